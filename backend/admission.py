@@ -0,0 +1,285 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Sequence
+
+BUDGETS = ("llm", "sql", "mongodb")
+
+
+class AdmissionRejected(Exception):
+    """A request turned away, ``status`` is 429 (rate limit) or 503 (overload)."""
+
+    def __init__(self, message: str, status: int, retry_after: float):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def payload(self) -> Dict[str, Any]:
+        return {"detail": str(self), "retry_after": round(self.retry_after, 2)}
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class Budget:
+    """Caps concurrent work on one path and bounds how long callers queue.
+
+    Callers past ``limit`` wait in FIFO order for at most ``max_wait``
+    seconds. The expected wait is estimated from the average time a slot is
+    held, and a caller that would not get a slot before its deadline is
+    rejected straight away instead of queueing for nothing. A limit of 0
+    disables the budget.
+    """
+
+    def __init__(self, name: str, limit: int, max_wait: float, on_wait: Optional[Callable[[float], None]] = None):
+        self.name = name
+        self.limit = limit
+        self.max_wait = max_wait
+        self.on_wait = on_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max(1, limit))
+        # Moving average of how long a slot is held, None until one is released
+        self._hold_time: Optional[float] = None
+        self._counters = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    def estimated_wait(self) -> float:
+        if self.in_flight < self.limit and not self.waiting:
+            return 0.0
+        if self._hold_time is None:
+            return 0.0
+        return (self.waiting + 1) * self._hold_time / self.limit
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        return AdmissionRejected(f"The {self.name} path is overloaded: {reason}", 503, retry_after)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self.limit <= 0:
+            yield
+            return
+        started = time.monotonic()
+        if self._semaphore.locked() or self.waiting:
+            estimate = self.estimated_wait()
+            if estimate > self.max_wait:
+                self._counters["rejected"] += 1
+                raise self._reject(f"estimated wait {estimate:.1f}s exceeds {self.max_wait:g}s", estimate)
+            self._counters["queued"] += 1
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self._counters["timed_out"] += 1
+                raise self._reject(
+                    f"no slot within {self.max_wait:g}s", self.estimated_wait() or self.max_wait
+                ) from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        acquired = time.monotonic()
+        if self.on_wait is not None:
+            self.on_wait(acquired - started)
+        self._counters["admitted"] += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            held = time.monotonic() - acquired
+            self._hold_time = held if self._hold_time is None else 0.8 * self._hold_time + 0.2 * held
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "max_wait": self.max_wait,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "avg_hold_ms": round(1000 * self._hold_time, 2) if self._hold_time is not None else None,
+            "estimated_wait_ms": round(1000 * self.estimated_wait(), 2),
+            **self._counters,
+        }
+
+
+class RateLimiter:
+    """Token bucket per client, ``rate`` tokens a second up to ``burst``.
+
+    Only the ``max_clients`` most recently seen clients are tracked, one
+    that is dropped starts again with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters = {"allowed": 0, "limited": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, client: str, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens, returns 0 or the seconds until they are available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+            self._counters["allowed"] += 1
+        else:
+            wait = (cost - tokens) / self.rate
+            self._counters["limited"] += 1
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            **self._counters,
+        }
+
+
+class AdmissionController:
+    """Concurrency budgets for the LLM, SQL and Mongo paths plus per-client rate limits."""
+
+    def __init__(
+        self,
+        budgets: Dict[str, Budget],
+        rate_limiter: Optional[RateLimiter] = None,
+        client_header: Optional[str] = None,
+    ):
+        self.budgets = budgets
+        self.rate_limiter = rate_limiter
+        # Clients are keyed by peer address unless a trusted proxy sets this header
+        self.client_header = client_header.lower() if client_header else None
+
+    @classmethod
+    def from_env(cls, on_wait: Optional[Callable[[str, float], None]] = None) -> "AdmissionController":
+        # The LLM budget defaults to the client's own cap, so its semaphore never queues
+        defaults = {
+            "llm": (os.getenv("LLM_MAX_CONCURRENCY", "8"), "10"),
+            "sql": ("32", "5"),
+            "mongodb": ("64", "5"),
+        }
+        budgets = {}
+        for name, (limit, max_wait) in defaults.items():
+            prefix = f"ADMISSION_{name.upper()}"
+            budgets[name] = Budget(
+                name,
+                limit=int(os.getenv(f"{prefix}_CONCURRENCY", limit)),
+                max_wait=float(os.getenv(f"{prefix}_MAX_WAIT_SECONDS", max_wait)),
+                on_wait=(lambda seconds, name=name: on_wait(name, seconds)) if on_wait else None,
+            )
+        # Rate limiting is off unless a rate is configured
+        rate_limiter = RateLimiter(
+            rate=float(os.getenv("RATE_LIMIT_PER_SECOND", "0")),
+            burst=float(os.getenv("RATE_LIMIT_BURST", "20")),
+            max_clients=int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000")),
+        )
+        # Only set behind a proxy that overwrites or appends to this header,
+        # clients can put anything in it themselves
+        return cls(budgets, rate_limiter, client_header=os.getenv("RATE_LIMIT_CLIENT_HEADER") or None)
+
+    def slot(self, name: str):
+        budget = self.budgets.get(name)
+        return budget.slot() if budget is not None else nullcontext()
+
+    async def acquire(self, name: str) -> AsyncExitStack:
+        """Take a slot that outlives the caller, for work handed to a stream.
+
+        The slot is released by closing the returned stack, see ``release_after``.
+        """
+        stack = AsyncExitStack()
+        await stack.enter_async_context(self.slot(name))
+        return stack
+
+    def client_key(self, scope: Dict[str, Any]) -> str:
+        if self.client_header is not None:
+            values = [value.decode("latin-1") for key, value in scope.get("headers", [])
+                      if key.decode("latin-1").lower() == self.client_header]
+            if values:
+                # The last entry is the one the trusted proxy added (X-Forwarded-For style)
+                last = values[-1].split(",")[-1].strip()
+                if last:
+                    return last
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def check_rate(self, client: str):
+        if self.rate_limiter is None or not self.rate_limiter.enabled:
+            return
+        wait = self.rate_limiter.take(client)
+        if wait:
+            raise AdmissionRejected(f"Rate limit exceeded for client {client}", 429, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budgets": {name: budget.stats() for name, budget in self.budgets.items()},
+            "rate_limit": self.rate_limiter.stats() if self.rate_limiter else None,
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying per-client rate limits.
+
+    Only requests whose method is in ``methods`` and whose path starts with
+    one of ``prefixes`` (but none of ``exempt``) spend tokens, so polling
+    and admin endpoints stay free.
+    """
+
+    def __init__(self, app, controller: AdmissionController, prefixes: Sequence[str] = ("/api/",),
+                 exempt: Sequence[str] = ("/api/admin/",), methods: Sequence[str] = ("POST",)):
+        self.app = app
+        self.controller = controller
+        self.prefixes = tuple(prefixes)
+        self.exempt = tuple(exempt)
+        self.methods = tuple(methods)
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if (
+            scope["type"] == "http"
+            and scope.get("method") in self.methods
+            and path.startswith(self.prefixes)
+            and not path.startswith(self.exempt)
+        ):
+            try:
+                self.controller.check_rate(self.controller.client_key(scope))
+            except AdmissionRejected as e:
+                await send_rejection(send, e)
+                return
+        await self.app(scope, receive, send)
+
+
+async def release_after(stream: AsyncIterator[Any], slot: AsyncExitStack) -> AsyncIterator[Any]:
+    """Yield from ``stream``, releasing ``slot`` once it is exhausted or closed."""
+    try:
+        async for item in stream:
+            yield item
+    finally:
+        await slot.aclose()
+
+
+async def send_rejection(send, error: AdmissionRejected):
+    body = json.dumps(error.payload()).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": error.status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", error.headers()["Retry-After"].encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
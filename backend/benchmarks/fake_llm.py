@@ -0,0 +1,120 @@
+"""Local OpenAI-compatible chat completions server for benchmarks.
+
+Answers every request with a canned QUERY|||EXPLANATION|||OPTIMIZATION
+completion after a configurable latency, and streams it at a configurable
+token rate when ``stream`` is set.
+"""
+import argparse
+import asyncio
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from aiohttp import web
+
+SQL_TABLES = ("customers", "products", "orders", "order_items")
+MONGO_COLLECTIONS = ("users", "events", "sessions")
+
+
+@dataclass
+class FakeLLMConfig:
+    latency: float = 0.2
+    tokens_per_second: float = 200.0
+    error_rate: float = 0.0
+    # Errors are 429s with this Retry-After, other statuses get a plain-text body
+    error_status: int = 429
+    retry_after: str = "0"
+
+
+@dataclass
+class FakeLLMState:
+    requests: int = 0
+    streams: int = 0
+    questions: Dict[str, int] = field(default_factory=dict)
+
+
+def _completion_for(question: str) -> str:
+    words = set(re.findall(r"[a-z_]+", question.lower()))
+    if "mongodb" in words:
+        collection = next((c for c in MONGO_COLLECTIONS if c in words or c.rstrip("s") in words), "users")
+        query = json.dumps({"find": collection, "filter": {}, "projection": {"_id": 0}})
+    else:
+        table = next((t for t in SQL_TABLES if t in words or t.rstrip("s") in words), "customers")
+        query = f"SELECT * FROM {table} LIMIT 10"
+    return f"{query}|||Returns rows from the requested data.|||Add an index on the filtered columns."
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def create_app(config: FakeLLMConfig, state: FakeLLMState) -> web.Application:
+    error_counter = {"n": 0}
+
+    async def completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        state.requests += 1
+        question = body["messages"][-1]["content"]
+        state.questions[question] = state.questions.get(question, 0) + 1
+
+        if config.error_rate:
+            error_counter["n"] += 1
+            if error_counter["n"] * config.error_rate >= 1:
+                error_counter["n"] = 0
+                if config.error_status == 429:
+                    return web.Response(status=429, headers={"Retry-After": config.retry_after}, text="rate limited")
+                return web.Response(status=config.error_status, text=f"<html><body>{config.error_status}</body></html>")
+
+        await asyncio.sleep(config.latency)
+        content = _completion_for(question)
+        tokens = _tokens(content)
+        usage = {"prompt_tokens": len(body["messages"][0]["content"].split()), "completion_tokens": len(tokens)}
+
+        if not body.get("stream"):
+            if config.tokens_per_second:
+                await asyncio.sleep(len(tokens) / config.tokens_per_second)
+            return web.json_response({
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+        state.streams += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        delay = 1.0 / config.tokens_per_second if config.tokens_per_second else 0
+        for token in tokens:
+            chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            if delay:
+                await asyncio.sleep(delay)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_post("/openai/v1/chat/completions", completions)
+    return app
+
+
+async def start_fake_llm(config: FakeLLMConfig, host: str = "127.0.0.1", port: int = 0):
+    """Start the server in the running loop, returns (runner, base_url, state)."""
+    state = FakeLLMState()
+    runner = web.AppRunner(create_app(config, state))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}/v1", state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible completion server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=429)
+    args = parser.parse_args()
+    config = FakeLLMConfig(args.latency, args.tokens_per_second, args.error_rate, args.error_status)
+    web.run_app(create_app(config, FakeLLMState()), port=args.port)
@@ -0,0 +1,241 @@
+"""End-to-end load test for the API with local stand-ins for every backend.
+
+By default the app is imported in-process with SQL on a throwaway SQLite
+file, MongoDB on mongomock-motor and the LLM on benchmarks.fake_llm, seeded
+with a synthetic dataset of the chosen scale. Each endpoint is then driven
+at the given concurrency and throughput and p50/p95/p99 are reported per
+endpoint. Results can be saved as a baseline and later runs compared
+against it, failing when an endpoint regressed by more than --threshold.
+
+    python -m benchmarks.load_test --scale small --requests 500 --save baseline.json
+    python -m benchmarks.load_test --scale small --requests 500 --compare baseline.json
+
+Pass --target http://host:8001 to drive a running deployment instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.fake_llm import MONGO_COLLECTIONS, SQL_TABLES, FakeLLMConfig, start_fake_llm
+from benchmarks.stats import summarize
+
+ENDPOINTS = ("convert", "execute_sql", "execute_mongo", "schema", "insights")
+
+SQL_QUERIES = [
+    "SELECT * FROM customers WHERE country = 'India' LIMIT 50",
+    "SELECT c.name, SUM(o.total_amount) AS revenue FROM customers c JOIN orders o ON o.customer_id = c.customer_id "
+    "GROUP BY c.customer_id ORDER BY revenue DESC LIMIT 10",
+    "SELECT category, COUNT(*) AS products, AVG(price) AS avg_price FROM products GROUP BY category",
+    "SELECT status, COUNT(*) FROM orders GROUP BY status",
+    "SELECT * FROM orders WHERE order_id = 42",
+]
+MONGO_QUERIES = [
+    ({"find": "users", "filter": {"country": "India"}, "projection": {"_id": 0}}, "users"),
+    ({"find": "users", "filter": {"age": {"$gt": 30}}, "projection": {"_id": 0}}, "users"),
+    ({"aggregate": "events", "pipeline": [{"$group": {"_id": "$event_type", "count": {"$sum": 1}}}]}, "events"),
+    ({"find": "sessions", "filter": {"duration_minutes": {"$gte": 60}}, "projection": {"_id": 0}}, "sessions"),
+]
+
+Request = Tuple[str, str, Optional[Dict[str, Any]]]
+
+
+def question_pool(size: int) -> List[Tuple[str, str]]:
+    pool = []
+    for i in range(size):
+        if i % 3 == 2:
+            collection = MONGO_COLLECTIONS[i % len(MONGO_COLLECTIONS)]
+            pool.append((f"MongoDB: list {collection} matching segment {i}", "mongodb"))
+        else:
+            table = SQL_TABLES[i % len(SQL_TABLES)]
+            pool.append((f"Show {table} for segment {i}", "sql"))
+    return pool
+
+
+def build_workload(endpoint: str, count: int, questions: int, rng: random.Random) -> List[Request]:
+    if endpoint == "convert":
+        pool = question_pool(questions)
+        picks = rng.choices(pool, k=count)
+        return [("POST", "/api/convert-query", {"query": q, "db_type": t}) for q, t in picks]
+    if endpoint == "execute_sql":
+        return [("POST", "/api/execute-query", {"query": rng.choice(SQL_QUERIES), "db_type": "sql"})
+                for _ in range(count)]
+    if endpoint == "execute_mongo":
+        picks = rng.choices(MONGO_QUERIES, k=count)
+        return [("POST", "/api/execute-query", {"query": json.dumps(q), "db_type": "mongodb", "collection_name": c})
+                for q, c in picks]
+    if endpoint == "schema":
+        names = [("sql", t) for t in SQL_TABLES] + [("mongodb", c) for c in MONGO_COLLECTIONS]
+        return [("GET", "/api/schema/%s/%s" % rng.choice(names), None) for _ in range(count)]
+    if endpoint == "insights":
+        return [("GET", f"/api/insights?bucket={rng.choice(['all', 'day', 'hour'])}", None) for _ in range(count)]
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+async def drive(client: httpx.AsyncClient, workload: List[Request], concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+    rejected = 0
+
+    async def one(method: str, path: str, body: Optional[Dict[str, Any]]):
+        nonlocal errors, rejected
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                ok = response.status_code < 400 and response.json().get("success", True)
+                # Shed by admission control (rate limit or overload), also counted as errors
+                rejected += response.status_code in (429, 503)
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(*request) for request in workload])
+    elapsed = time.perf_counter() - started
+    return {**summarize(latencies, elapsed), "errors": errors, "rejected": rejected}
+
+
+async def start_local_app(scale: str, workdir: str, llm_config: FakeLLMConfig):
+    """Import main against the stand-ins, returns (app module, cleanup)."""
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    runner, base_url, _ = await start_fake_llm(llm_config)
+    os.environ.update({
+        "MONGO_URL": "mongodb://stand-in",
+        "DB_NAME": "datawhiz_bench",
+        "SQL_DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LLM_BASE_URL": base_url,
+        "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "bench"),
+        # The in-process Mongo stand-in has no change streams
+        "RESULT_CACHE_CHANGE_STREAMS": "false",
+    })
+    # main and the datasources build Motor clients, hand them the in-process one
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    import main
+
+    from seeder import scale_sizes, seed_mongo, seed_sql
+
+    sizes = scale_sizes(scale)
+    await asyncio.to_thread(seed_sql, main.datasources.get("sql").engine, sizes)
+    await seed_mongo(main.datasources.get("mongodb").db, sizes)
+    await main.startup_db()
+    for source in main.datasources.active():
+        await source.catalog.refresh()
+
+    async def cleanup():
+        await main.shutdown_db_client()
+        await runner.cleanup()
+
+    return main, cleanup
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    for endpoint, result in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if before[metric] and result[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{endpoint} {metric}: {before[metric]} -> {result[metric]}")
+        if before["throughput_rps"] and result["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{endpoint} throughput_rps: {before['throughput_rps']} -> {result['throughput_rps']}")
+        if result["errors"] > before.get("errors", 0):
+            regressions.append(f"{endpoint} errors: {before.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    cleanup: Optional[Callable] = None
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.target:
+            client = httpx.AsyncClient(base_url=args.target, timeout=args.timeout)
+        else:
+            config = FakeLLMConfig(latency=args.llm_latency, tokens_per_second=args.tokens_per_second)
+            app_module, cleanup = await start_local_app(args.scale, workdir, config)
+            transport = httpx.ASGITransport(app=app_module.app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout)
+
+        results = {}
+        try:
+            for endpoint in args.endpoints:
+                workload = build_workload(endpoint, args.requests, args.questions, rng)
+                if args.warmup:
+                    await drive(client, workload[:args.warmup], args.concurrency)
+                results[endpoint] = await drive(client, workload, args.concurrency)
+                print(f"{endpoint:>14}: {json.dumps(results[endpoint])}", file=sys.stderr)
+        finally:
+            await client.aclose()
+            if cleanup is not None:
+                await cleanup()
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "target": args.target or "local",
+        "scale": None if args.target else args.scale,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "environment": environment(),
+        "endpoints": results,
+    }
+
+
+def main():
+    from seeder import SCALES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="base URL of a running deployment, default runs in-process")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=300, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per endpoint")
+    parser.add_argument("--questions", type=int, default=50, help="distinct conversion questions")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to check the results against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
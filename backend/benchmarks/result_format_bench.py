@@ -0,0 +1,101 @@
+"""Serialization cost of execute-query results by response shape.
+
+Builds wide and tall result sets with the value types MySQL hands back
+(int, Decimal, date, datetime, str) and times the records response, with
+and without per-row ExecuteResponse validation, against the orjson-encoded
+columns and rows shapes. Speedups are relative to validated records.
+
+    python -m benchmarks.result_format_bench --repeat 5
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from result_format import encode_columnar
+
+
+class ExecuteResponse(BaseModel):
+    # Same fields as main.ExecuteResponse, without importing the app
+    success: bool
+    results: List[Dict[str, Any]]
+    row_count: int
+    error: Any = None
+    cost: Any = None
+
+
+def make_rows(rows: int, columns: int, seed: int = 1) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    makers = [
+        lambda i: i,
+        lambda i: Decimal(f"{rng.uniform(1, 10_000):.2f}"),
+        lambda i: (start + timedelta(days=i % 900)).date(),
+        lambda i: start + timedelta(seconds=rng.randrange(10**8)),
+        lambda i: f"value {rng.randrange(10**6)}",
+    ]
+    names = [f"col_{c}" for c in range(columns)]
+    return [{name: makers[c % len(makers)](i) for c, name in enumerate(names)} for i in range(rows)]
+
+
+def records_validated(rows: List[Dict[str, Any]]) -> bytes:
+    response = ExecuteResponse(success=True, results=rows, row_count=len(rows))
+    return JSONResponse(response.model_dump(mode="json")).body
+
+
+def records(rows: List[Dict[str, Any]]) -> bytes:
+    response = ExecuteResponse.model_construct(success=True, results=rows, row_count=len(rows))
+    return JSONResponse(response.model_dump(mode="json")).body
+
+
+def shaped(shape: str) -> Callable[[List[Dict[str, Any]]], bytes]:
+    def encode(rows: List[Dict[str, Any]]) -> bytes:
+        return encode_columnar({"success": True, "results": rows, "row_count": len(rows)}, shape)
+    return encode
+
+
+def measure(fn: Callable[[List[Dict[str, Any]]], bytes], rows: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn(rows)
+        timings.append(time.perf_counter() - started)
+    return {"best_ms": round(1000 * min(timings), 2), "bytes": len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tall-rows", type=int, default=50_000)
+    parser.add_argument("--wide-rows", type=int, default=2_000)
+    parser.add_argument("--wide-columns", type=int, default=100)
+    args = parser.parse_args()
+
+    cases = {
+        "tall": make_rows(args.tall_rows, 5),
+        "wide": make_rows(args.wide_rows, args.wide_columns),
+    }
+    encoders = {
+        "records_validated": records_validated,
+        "records": records,
+        "columns": shaped("columns"),
+        "rows": shaped("rows"),
+    }
+    results = {}
+    for case, rows in cases.items():
+        results[case] = {name: measure(fn, rows, args.repeat) for name, fn in encoders.items()}
+        baseline = results[case]["records_validated"]["best_ms"]
+        for name in ("records", "columns", "rows"):
+            current = results[case][name]["best_ms"]
+            results[case][name]["speedup"] = round(baseline / current, 2) if current else None
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
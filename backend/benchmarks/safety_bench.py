@@ -0,0 +1,166 @@
+"""Query safety checks: the old keyword scans against query_safety.
+
+Times the old per-keyword regex and substring checks (plus the cleanup
+regexes and character-loop JSON extraction the execute path ran before
+them) against the single-pass analyzer, on short and long generated
+queries. The analyzer is timed uncached, a repeated query is a cache hit.
+Cases where the two disagree are listed after the timings.
+
+    python -m benchmarks.safety_bench --repeat 5
+"""
+import argparse
+import json
+import re
+import time
+from typing import Any, Callable, Dict, List
+
+from query_safety import analyze_mongo, analyze_sql, clean_sql, parse_mongo
+
+
+# Same as the old checks in main, without importing the app
+
+def legacy_prepare_sql(raw_query: str) -> str:
+    query_str = re.sub(r'(?i)(QUERY:|FINAL RESPONSE:|EXPLANATION:|OPTIMIZATION:)', '', raw_query)
+    query_str = re.sub(r'```sql|```|`', '', query_str, flags=re.IGNORECASE).strip()
+    return next((line.strip() for line in query_str.splitlines() if line.strip()), "")
+
+
+def legacy_is_safe_sql(query: str) -> bool:
+    query_lower = query.lower().strip()
+    destructive_keywords = [
+        r'\bdrop\b', r'\bdelete\b', r'\btruncate\b', r'\bupdate\b',
+        r'\binsert\b', r'\balter\b', r'\bcreate\b', r'\breplace\b',
+        r'\bgrant\b', r'\brevoke\b'
+    ]
+    for keyword in destructive_keywords:
+        if re.search(keyword, query_lower):
+            return False
+    return True
+
+
+def legacy_extract_first_json(text: str) -> dict:
+    stack = []
+    start_idx = None
+    for idx, char in enumerate(text):
+        if char == '{':
+            if start_idx is None:
+                start_idx = idx
+            stack.append('{')
+        elif char == '}':
+            if stack:
+                stack.pop()
+                if not stack and start_idx is not None:
+                    return json.loads(text[start_idx:idx + 1])
+    raise ValueError("No valid JSON found in text")
+
+
+def legacy_is_safe_mongo(query_str: str) -> bool:
+    query_lower = query_str.lower()
+    for keyword in ['drop', 'remove', 'delete', 'bulkwrite', 'update', 'insert', 'replace', '$where']:
+        if keyword in query_lower:
+            return False
+    return True
+
+
+def legacy_sql(raw_query: str) -> bool:
+    return legacy_is_safe_sql(legacy_prepare_sql(raw_query))
+
+
+def legacy_mongo(raw_query: str) -> bool:
+    query_str = re.sub(r"```json|```", "", raw_query.strip(), flags=re.IGNORECASE | re.DOTALL)
+    query_str = re.sub(r"(?i)query:|explanation:|optimization:", "", query_str).strip()
+    legacy_extract_first_json(query_str)
+    return legacy_is_safe_mongo(query_str)
+
+
+def analyzer_sql(raw_query: str) -> bool:
+    sql = next((line.strip() for line in clean_sql(raw_query).splitlines() if line.strip()), "")
+    return analyze_sql.__wrapped__(sql).safe
+
+
+def analyzer_mongo(raw_query: str) -> bool:
+    return analyze_mongo(parse_mongo(raw_query)).safe
+
+
+def long_sql(columns: int) -> str:
+    select = ", ".join(f"o.col_{i} AS alias_{i}" for i in range(columns))
+    where = " AND ".join(f"o.col_{i} <> 'value {i}'" for i in range(columns))
+    return (
+        f"```sql\nSELECT {select} FROM orders o JOIN customers c ON c.customer_id = o.customer_id "
+        f"WHERE {where} ORDER BY o.order_date DESC LIMIT 100\n```"
+    )
+
+
+def long_mongo(stages: int) -> str:
+    pipeline = [{"$match": {f"field_{i}": {"$gte": i, "$lt": i * 2}}} for i in range(stages)]
+    pipeline += [{"$lookup": {"from": "customers", "localField": "c", "foreignField": "_id", "as": "c"}},
+                 {"$limit": 100}]
+    return f"```json\n{json.dumps({'aggregate': 'orders', 'pipeline': pipeline})}\n```"
+
+
+CASES = {
+    "sql_short": ("sql", "SELECT name, email FROM customers WHERE country = 'US' LIMIT 10"),
+    "sql_long": ("sql", long_sql(200)),
+    "mongo_short": ("mongodb", '{"find": "customers", "filter": {"country": "US"}, "limit": 10}'),
+    "mongo_long": ("mongodb", long_mongo(200)),
+}
+# Inputs where the old checks give the wrong answer
+DISAGREEMENTS = [
+    ("sql", "SELECT * FROM audit_log WHERE action = 'delete'"),
+    ("sql", "SELECT * FROM tickets WHERE note = 'please update my address'"),
+    ("sql", "SELECT REPLACE(name, '-', ' ') FROM products"),
+    ("sql", "/*!50000DROP TABLE orders*/ SELECT 1"),
+    ("sql", "SELECT 1; SHOW GRANTS"),
+    ("sql", "SELECT SLEEP(60)"),
+    ("sql", "SELECT * FROM customers INTO OUTFILE '/tmp/customers.csv'"),
+    ("mongodb", '{"find": "orders", "filter": {"status": "updated"}}'),
+    ("mongodb", '{"aggregate": "orders", "pipeline": [{"$out": "orders_copy"}]}'),
+    ("mongodb", '{"aggregate": "orders", "pipeline": [{"$merge": {"into": "totals"}}]}'),
+]
+
+
+def measure(fn: Callable[[str], bool], query: str, repeat: int, loops: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn(query)
+        timings.append((time.perf_counter() - started) / loops)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--loops", type=int, default=200)
+    args = parser.parse_args()
+
+    checks = {"sql": (legacy_sql, analyzer_sql), "mongodb": (legacy_mongo, analyzer_mongo)}
+    results: Dict[str, Any] = {}
+    for case, (db_type, query) in CASES.items():
+        legacy, analyzer = checks[db_type]
+        old = measure(legacy, query, args.repeat, args.loops)
+        new = measure(analyzer, query, args.repeat, args.loops)
+        results[case] = {
+            "chars": len(query),
+            "legacy_us": round(1e6 * old, 2),
+            "analyzer_us": round(1e6 * new, 2),
+            "speedup": round(old / new, 2) if new else None,
+        }
+
+    disagreements: List[Dict[str, Any]] = []
+    for db_type, query in DISAGREEMENTS:
+        legacy, analyzer = checks[db_type]
+        verdict = analyze_sql(query) if db_type == "sql" else analyze_mongo(parse_mongo(query))
+        disagreements.append({
+            "query": query,
+            "legacy_safe": legacy(query),
+            "analyzer_safe": analyzer(query),
+            "reason": verdict.reason,
+        })
+    results["disagreements"] = disagreements
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
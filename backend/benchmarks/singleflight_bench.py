@@ -0,0 +1,79 @@
+"""Upstream calls and latency for duplicate-heavy conversion load.
+
+Fires bursts of conversion requests drawn from a small set of questions at
+a fake completion server, once calling the LLM for every request and once
+through SingleFlight, and prints both results side by side.
+
+    python -m benchmarks.singleflight_bench --requests 400 --questions 10
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from llm_client import LLMClient
+from query_cache import normalize_question
+from singleflight import SingleFlight
+
+from benchmarks.fake_llm import FakeLLMConfig, start_fake_llm
+from benchmarks.stats import summarize
+
+
+async def run(requests: int, questions: int, concurrency: int, llm_concurrency: int, use_single_flight: bool,
+              config: FakeLLMConfig, seed: int):
+    runner, base_url, state = await start_fake_llm(config)
+    client = LLMClient(api_key="bench", model="bench", base_url=base_url,
+                       max_concurrency=llm_concurrency, max_connections=llm_concurrency)
+    await client.start()
+    flight = SingleFlight()
+    rng = random.Random(seed)
+    # Skewed towards a few hot questions, like a dashboard loading
+    pool = [f"Show top customers by revenue for segment {i}" for i in range(questions)]
+    weights = [1 / (i + 1) for i in range(questions)]
+    workload = rng.choices(pool, weights=weights, k=requests)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def convert(question: str):
+        messages = [{"role": "system", "content": "bench"}, {"role": "user", "content": question}]
+        return await client.chat(messages)
+
+    async def one(question: str):
+        async with semaphore:
+            started = time.perf_counter()
+            if use_single_flight:
+                key = (normalize_question(question), "sql")
+                await flight.do(key, lambda: convert(question))
+            else:
+                await convert(question)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(q) for q in workload])
+    elapsed = time.perf_counter() - started
+    await client.close()
+    await runner.cleanup()
+    return {"single_flight": use_single_flight, "upstream_calls": state.requests, **summarize(latencies, elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="LLMClient in-flight cap")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    config = FakeLLMConfig(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    results = [
+        asyncio.run(run(args.requests, args.questions, args.concurrency, args.llm_concurrency, mode, config, args.seed))
+        for mode in (False, True)
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+from typing import Dict, List
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(1000 * percentile(samples, 50), 2),
+        "p95_ms": round(1000 * percentile(samples, 95), 2),
+        "p99_ms": round(1000 * percentile(samples, 99), 2),
+    }
@@ -0,0 +1,216 @@
+import copy
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from query_safety import analyze_sql, needs_full_read, strip_trailing
+
+logger = logging.getLogger(__name__)
+
+_TABLE_REF = re.compile(r"(?:\bfrom|\bjoin|,)\s*([A-Za-z_]\w*)(?:\s+(?:as\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+_NOT_ALIAS = {
+    "where", "join", "inner", "left", "right", "full", "cross", "outer", "on", "using", "group",
+    "order", "limit", "having", "union", "natural", "as",
+}
+
+
+def has_limit(sql: str) -> bool:
+    return analyze_sql(sql).has_limit
+
+
+def add_limit(sql: str, limit: int) -> str:
+    return f"{strip_trailing(sql)} LIMIT {int(limit)}"
+
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """Map every table name and alias in FROM/JOIN clauses to its table."""
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        aliases[table] = table
+        if alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias] = table
+    return aliases
+
+
+class CostGuard:
+    """Pre-execution cost check between the safety check and execution.
+
+    SQL queries are run through EXPLAIN. Queries whose estimated row count is
+    over ``max_rows`` and that a LIMIT would not bound are blocked, and
+    unbounded queries get a LIMIT appended. Mongo queries get a server-side
+    time cap and a trailing ``$limit``.
+    """
+
+    def __init__(
+        self,
+        sql_executor=None,
+        schema_catalog=None,
+        enabled: bool = True,
+        max_rows: int = 10_000_000,
+        limit_threshold: int = 1000,
+        default_limit: int = 1000,
+        mongo_max_time_ms: int = 10_000,
+        mongo_default_limit: int = 1000,
+    ):
+        self.sql_executor = sql_executor
+        self.schema_catalog = schema_catalog
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.limit_threshold = limit_threshold
+        self.default_limit = default_limit
+        self.mongo_max_time_ms = mongo_max_time_ms
+        self.mongo_default_limit = mongo_default_limit
+        self._counters = {"checked": 0, "blocked": 0, "rewritten": 0, "explain_errors": 0}
+
+    @classmethod
+    def from_env(cls, sql_executor=None, schema_catalog=None) -> "CostGuard":
+        return cls(
+            sql_executor=sql_executor,
+            schema_catalog=schema_catalog,
+            enabled=os.getenv("COST_GUARD_ENABLED", "true").lower() in ("1", "true", "yes"),
+            max_rows=int(os.getenv("COST_GUARD_MAX_ROWS", "10000000")),
+            limit_threshold=int(os.getenv("COST_GUARD_LIMIT_THRESHOLD", "1000")),
+            default_limit=int(os.getenv("COST_GUARD_DEFAULT_LIMIT", "1000")),
+            mongo_max_time_ms=int(os.getenv("COST_GUARD_MONGO_MAX_TIME_MS", "10000")),
+            mongo_default_limit=int(os.getenv("COST_GUARD_MONGO_DEFAULT_LIMIT", "1000")),
+        )
+
+    # -- SQL --------------------------------------------------------------
+
+    async def explain(self, sql: str) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+        """Estimated rows and the per-table scans for ``sql``, without running it."""
+        dialect = self.sql_executor.dialect
+        if dialect == "mysql":
+            plan = await self.sql_executor.fetch_all(f"EXPLAIN {sql}")
+            return self._estimate_mysql(plan)
+        if dialect == "postgresql":
+            plan = await self.sql_executor.fetch_all(f"EXPLAIN (FORMAT JSON) {sql}")
+            return self._estimate_postgres(plan)
+        if dialect == "sqlite":
+            plan = await self.sql_executor.fetch_all(f"EXPLAIN QUERY PLAN {sql}")
+            return self._estimate_sqlite(sql, plan)
+        return None, []
+
+    @staticmethod
+    def _estimate_mysql(plan: List[Dict[str, Any]]) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+        per_select: Dict[Any, float] = {}
+        scans = []
+        for row in plan:
+            rows = float(row.get("rows") or 1)
+            filtered = float(row.get("filtered") or 100) / 100
+            # Rows within one SELECT are joined, so their estimates multiply
+            per_select[row.get("id")] = per_select.get(row.get("id"), 1.0) * max(1.0, rows * filtered)
+            scans.append({"table": row.get("table"), "scan": row.get("type"), "key": row.get("key"), "rows": int(rows)})
+        return (int(max(per_select.values())) if per_select else None), scans
+
+    @staticmethod
+    def _estimate_postgres(plan: List[Dict[str, Any]]) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+        doc = next(iter(plan[0].values())) if plan else None
+        if not doc:
+            return None, []
+        root = doc[0]["Plan"]
+        scans = []
+
+        def visit(node):
+            if "Relation Name" in node:
+                scans.append({"table": node["Relation Name"], "scan": node["Node Type"],
+                              "key": node.get("Index Name"), "rows": int(node.get("Plan Rows", 0))})
+            for child in node.get("Plans", []):
+                visit(child)
+
+        visit(root)
+        return int(root.get("Plan Rows", 0)), scans
+
+    def _estimate_sqlite(self, sql: str, plan: List[Dict[str, Any]]) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+        # SQLite has no row estimates, use the catalog's table sizes instead.
+        # The plan names tables by alias, so map those back first.
+        aliases = table_aliases(sql)
+        estimate = 1
+        scans = []
+        for row in plan:
+            detail = str(row.get("detail", ""))
+            match = re.match(r"(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)", detail)
+            if not match:
+                continue
+            kind, table = match.group(1), aliases.get(match.group(2), match.group(2))
+            entry = self.schema_catalog.cached("sql", table) if self.schema_catalog else None
+            table_rows = int(entry["row_estimate"] or 0) if entry else 0
+            rows = table_rows if kind == "SCAN" else max(1, table_rows // 10)
+            estimate *= max(1, rows)
+            scans.append({"table": table, "scan": "ALL" if kind == "SCAN" else "index", "key": None, "rows": rows})
+        return (estimate if scans else None), scans
+
+    async def check_sql(self, sql: str) -> Dict[str, Any]:
+        report: Dict[str, Any] = {
+            "action": "allowed",
+            "reasons": [],
+            "estimated_rows": None,
+            "scans": [],
+            "query": sql,
+        }
+        if not self.enabled or self.sql_executor is None or analyze_sql(sql).statement not in ("select", "with"):
+            return report
+
+        self._counters["checked"] += 1
+        try:
+            estimate, scans = await self.explain(sql)
+        except Exception as e:
+            # A query EXPLAIN can't handle will fail the same way when run
+            self._counters["explain_errors"] += 1
+            logger.warning(f"EXPLAIN failed, skipping cost guard: {e}")
+            report["reasons"].append(f"EXPLAIN failed: {e}")
+            return report
+        report["estimated_rows"] = estimate
+        report["scans"] = scans
+        full_scans = [s["table"] for s in scans if str(s["scan"]).upper() in ("ALL", "SEQ SCAN")]
+
+        bounded = has_limit(sql)
+        if not bounded and (estimate is None or estimate > self.limit_threshold):
+            report["query"] = add_limit(sql, self.default_limit)
+            report["action"] = "rewritten"
+            report["reasons"].append(f"No LIMIT clause, added LIMIT {self.default_limit}")
+            bounded = True
+
+        if estimate is not None and estimate > self.max_rows and (not bounded or needs_full_read(sql)):
+            report["action"] = "blocked"
+            reason = f"Estimated {estimate:,} rows exceeds the limit of {self.max_rows:,}"
+            if full_scans:
+                reason += f" (full scan of {', '.join(full_scans)})"
+            report["reasons"] = [reason]
+            report["query"] = sql
+
+        if report["action"] == "blocked":
+            self._counters["blocked"] += 1
+        elif report["action"] == "rewritten":
+            self._counters["rewritten"] += 1
+        return report
+
+    # -- Mongo ------------------------------------------------------------
+
+    def guard_mongo(self, query_obj: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        report: Dict[str, Any] = {"action": "allowed", "reasons": [], "max_time_ms": None}
+        if not self.enabled:
+            return query_obj, report
+
+        self._counters["checked"] += 1
+        report["max_time_ms"] = self.mongo_max_time_ms
+        if "aggregate" in query_obj:
+            pipeline = query_obj.get("pipeline", [])
+            if not pipeline or "$limit" not in pipeline[-1]:
+                query_obj = copy.copy(query_obj)
+                query_obj["pipeline"] = list(pipeline) + [{"$limit": self.mongo_default_limit}]
+                report["action"] = "rewritten"
+                report["reasons"].append(f"Added trailing $limit of {self.mongo_default_limit}")
+                self._counters["rewritten"] += 1
+        return query_obj, report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_rows": self.max_rows,
+            "limit_threshold": self.limit_threshold,
+            "default_limit": self.default_limit,
+            "mongo_max_time_ms": self.mongo_max_time_ms,
+            **self._counters,
+        }
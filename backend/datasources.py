@@ -0,0 +1,400 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from cost_guard import CostGuard
+from pipeline_optimizer import PipelineOptimizer
+from schema_catalog import SchemaCatalog
+from sql_executor import SQLExecutor, create_sql_engine
+
+logger = logging.getLogger(__name__)
+
+DB_TYPES = ("sql", "mongodb")
+
+
+class DataSourceError(Exception):
+    pass
+
+
+class _PoolListener(monitoring.ConnectionPoolListener):
+    """Counts Motor/PyMongo pool connections, which the driver doesn't expose."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.check_out_failures = 0
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failures += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+class DataSource:
+    """One named database the app can query, created on first use."""
+
+    db_type = ""
+
+    def __init__(self, name: str, config: Dict[str, Any]):
+        self.name = name
+        self.config = config
+        self.idle_timeout = float(config.get("idle_timeout", os.getenv("DATASOURCE_IDLE_SECONDS", "900")))
+        # Sources are treated as production, where nothing may change the schema, unless marked otherwise
+        self.production = str(config.get("production", os.getenv("DATASOURCE_PRODUCTION", "true"))).lower() in (
+            "1", "true", "yes"
+        )
+        # Seconds results of this source stay in the result cache, None for the default and 0 to not cache
+        ttl = config.get("result_cache_ttl")
+        self.result_cache_ttl = float(ttl) if ttl is not None else None
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.catalog: Optional[SchemaCatalog] = None
+        self.cost_guard: Optional[CostGuard] = None
+        self.last_health: Optional[Dict[str, Any]] = None
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_used
+
+    def evictable(self) -> bool:
+        return self.in_use == 0 and self.idle_timeout > 0 and self.idle_seconds() > self.idle_timeout
+
+    def _catalog(self, **backend: Any) -> SchemaCatalog:
+        return SchemaCatalog(
+            **backend,
+            refresh_interval=float(self.config.get(
+                "schema_refresh_seconds", os.getenv("SCHEMA_REFRESH_SECONDS", "300")
+            )),
+            mongo_sample_size=int(os.getenv("SCHEMA_MONGO_SAMPLE_SIZE", "200")),
+            exclude_collections=self.config.get("exclude_collections"),
+            miss_refresh_interval=float(os.getenv("SCHEMA_MISS_REFRESH_SECONDS", "30")),
+        )
+
+    async def ping(self):
+        raise NotImplementedError
+
+    async def health(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            await self.ping()
+            self.last_health = {"ok": True}
+        except Exception as e:
+            self.last_health = {"ok": False, "error": str(e)}
+        self.last_health.update(latency_ms=round(1000 * (time.perf_counter() - started), 2), checked_at=time.time())
+        return self.last_health
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return {}
+
+    async def close(self):
+        if self.catalog is not None:
+            await self.catalog.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "type": self.db_type,
+            "active": True,
+            "production": self.production,
+            "in_use": self.in_use,
+            "idle_seconds": round(self.idle_seconds(), 1),
+            "idle_timeout": self.idle_timeout,
+            "created_at": self.created_at,
+            "health": self.last_health,
+            "pool": self.pool_stats(),
+        }
+
+
+class SQLDataSource(DataSource):
+    db_type = "sql"
+
+    def __init__(self, name: str, config: Dict[str, Any]):
+        super().__init__(name, config)
+        overrides = {
+            key: config[key]
+            for key in ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping")
+            if key in config
+        }
+        self.engine = create_sql_engine(config["url"], **overrides)
+        workers = config.get("workers", os.getenv("SQL_EXECUTOR_WORKERS"))
+        self.executor = SQLExecutor(
+            self.engine,
+            max_workers=int(workers) if workers else None,
+            statement_timeout=float(config.get(
+                "statement_timeout", os.getenv("SQL_STATEMENT_TIMEOUT_SECONDS", "30")
+            )),
+        )
+        self.catalog = self._catalog(sql_executor=self.executor)
+        self.cost_guard = CostGuard.from_env(sql_executor=self.executor, schema_catalog=self.catalog)
+
+    async def ping(self):
+        def select_one():
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql("SELECT 1")
+        await self.executor.run(select_one)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        pool = self.executor.stats()["pool"]
+        capacity = pool.get("size", 0) + max(0, getattr(self.engine.pool, "_max_overflow", 0))
+        checked_out = pool.get("checkedout", 0)
+        return {
+            **pool,
+            "capacity": capacity,
+            "utilization": round(checked_out / capacity, 3) if capacity else None,
+        }
+
+    async def close(self):
+        await super().close()
+        self.executor.shutdown()
+        self.engine.dispose()
+
+
+class MongoDataSource(DataSource):
+    db_type = "mongodb"
+
+    def __init__(self, name: str, config: Dict[str, Any]):
+        super().__init__(name, config)
+        self.max_pool_size = int(config.get("max_pool_size", os.getenv("MONGO_MAX_POOL_SIZE", "100")))
+        self.listener = _PoolListener()
+        self.client = AsyncIOMotorClient(
+            config["url"],
+            maxPoolSize=self.max_pool_size,
+            minPoolSize=int(config.get("min_pool_size", 0)),
+            maxIdleTimeMS=int(config.get("max_idle_time_ms", 300_000)),
+            serverSelectionTimeoutMS=int(config.get("server_selection_timeout_ms", 30_000)),
+            event_listeners=[self.listener],
+        )
+        self.db = self.client[config["database"]]
+        self.catalog = self._catalog(mongo_db=self.db)
+        self.cost_guard = CostGuard.from_env(schema_catalog=self.catalog)
+        self.optimizer = PipelineOptimizer.from_env(schema_catalog=self.catalog)
+
+    async def ping(self):
+        await self.db.command("ping")
+
+    async def kill_operations(self, comment: str) -> int:
+        """killOp every operation tagged with ``comment``, getMores included."""
+        admin = self.client.admin
+        pipeline = [
+            {"$currentOp": {}},
+            {"$match": {"$or": [
+                {"command.comment": comment}, {"cursor.originatingCommand.comment": comment},
+            ]}},
+        ]
+        killed = 0
+        async for op in admin.aggregate(pipeline):
+            await admin.command("killOp", op=op["opid"])
+            killed += 1
+        return killed
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return {
+            "max_pool_size": self.max_pool_size,
+            "open": self.listener.open,
+            "checked_out": self.listener.checked_out,
+            "check_out_failures": self.listener.check_out_failures,
+            "utilization": round(self.listener.checked_out / self.max_pool_size, 3) if self.max_pool_size else None,
+        }
+
+    async def close(self):
+        await super().close()
+        self.client.close()
+
+
+_SOURCE_TYPES = {"sql": SQLDataSource, "mongodb": MongoDataSource}
+
+
+def load_config(exclude_collections: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Named datasources from the environment.
+
+    SQL_DATABASE_URL and MONGO_URL/DB_NAME define the default "sql" and
+    "mongodb" sources. More are read as a JSON object of name -> options
+    from DATASOURCES, or from the file named by DATASOURCES_FILE.
+    """
+    config: Dict[str, Dict[str, Any]] = {}
+    if os.getenv("SQL_DATABASE_URL"):
+        config["sql"] = {"type": "sql", "url": os.environ["SQL_DATABASE_URL"]}
+    if os.getenv("MONGO_URL") and os.getenv("DB_NAME"):
+        config["mongodb"] = {"type": "mongodb", "url": os.environ["MONGO_URL"], "database": os.environ["DB_NAME"]}
+
+    raw = os.getenv("DATASOURCES")
+    if os.getenv("DATASOURCES_FILE"):
+        with open(os.environ["DATASOURCES_FILE"]) as f:
+            raw = f.read()
+    if raw:
+        for name, options in json.loads(raw).items():
+            if options.get("type") not in _SOURCE_TYPES:
+                raise DataSourceError(f"Datasource {name} has an unknown type: {options.get('type')}")
+            config[name] = options
+
+    for options in config.values():
+        if options["type"] == "mongodb" and exclude_collections:
+            options.setdefault("exclude_collections", exclude_collections)
+    return config
+
+
+class DataSourceRegistry:
+    """Named SQL and Mongo datasources with their own pools and catalogs.
+
+    Sources are created on first use and closed again once nothing has
+    leased them for their ``idle_timeout``. A request without a datasource
+    uses the default one named after its db_type.
+    """
+
+    def __init__(self, config: Dict[str, Dict[str, Any]], evict_interval: float = 60.0):
+        self.config = config
+        self.evict_interval = evict_interval
+        self._sources: Dict[str, DataSource] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"created": 0, "evicted": 0}
+
+    def names(self, db_type: Optional[str] = None) -> List[str]:
+        return [name for name, options in self.config.items() if db_type is None or options["type"] == db_type]
+
+    def _name_for(self, db_type: str, name: Optional[str]) -> str:
+        db_type = db_type.lower()
+        if db_type not in DB_TYPES:
+            raise DataSourceError(f"Invalid db_type: {db_type}")
+        name = name or db_type
+        options = self.config.get(name)
+        if options is None:
+            raise DataSourceError(f"Unknown datasource: {name}")
+        if options["type"] != db_type:
+            raise DataSourceError(f"Datasource {name} is {options['type']}, not {db_type}")
+        return name
+
+    def get(self, db_type: str, name: Optional[str] = None) -> DataSource:
+        name = self._name_for(db_type, name)
+        source = self._sources.get(name)
+        if source is None:
+            options = self.config[name]
+            # Constructors only build pools and clients, connections open on first query
+            source = _SOURCE_TYPES[options["type"]](name, options)
+            self._sources[name] = source
+            self._counters["created"] += 1
+            source.catalog.start()
+            logger.info(f"Datasource {name} ({options['type']}) created")
+        source.touch()
+        return source
+
+    def active(self, db_type: Optional[str] = None) -> List[DataSource]:
+        return [s for s in self._sources.values() if db_type is None or s.db_type == db_type]
+
+    @asynccontextmanager
+    async def lease(self, db_type: str, name: Optional[str] = None) -> AsyncIterator[DataSource]:
+        """Use a source, keeping it from being evicted until the block exits."""
+        source = self.get(db_type, name)
+        source.in_use += 1
+        try:
+            yield source
+        finally:
+            source.in_use -= 1
+            source.touch()
+
+    async def leased_stream(self, source: DataSource, stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """Hold a lease on ``source`` until ``stream`` is exhausted or closed."""
+        source.in_use += 1
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            source.in_use -= 1
+            source.touch()
+
+    def cached_names(self, db_type: str) -> List[str]:
+        names: List[str] = []
+        for source in self.active(db_type.lower()):
+            names.extend(source.catalog.cached_names(db_type))
+        return names
+
+    async def evict_idle(self) -> List[str]:
+        evicted = []
+        async with self._lock:
+            for name, source in list(self._sources.items()):
+                if source.evictable():
+                    del self._sources[name]
+                    await source.close()
+                    self._counters["evicted"] += 1
+                    evicted.append(name)
+                    logger.info(f"Datasource {name} closed after {source.idle_seconds():.0f}s idle")
+        return evicted
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error evicting idle datasources: {e}")
+
+    def start(self):
+        if self._task is None and self.evict_interval > 0:
+            self._task = asyncio.create_task(self._evict_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for source in list(self._sources.values()):
+            await source.close()
+        self._sources.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "evict_interval": self.evict_interval,
+            "datasources": {
+                name: self._sources[name].stats() if name in self._sources
+                else {"type": options["type"], "active": False}
+                for name, options in self.config.items()
+            },
+        }
+
+    @classmethod
+    def from_env(cls, exclude_collections: Optional[List[str]] = None) -> "DataSourceRegistry":
+        return cls(
+            load_config(exclude_collections),
+            evict_interval=float(os.getenv("DATASOURCE_EVICT_INTERVAL_SECONDS", "60")),
+        )
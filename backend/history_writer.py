@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """Buffered, batched writer for query_history.
+
+    Entries are queued in memory and written with insert_many once
+    ``batch_size`` entries are waiting or ``flush_interval`` seconds have
+    passed, so request handlers never wait on Mongo. When the queue is full
+    entries are dropped and counted, or with ``block_when_full`` the caller
+    waits for room. Conversion entries are also fed to the insights rollups.
+    """
+
+    def __init__(
+        self,
+        collection,
+        rollups=None,
+        max_queue: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        block_when_full: bool = False,
+    ):
+        self.collection = collection
+        self.rollups = rollups
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_when_full = block_when_full
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"enqueued": 0, "written": 0, "dropped": 0, "flushes": 0, "errors": 0}
+        self._last_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    async def submit(self, entry: Dict[str, Any]):
+        if self.block_when_full:
+            await self._queue.put(entry)
+        else:
+            try:
+                self._queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                self._counters["dropped"] += 1
+                return
+        self._counters["enqueued"] += 1
+
+    async def _collect(self) -> tuple:
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        try:
+            # insert_many adds _id to the dicts, hand it copies
+            await self.collection.insert_many([dict(entry) for entry in batch], ordered=False)
+            self._counters["written"] += len(batch)
+        except Exception as e:
+            self._counters["errors"] += 1
+            self._counters["dropped"] += len(batch)
+            logger.error(f"Error writing {len(batch)} query history entries: {e}")
+        if self.rollups is not None:
+            conversions = [entry for entry in batch if entry.get("event", "conversion") == "conversion"]
+            if conversions:
+                try:
+                    await self.rollups.record_many(conversions)
+                except Exception as e:
+                    self._counters["errors"] += 1
+                    logger.error(f"Error updating insights rollups: {e}")
+        self._last_flush_ms = 1000 * (time.perf_counter() - started)
+        self._total_flush_ms += self._last_flush_ms
+        self._counters["flushes"] += 1
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Queued behind every pending entry, so the writer drains before exiting
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        flushes = self._counters["flushes"]
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            **self._counters,
+            "last_flush_ms": round(self._last_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / flushes, 2) if flushes else 0.0,
+        }
@@ -0,0 +1,473 @@
+import hashlib
+import json
+import logging
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from cost_guard import table_aliases
+from datasources import DataSourceError
+from insights_rollup import extract_sql_tables
+from pipeline_optimizer import PipelineOptimizer, stage_name
+
+logger = logging.getLogger(__name__)
+
+# Fractions of a table left after one predicate, the usual textbook defaults
+EQUALITY_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 0.33
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_CLAUSE_END = r"(?=\b(?:group\s+by|order\s+by|having|limit|union|window)\b|\)|;|$)"
+_WHERE = re.compile(r"\bwhere\b(.*?)" + _CLAUSE_END, re.IGNORECASE | re.DOTALL)
+_ON = re.compile(
+    r"\bon\b(.*?)(?=\b(?:inner|left|right|full|cross|join|where|group|order|limit|having|union)\b|\)|;|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+_GROUP_BY = re.compile(r"\bgroup\s+by\b(.*?)(?=\b(?:having|order\s+by|limit|union)\b|\)|;|$)", re.IGNORECASE | re.DOTALL)
+_ORDER_BY = re.compile(r"\border\s+by\b(.*?)(?=\b(?:limit|union)\b|\)|;|$)", re.IGNORECASE | re.DOTALL)
+_COLUMN_PAIR = re.compile(r"(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\s*=\s*([A-Za-z_]\w*)\.([A-Za-z_]\w*)")
+_PREDICATE = re.compile(
+    r"(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\s*(<=>|>=|<=|=|>|<|\bin\b|\bbetween\b|\blike\b|\bis\b)",
+    re.IGNORECASE,
+)
+_COLUMN_REF = re.compile(r"^(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)(?:\s+(asc|desc))?$", re.IGNORECASE)
+_EQUALITY_OPS = {"=", "<=>", "in", "is"}
+_MONGO_RANGE_OPS = {"$gt", "$gte", "$lt", "$lte", "$regex"}
+_MONGO_EQUALITY_OPS = {"$eq", "$in"}
+
+
+@dataclass
+class Usage:
+    """How one query uses one table: equality, range, sort and group columns."""
+    table: str
+    equality: List[str] = field(default_factory=list)
+    range: List[str] = field(default_factory=list)
+    sort: List[Tuple[str, int]] = field(default_factory=list)
+    group: List[str] = field(default_factory=list)
+
+    def add(self, kind: str, column: str):
+        values = getattr(self, kind)
+        if column not in values:
+            values.append(column)
+
+    def candidate(self, max_columns: int) -> Tuple[Tuple[Tuple[str, int], ...], int, bool]:
+        """Index columns in equality, sort, range order.
+
+        Also returns how many leading columns are equalities and whether
+        the range column directly follows them, so the index can seek on it.
+        """
+        columns: List[Tuple[str, int]] = [(c, 1) for c in self.equality]
+        seen = set(self.equality)
+        # An index can only serve the sort when it follows the equality columns directly
+        trailing = self.sort or [(c, 1) for c in self.group]
+        for column, direction in trailing:
+            if column not in seen:
+                columns.append((column, direction))
+                seen.add(column)
+        range_seek = False
+        for column in self.range[:1]:
+            if column not in seen and len(columns) < max_columns:
+                range_seek = len(columns) == len(self.equality)
+                columns.append((column, 1))
+        return tuple(columns[:max_columns]), min(len(self.equality), max_columns), range_seek
+
+
+def _resolve(qualifier: Optional[str], column: str, aliases: Dict[str, str], catalog, tables: List[str]) -> Optional[str]:
+    if qualifier:
+        table = aliases.get(qualifier)
+        return table if table in tables else None
+    owners = []
+    for table in tables:
+        entry = catalog.cached("sql", table) if catalog else None
+        if entry and any(col["name"] == column for col in entry["columns"]):
+            owners.append(table)
+    if len(owners) == 1:
+        return owners[0]
+    if not owners and len(tables) == 1 and not (catalog and catalog.cached("sql", tables[0])):
+        return tables[0]
+    return None
+
+
+def _known_column(table: str, column: str, catalog) -> bool:
+    entry = catalog.cached("sql", table) if catalog else None
+    return entry is None or any(col["name"] == column for col in entry["columns"])
+
+
+def sql_usage(sql: str, catalog=None) -> Dict[str, Usage]:
+    """Columns a SQL query filters, joins, sorts and groups on, per table."""
+    sql = _STRING.sub("?", sql)
+    # table_aliases also picks up names after select-list commas, keep real tables only
+    tables = extract_sql_tables(sql)
+    aliases = {alias: table for alias, table in table_aliases(sql).items() if table in tables}
+    usage: Dict[str, Usage] = {}
+
+    def note(kind: str, qualifier: Optional[str], column: str, direction: int = 1):
+        table = _resolve(qualifier, column, aliases, catalog, tables)
+        if table is None or not _known_column(table, column, catalog):
+            return
+        entry = usage.setdefault(table, Usage(table))
+        if kind == "sort":
+            if column not in [c for c, _ in entry.sort]:
+                entry.sort.append((column, direction))
+        else:
+            entry.add(kind, column)
+
+    for match in _ON.finditer(sql):
+        for left_q, left, right_q, right in _COLUMN_PAIR.findall(match.group(1)):
+            note("equality", left_q or None, left)
+            note("equality", right_q, right)
+    for match in _WHERE.finditer(sql):
+        clause = match.group(1)
+        for left_q, left, right_q, right in _COLUMN_PAIR.findall(clause):
+            if left_q:
+                # a.x = b.y in WHERE is an old-style join
+                note("equality", left_q, left)
+                note("equality", right_q, right)
+        clause = _COLUMN_PAIR.sub(" ", clause)
+        for qualifier, column, op in _PREDICATE.findall(clause):
+            if column.lower() in ("and", "or", "not", "null"):
+                continue
+            kind = "equality" if op.lower() in _EQUALITY_OPS else "range"
+            note(kind, qualifier or None, column)
+    for match in _GROUP_BY.finditer(sql):
+        for ref in match.group(1).split(","):
+            parsed = _COLUMN_REF.match(ref.strip())
+            if parsed:
+                note("group", parsed.group(1), parsed.group(2))
+    for match in _ORDER_BY.finditer(sql):
+        refs = [_COLUMN_REF.match(ref.strip()) for ref in match.group(1).split(",")]
+        # ORDER BY an expression or an alias can't be served by an index
+        if all(refs):
+            for parsed in refs:
+                direction = -1 if (parsed.group(3) or "").lower() == "desc" else 1
+                note("sort", parsed.group(1), parsed.group(2), direction)
+
+    # A sort spanning several tables can't come from one index
+    sorted_tables = [u.table for u in usage.values() if u.sort]
+    if len(sorted_tables) > 1:
+        for entry in usage.values():
+            entry.sort = []
+    return usage
+
+
+def _mongo_filter_usage(entry: Usage, filter_dict: Dict[str, Any]):
+    for key, value in filter_dict.items():
+        if key == "$and" and isinstance(value, list):
+            for clause in value:
+                if isinstance(clause, dict):
+                    _mongo_filter_usage(entry, clause)
+        elif key.startswith("$"):
+            # $or branches need an index each, $expr/$text can't use one this way
+            continue
+        elif isinstance(value, dict) and any(op.startswith("$") for op in value):
+            if set(value) & _MONGO_RANGE_OPS:
+                entry.add("range", key)
+            elif set(value) & _MONGO_EQUALITY_OPS:
+                entry.add("equality", key)
+        else:
+            entry.add("equality", key)
+
+
+def mongo_usage(query: str) -> Tuple[Dict[str, Usage], Optional[Dict[str, Any]]]:
+    """Fields a Mongo query filters and sorts on, and the filter an index would serve."""
+    start = query.find("{")
+    if start == -1:
+        return {}, None
+    try:
+        query_obj, _ = json.JSONDecoder().raw_decode(query[start:])
+    except ValueError:
+        return {}, None
+    if not isinstance(query_obj, dict):
+        return {}, None
+
+    usage: Dict[str, Usage] = {}
+    plan = None
+    if isinstance(query_obj.get("find"), str):
+        collection = query_obj["find"]
+        filter_dict, sort = query_obj.get("filter") or {}, query_obj.get("sort") or {}
+    elif isinstance(query_obj.get("aggregate"), str):
+        collection = query_obj["aggregate"]
+        # Only a $match (and $sort) that reaches the front of the pipeline can use an index
+        pipeline, _ = PipelineOptimizer(hints=False, narrow_projections=False).optimize_pipeline(
+            collection, list(query_obj.get("pipeline") or [])
+        )
+        filter_dict, sort = {}, {}
+        if pipeline and stage_name(pipeline[0]) == "$match":
+            filter_dict = pipeline[0]["$match"]
+            if len(pipeline) > 1 and stage_name(pipeline[1]) == "$sort":
+                sort = pipeline[1]["$sort"]
+        elif pipeline and stage_name(pipeline[0]) == "$sort":
+            sort = pipeline[0]["$sort"]
+        for stage in pipeline:
+            lookup = stage.get("$lookup") if isinstance(stage, dict) else None
+            if isinstance(lookup, dict) and lookup.get("from") and lookup.get("foreignField"):
+                usage.setdefault(lookup["from"], Usage(lookup["from"])).add("equality", lookup["foreignField"])
+    else:
+        return {}, None
+
+    entry = Usage(collection)
+    if isinstance(filter_dict, dict):
+        _mongo_filter_usage(entry, filter_dict)
+    if isinstance(sort, dict):
+        entry.sort = [(key, -1 if value == -1 else 1) for key, value in sort.items()]
+    if entry.equality or entry.range or entry.sort:
+        usage[collection] = entry
+        plan = {"filter": filter_dict, "sort": sort}
+    return usage, plan
+
+
+def _covered(columns: Tuple[Tuple[str, int], ...], equalities: int, indexes: List[Dict[str, Any]]) -> Optional[str]:
+    names = [c for c, _ in columns]
+    for index in indexes:
+        existing = list(index["columns"])
+        # A unique index on equality columns already narrows to one row
+        if index.get("unique") and existing and set(existing) <= set(names[:equalities]):
+            return index["name"]
+        if len(existing) < len(names):
+            continue
+        # Equality columns can be in any order, the rest must follow in place
+        if set(existing[:equalities]) == set(names[:equalities]) and existing[equalities:len(names)] == names[equalities:]:
+            return index["name"]
+    return None
+
+
+def index_name(table: str, columns: Tuple[Tuple[str, int], ...], db_type: str) -> str:
+    if db_type == "mongodb":
+        return "_".join(f"{c}_{d}" for c, d in columns)
+    name = f"ix_{table}_{'_'.join(c for c, _ in columns)}"
+    if len(name) > 60:
+        digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+        name = f"{name[:51]}_{digest}"
+    return name
+
+
+class IndexAdvisor:
+    """Index recommendations from query_history, checked against EXPLAIN.
+
+    Successful executions are parsed for the columns they filter, join,
+    sort and group on. Each query contributes one candidate per table,
+    ordered equality, sort, range. Candidates an existing index already
+    serves are dropped, the rest are checked with EXPLAIN and ranked by
+    rows examined saved times how often the query ran.
+    """
+
+    def __init__(self, history_collection, datasources, history_limit: int = 20_000, max_columns: int = 4):
+        self.history = history_collection
+        self.datasources = datasources
+        self.history_limit = history_limit
+        self.max_columns = max_columns
+        self._counters = {"runs": 0, "applied": 0, "apply_errors": 0}
+
+    def _options(self, name: str) -> Dict[str, Any]:
+        options = self.datasources.config.get(name)
+        if options is None:
+            raise DataSourceError(f"Unknown datasource: {name}")
+        return options
+
+    async def _load_history(self) -> Dict[str, List[Dict[str, Any]]]:
+        cursor = self.history.find(
+            {"event": "execution", "success": True},
+            {"_id": 0, "db_type": 1, "datasource": 1, "query": 1, "duration_ms": 1},
+        ).sort("timestamp", -1).limit(self.history_limit)
+        by_source: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        async for entry in cursor:
+            db_type = str(entry.get("db_type") or "").lower()
+            if db_type in ("sql", "mongodb") and entry.get("query"):
+                by_source[entry.get("datasource") or db_type].append(entry)
+        return by_source
+
+    def _candidates(self, source, entries: List[Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+        candidates: Dict[tuple, Dict[str, Any]] = {}
+        for entry in entries:
+            if source.db_type == "sql":
+                usage, plan = sql_usage(entry["query"], source.catalog), None
+            else:
+                usage, plan = mongo_usage(entry["query"])
+            for table, table_usage in usage.items():
+                columns, equalities, range_seek = table_usage.candidate(self.max_columns)
+                if not columns:
+                    continue
+                found = candidates.setdefault((table, columns), {
+                    "table": table, "columns": columns, "equalities": equalities, "range_seek": range_seek,
+                    "queries": 0, "duration_ms": 0.0, "examples": Counter(), "plans": {},
+                })
+                found["queries"] += 1
+                found["duration_ms"] += float(entry.get("duration_ms") or 0)
+                found["examples"][entry["query"]] += 1
+                if plan is not None:
+                    found["plans"].setdefault(entry["query"], plan)
+        return candidates
+
+    @staticmethod
+    def _fold_prefixes(candidates: Dict[tuple, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # An index on (a, b) also serves queries that only need (a)
+        ordered = sorted(candidates.values(), key=lambda c: len(c["columns"]), reverse=True)
+        kept: List[Dict[str, Any]] = []
+        for candidate in ordered:
+            names = [c for c, _ in candidate["columns"]]
+            wider = next((k for k in kept if k["table"] == candidate["table"]
+                          and [c for c, _ in k["columns"]][:len(names)] == names), None)
+            if wider is None:
+                kept.append(candidate)
+                continue
+            wider["queries"] += candidate["queries"]
+            wider["duration_ms"] += candidate["duration_ms"]
+            wider["examples"].update(candidate["examples"])
+            wider["plans"].update(candidate["plans"])
+        return kept
+
+    async def _sql_plan(self, source, table: str, sql: str) -> Tuple[str, Optional[int]]:
+        try:
+            _, scans = await source.cost_guard.explain(sql)
+        except Exception as e:
+            return f"EXPLAIN failed: {e}", None
+        for scan in scans:
+            if scan["table"] == table:
+                full = str(scan["scan"]).upper() in ("ALL", "SEQ SCAN")
+                plan = "full scan" if full else f"{scan['scan']} via {scan['key'] or 'index'}"
+                return plan, None if full else scan["rows"]
+        return "not in plan", None
+
+    async def _mongo_plan(self, source, table: str, plan: Optional[Dict[str, Any]]) -> Tuple[str, Optional[int]]:
+        if not plan:
+            return "unknown", None
+        command = {"find": table, "filter": plan["filter"]}
+        if plan["sort"]:
+            command["sort"] = plan["sort"]
+        try:
+            explain = await source.db.command("explain", command, verbosity="queryPlanner")
+        except Exception as e:
+            return f"explain failed: {e}", None
+        stages: List[str] = []
+
+        def visit(node):
+            if isinstance(node, dict):
+                if "stage" in node:
+                    stages.append(node["stage"] + (f" {node['indexName']}" if node.get("indexName") else ""))
+                for value in node.values():
+                    visit(value)
+            elif isinstance(node, list):
+                for value in node:
+                    visit(value)
+
+        visit(explain.get("queryPlanner", {}).get("winningPlan", explain))
+        summary = " <- ".join(stages) or "unknown"
+        return summary, None if "COLLSCAN" in summary or not stages else 0
+
+    def _statement(self, source, table: str, name: str, columns: Tuple[Tuple[str, int], ...]) -> Any:
+        if source.db_type == "mongodb":
+            return {"createIndexes": table, "indexes": [{"key": dict(columns), "name": name}]}
+        quote = source.engine.dialect.identifier_preparer.quote
+        column_list = ", ".join(quote(c) for c, _ in columns)
+        return f"CREATE INDEX {quote(name)} ON {quote(table)} ({column_list})"
+
+    async def recommend_for(self, source, entries: List[Dict[str, Any]], limit: int = 20) -> List[Dict[str, Any]]:
+        recommendations = []
+        for candidate in self._fold_prefixes(self._candidates(source, entries)):
+            table, columns, equalities = candidate["table"], candidate["columns"], candidate["equalities"]
+            entry = source.catalog.cached(source.db_type, table)
+            if entry is None:
+                continue
+            if _covered(columns, equalities, entry.get("indexes") or []):
+                continue
+            example = candidate["examples"].most_common(1)[0][0]
+            if source.db_type == "sql":
+                plan, indexed_rows = await self._sql_plan(source, table, example)
+            else:
+                plan, indexed_rows = await self._mongo_plan(source, table, candidate["plans"].get(example))
+            table_rows = int(entry.get("row_estimate") or 0)
+            if indexed_rows is None:
+                before = table_rows
+            elif indexed_rows:
+                before = indexed_rows
+            else:
+                # Mongo's planner doesn't estimate rows, assume an index on one field
+                before = max(1, int(table_rows * EQUALITY_SELECTIVITY))
+            selectivity = EQUALITY_SELECTIVITY ** equalities
+            if candidate["range_seek"]:
+                selectivity *= RANGE_SELECTIVITY
+            after = max(1, int(table_rows * selectivity))
+            saved = max(0, before - after)
+            if saved <= 0:
+                continue
+            name = index_name(table, columns, source.db_type)
+            recommendations.append({
+                "id": f"{source.name}:{table}:{name}",
+                "datasource": source.name,
+                "db_type": source.db_type,
+                "table": table,
+                "columns": [c for c, _ in columns],
+                "directions": [d for _, d in columns],
+                "name": name,
+                "queries": candidate["queries"],
+                "total_duration_ms": round(candidate["duration_ms"], 2),
+                "current_plan": plan,
+                "rows_examined_before": before,
+                "rows_examined_after": after,
+                "estimated_benefit": saved * candidate["queries"],
+                "statement": self._statement(source, table, name, columns),
+                "example_query": example,
+            })
+        recommendations.sort(key=lambda r: r["estimated_benefit"], reverse=True)
+        return recommendations[:limit]
+
+    async def recommend(self, datasource: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        self._counters["runs"] += 1
+        history = await self._load_history()
+        names = [datasource] if datasource else [n for n in history if n in self.datasources.config]
+        report = {}
+        for name in names:
+            options = self._options(name)
+            async with self.datasources.lease(options["type"], name) as source:
+                report[name] = {
+                    "production": source.production,
+                    "history_entries": len(history.get(name, [])),
+                    "recommendations": await self.recommend_for(source, history.get(name, []), limit),
+                }
+        return report
+
+    async def _create(self, source, recommendation: Dict[str, Any]):
+        if source.db_type == "mongodb":
+            keys = list(zip(recommendation["columns"], recommendation["directions"]))
+            await source.db[recommendation["table"]].create_index(keys, name=recommendation["name"])
+            return
+
+        def run_ddl():
+            with source.engine.begin() as conn:
+                conn.exec_driver_sql(recommendation["statement"])
+
+        await source.executor.run(run_ddl)
+
+    async def apply(self, datasource: str, ids: Optional[List[str]] = None, top: int = 1,
+                    dry_run: bool = True) -> Dict[str, Any]:
+        """Create recommended indexes, by id or the ``top`` ranked ones.
+
+        Production sources only ever get a dry run.
+        """
+        options = self._options(datasource)
+        async with self.datasources.lease(options["type"], datasource) as source:
+            history = await self._load_history()
+            recommendations = await self.recommend_for(source, history.get(datasource, []), limit=10_000)
+            chosen = [r for r in recommendations if r["id"] in ids] if ids else recommendations[:top]
+            if not dry_run and source.production:
+                raise PermissionError(f"Datasource {datasource} is production, indexes can only be dry-run")
+            results = []
+            for recommendation in chosen:
+                result = {"id": recommendation["id"], "statement": recommendation["statement"], "applied": False}
+                if not dry_run:
+                    try:
+                        await self._create(source, recommendation)
+                        result["applied"] = True
+                        self._counters["applied"] += 1
+                        logger.info(f"Index advisor created {recommendation['id']}")
+                    except Exception as e:
+                        self._counters["apply_errors"] += 1
+                        result["error"] = str(e)
+                results.append(result)
+            if any(r["applied"] for r in results):
+                await source.catalog.refresh(source.db_type)
+        return {"datasource": datasource, "dry_run": dry_run, "results": results}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"history_limit": self.history_limit, "max_columns": self.max_columns, **self._counters}
@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from pymongo import DESCENDING, UpdateOne
+
+from query_cache import normalize_question
+from query_safety import analyze_mongo, analyze_sql, clean_sql, parse_mongo
+
+logger = logging.getLogger(__name__)
+
+BUCKET_FORMATS = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d"}
+
+def extract_sql_tables(sql: str) -> List[str]:
+    return list(analyze_sql(clean_sql(sql)).tables)
+
+
+def extract_mongo_collections(query: str) -> List[str]:
+    try:
+        query_obj = parse_mongo(query)
+    except ValueError:
+        return []
+    return list(analyze_mongo(query_obj).tables)
+
+
+def extract_tables(db_type: str, query: str) -> List[str]:
+    if db_type.lower() == "sql":
+        return extract_sql_tables(query)
+    return extract_mongo_collections(query)
+
+
+def _parse_timestamp(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return datetime.now(timezone.utc)
+
+
+class InsightRollups:
+    """Query counters maintained at write time for /api/insights.
+
+    Every logged conversion increments one counter per question and one per
+    referenced table or collection, for the all-time bucket and each
+    configured time bucket. Reads are then an indexed sort over a few small
+    documents instead of a $group over the whole history.
+    """
+
+    def __init__(self, collection, buckets: Sequence[str] = ("hour", "day"), known_names=None):
+        self.collection = collection
+        self.buckets = [b for b in buckets if b in BUCKET_FORMATS]
+        # Optional callable(db_type) -> iterable of real table/collection names
+        self.known_names = known_names
+
+    async def ensure_indexes(self, collection=None):
+        collection = self.collection if collection is None else collection
+        await collection.create_index(
+            [("kind", 1), ("bucket", 1), ("period", 1), ("db_type", 1), ("key", 1)], unique=True
+        )
+        await collection.create_index([("kind", 1), ("bucket", 1), ("period", 1), ("count", DESCENDING)])
+
+    def _periods(self, when: datetime) -> List[tuple]:
+        return [("all", "all")] + [(b, when.strftime(BUCKET_FORMATS[b])) for b in self.buckets]
+
+    def _tables(self, db_type: str, generated_query: str) -> List[str]:
+        tables = extract_tables(db_type, generated_query or "")
+        if self.known_names is not None:
+            known = set(self.known_names(db_type))
+            if known:
+                tables = [t for t in tables if t in known]
+        return tables
+
+    def _operations(self, counts: Dict[tuple, Dict[str, Any]]) -> List[UpdateOne]:
+        operations = []
+        for (kind, bucket, period, db_type, key), info in counts.items():
+            operations.append(UpdateOne(
+                {"kind": kind, "bucket": bucket, "period": period, "db_type": db_type, "key": key},
+                {
+                    "$inc": {"count": info["count"]},
+                    "$max": {"last_seen": info["last_seen"]},
+                    "$set": {"text": info["text"]},
+                },
+                upsert=True,
+            ))
+        return operations
+
+    def _accumulate(self, counts: Dict[tuple, Dict[str, Any]], entry: Dict[str, Any]):
+        db_type = str(entry.get("db_type", "")).lower()
+        when = _parse_timestamp(entry.get("timestamp"))
+        keys = [("question", normalize_question(entry.get("nl_query", "")), entry.get("nl_query", ""))]
+        keys += [("table", table, table) for table in self._tables(db_type, entry.get("generated_query", ""))]
+        for bucket, period in self._periods(when):
+            for kind, key, text in keys:
+                if not key:
+                    continue
+                info = counts[(kind, bucket, period, db_type, key)]
+                info["count"] += 1
+                info["text"] = text
+                info["last_seen"] = max(info["last_seen"], when) if info["last_seen"] else when
+
+    @staticmethod
+    def _new_counts() -> Dict[tuple, Dict[str, Any]]:
+        return defaultdict(lambda: {"count": 0, "text": "", "last_seen": None})
+
+    async def record_many(self, entries: Iterable[Dict[str, Any]], collection=None):
+        counts = self._new_counts()
+        for entry in entries:
+            self._accumulate(counts, entry)
+        operations = self._operations(counts)
+        if operations:
+            await (self.collection if collection is None else collection).bulk_write(operations, ordered=False)
+
+    async def record(self, entry: Dict[str, Any]):
+        await self.record_many([entry])
+
+    async def top(self, kind: str, bucket: str = "all", period: Optional[str] = None,
+                  limit: int = 5, db_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        if bucket != "all" and period is None:
+            period = datetime.now(timezone.utc).strftime(BUCKET_FORMATS[bucket])
+        query = {"kind": kind, "bucket": bucket, "period": period or "all"}
+        if db_type:
+            query["db_type"] = db_type.lower()
+        cursor = self.collection.find(query, {"_id": 0}).sort("count", DESCENDING).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def backfill(self, history_collection, batch_size: int = 5000) -> Dict[str, int]:
+        """Rebuild every rollup from the existing query history.
+
+        The rollups are built in a separate collection and renamed over the
+        live one, so readers never see them half built. Conversions logged
+        while that runs were counted into the old collection, they are
+        replayed into the new one after the swap. One whose live update
+        lands in the moment around the swap can be counted twice.
+        """
+        conversions = {"event": {"$ne": "execution"}}
+        last_id = await self._last_history_id(history_collection)
+        if last_id is None:
+            query = conversions
+        else:
+            query = {**conversions, "_id": {"$lte": last_id}}
+        building = self.collection.database[f"{self.collection.name}_backfill"]
+        await building.drop()
+        await self.ensure_indexes(building)
+
+        counts = self._new_counts()
+        scanned = 0
+        async for entry in history_collection.find(query, {"_id": 0}).batch_size(batch_size):
+            self._accumulate(counts, entry)
+            scanned += 1
+        operations = self._operations(counts)
+        for start in range(0, len(operations), batch_size):
+            await building.bulk_write(operations[start:start + batch_size], ordered=False)
+        await building.rename(self.collection.name, dropTarget=True)
+
+        replayed = 0
+        if last_id is not None:
+            late = []
+            cursor = history_collection.find({**conversions, "_id": {"$gt": last_id}}, {"_id": 0})
+            async for entry in cursor:
+                late.append(entry)
+            replayed = len(late)
+            if late:
+                await self.record_many(late)
+        return {"history_entries": scanned, "rollups": len(operations), "replayed": replayed}
+
+    @staticmethod
+    async def _last_history_id(history_collection):
+        newest = await history_collection.find({}, {"_id": 1}).sort("_id", DESCENDING).limit(1).to_list(length=1)
+        return newest[0]["_id"] if newest else None
+
+
+async def _run_backfill():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    from datasources import DataSourceRegistry
+
+    load_dotenv(Path(__file__).parent / ".env")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    # Count only real tables and collections, the same as the live writes
+    datasources = DataSourceRegistry.from_env(exclude_collections=["query_history", "query_cache", "query_rollups"])
+    for db_type in ("sql", "mongodb"):
+        for name in datasources.names(db_type):
+            await datasources.get(db_type, name).catalog.refresh(db_type)
+    rollups = InsightRollups(
+        db.query_rollups,
+        buckets=os.getenv("INSIGHTS_BUCKETS", "hour,day").split(","),
+        known_names=datasources.cached_names,
+    )
+    await rollups.ensure_indexes()
+    result = await rollups.backfill(db.query_history)
+    logger.info(f"Insights rollups rebuilt: {result}")
+    await datasources.close()
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the /api/insights rollups")
+    parser.add_argument("--backfill", action="store_true", help="rebuild rollups from query_history")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.backfill:
+        asyncio.run(_run_backfill())
+    else:
+        parser.print_help()
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _error_message(result: Dict[str, Any], body: str) -> str:
+    error = result.get("error")
+    if isinstance(error, dict):
+        return error.get("message") or "Unknown LLM error"
+    return str(error) if error else body[:200]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class LLMClient:
+    """App-scoped client for an OpenAI-compatible chat completions API.
+
+    One instance owns a keep-alive connection pool for the lifetime of the app,
+    caps the number of in-flight calls and retries 429/5xx responses.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        model: str,
+        base_url: str = "https://api.groq.com/openai/v1",
+        max_concurrency: int = 8,
+        max_connections: int = 20,
+        keepalive_timeout: float = 30.0,
+        timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+        self._counters = {
+            "calls": 0,
+            "requests": 0,
+            "retries": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+        self._total_latency = 0.0
+
+    @classmethod
+    def from_env(cls) -> "LLMClient":
+        return cls(
+            api_key=os.getenv("GROQ_API_KEY"),
+            model=os.getenv("MODEL", "meta-llama/llama-4-maverick-17b-128e-instruct"),
+            base_url=os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1"),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+            keepalive_timeout=float(os.getenv("LLM_KEEPALIVE_SECONDS", "30")),
+            timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5")),
+            backoff_max=float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8")),
+        )
+
+    @property
+    def completions_url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    async def start(self):
+        if self._session is not None:
+            return
+        self._connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            },
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    def _record_usage(self, usage: Optional[Dict[str, Any]]):
+        if not isinstance(usage, dict):
+            return
+        self._counters["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+        self._counters["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            # Never retry sooner than the server asked us to
+            delay = max(delay, retry_after)
+        return delay
+
+    @asynccontextmanager
+    async def _slot(self):
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            # Also when the caller is cancelled while queued
+            self._waiting -= 1
+        self._in_flight += 1
+        self._counters["calls"] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._total_latency += time.perf_counter() - started
+            self._semaphore.release()
+
+    async def chat(self, messages: List[Dict[str, str]], **params: Any) -> Dict[str, Any]:
+        if self._session is None:
+            await self.start()
+
+        payload = {"model": self.model, "messages": messages, **params}
+        async with self._slot():
+            return await self._post_with_retries(payload)
+
+    async def _post_with_retries(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            self._counters["requests"] += 1
+            retry_after = None
+            try:
+                async with self._session.post(self.completions_url, json=payload) as response:
+                    if response.status in RETRYABLE_STATUSES:
+                        if response.status == 429:
+                            self._counters["rate_limited"] += 1
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        body = await response.text()
+                        error = LLMError(f"LLM API returned {response.status}: {body[:200]}", response.status)
+                    else:
+                        body = await response.text()
+                        try:
+                            result = json.loads(body)
+                        except ValueError:
+                            result = None
+                        if not isinstance(result, dict):
+                            self._counters["errors"] += 1
+                            raise LLMError(f"LLM API returned {response.status}: {body[:200]}", response.status)
+                        if "error" in result or response.status >= 400:
+                            self._counters["errors"] += 1
+                            raise LLMError(_error_message(result, body), response.status)
+                        self._record_usage(result.get("usage"))
+                        return result
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = LLMError(f"LLM connection error: {e!r}")
+
+            if attempt >= self.max_retries:
+                self._counters["errors"] += 1
+                raise error
+            delay = self._backoff(attempt, retry_after)
+            logger.warning(f"LLM call failed ({error}), retrying in {delay:.2f}s")
+            self._counters["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def chat_stream(self, messages: List[Dict[str, str]], **params: Any) -> AsyncIterator[str]:
+        """Stream a completion, yielding content deltas as they arrive.
+
+        Retries only happen before the first byte of the body; once tokens
+        have been yielded a failure is raised to the caller.
+        """
+        if self._session is None:
+            await self.start()
+
+        payload = {"model": self.model, "messages": messages, "stream": True, **params}
+        async with self._slot():
+            attempt = 0
+            streamed = False
+            while True:
+                self._counters["requests"] += 1
+                retry_after = None
+                try:
+                    async with self._session.post(self.completions_url, json=payload) as response:
+                        if response.status in RETRYABLE_STATUSES:
+                            if response.status == 429:
+                                self._counters["rate_limited"] += 1
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            body = await response.text()
+                            error = LLMError(f"LLM API returned {response.status}: {body[:200]}", response.status)
+                        elif response.status >= 400:
+                            self._counters["errors"] += 1
+                            body = await response.text()
+                            raise LLMError(f"LLM API returned {response.status}: {body[:200]}", response.status)
+                        else:
+                            async for delta in self._iter_sse(response):
+                                streamed = True
+                                yield delta
+                            return
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = LLMError(f"LLM connection error: {e!r}")
+                    if streamed:
+                        self._counters["errors"] += 1
+                        raise error
+
+                if attempt >= self.max_retries:
+                    self._counters["errors"] += 1
+                    raise error
+                delay = self._backoff(attempt, retry_after)
+                logger.warning(f"LLM stream failed ({error}), retrying in {delay:.2f}s")
+                self._counters["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _iter_sse(self, response) -> AsyncIterator[str]:
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise LLMError(_error_message(chunk, data))
+            # Groq reports stream usage under x_groq on the last chunk
+            self._record_usage(chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage"))
+            for choice in chunk.get("choices", []):
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+    def stats(self) -> Dict[str, Any]:
+        pool = {"limit": self.max_connections, "acquired": 0, "idle": 0}
+        if self._connector is not None:
+            pool["acquired"] = len(getattr(self._connector, "_acquired", ()))
+            pool["idle"] = sum(len(conns) for conns in getattr(self._connector, "_conns", {}).values())
+        calls = self._counters["calls"]
+        return {
+            "model": self.model,
+            "base_url": self.base_url,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "pool": pool,
+            **self._counters,
+            "avg_latency_ms": round(1000 * self._total_latency / calls, 2) if calls else 0.0,
+        }
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -9,37 +10,127 @@ from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 import uuid
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, text, inspect
-import re
 import asyncio
-import json
-import aiohttp
+import time
+import orjson
+from llm_client import LLMClient
+from query_cache import QueryCache, make_cache_key, normalize_question
+from query_jobs import JOB_STATES, JobError, QueryJobs
+from query_safety import analyze_mongo, analyze_sql, clean_sql, parse_mongo
+from admission import BUDGETS, AdmissionController, AdmissionMiddleware, AdmissionRejected, release_after
+from datasources import DataSourceError, DataSourceRegistry
+from insights_rollup import InsightRollups
+from index_advisor import IndexAdvisor
+from history_writer import HistoryWriter
+from singleflight import SingleFlight
+from similarity_index import SimilarityIndex
+from seeder import missing_mongo_collections, missing_sql_tables
+from metrics import (
+    PROMETHEUS_MEDIA_TYPE, MetricsMiddleware, MetricsRegistry, StageTimer, current_timing, route_template,
+)
+from query_stream import SectionStreamParser, sse_event, stream_event_payload
+from result_cache import ResultCache, canonical_mongo, is_volatile, normalize_sql
+from result_format import RESULT_SHAPES, encode_columnar
+from result_stream import (
+    ARROW_MEDIA_TYPE, NDJSON_MEDIA_TYPE, STREAM_FORMATS,
+    arrow_available, encode_arrow, encode_ndjson, mongo_batches, row_caps,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
-sql_database_url = os.getenv("SQL_DATABASE_URL")
-if sql_database_url:
-    engine = create_engine(sql_database_url)
+METADATA_COLLECTIONS = ["query_history", "query_cache", "query_rollups"]
+datasources = DataSourceRegistry.from_env(exclude_collections=METADATA_COLLECTIONS)
+result_cache = ResultCache.from_env(exclude_collections=METADATA_COLLECTIONS)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 model = os.getenv("MODEL", "meta-llama/llama-4-maverick-17b-128e-instruct")
+llm_client = LLMClient.from_env()
+STREAM_MAX_ROWS = int(os.getenv("STREAM_MAX_ROWS", "1000000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+STREAM_STATEMENT_TIMEOUT = float(os.getenv("STREAM_STATEMENT_TIMEOUT_SECONDS", "300"))
+# Jobs are written to disk as they run, record_query_job logs them once finished
+query_jobs = QueryJobs.from_env(on_finish=lambda job: record_query_job(job))
+JOBS_STATEMENT_TIMEOUT = float(os.getenv("QUERY_JOBS_STATEMENT_TIMEOUT_SECONDS", "3600"))
+JOBS_MAX_PAGE_SIZE = int(os.getenv("QUERY_JOBS_MAX_PAGE_SIZE", "10000"))
+query_cache = QueryCache(
+    db.query_cache,
+    max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600")),
+)
+insight_rollups = InsightRollups(
+    db.query_rollups,
+    buckets=os.getenv("INSIGHTS_BUCKETS", "hour,day").split(","),
+    known_names=datasources.cached_names,
+)
+history_writer = HistoryWriter(
+    db.query_history,
+    rollups=insight_rollups,
+    max_queue=int(os.getenv("HISTORY_MAX_QUEUE", "10000")),
+    batch_size=int(os.getenv("HISTORY_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("HISTORY_FLUSH_SECONDS", "1")),
+    block_when_full=os.getenv("HISTORY_BLOCK_WHEN_FULL", "false").lower() in ("1", "true", "yes"),
+)
+index_advisor = IndexAdvisor(
+    db.query_history,
+    datasources,
+    history_limit=int(os.getenv("INDEX_ADVISOR_HISTORY_LIMIT", "20000")),
+    max_columns=int(os.getenv("INDEX_ADVISOR_MAX_COLUMNS", "4")),
+)
+single_flight = SingleFlight()
+similarity_index = SimilarityIndex.from_env()
+SIMILARITY_HISTORY_LIMIT = int(os.getenv("SIMILARITY_HISTORY_LIMIT", "20000"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+PROMPT_MAX_TABLES = int(os.getenv("PROMPT_MAX_TABLES", "8"))
+PROMPT_MAX_COLUMNS = int(os.getenv("PROMPT_MAX_COLUMNS", "40"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "1000"))
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+metrics = MetricsRegistry("datawhiz")
+stage_timer = StageTimer(metrics.histogram(
+    "stage_duration_seconds", "Time spent in each stage of the convert and execute paths",
+    ["path", "stage", "db_type", "outcome"],
+))
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+slow_queries = metrics.counter("slow_queries_total", "Executed queries slower than SLOW_QUERY_MS", ["db_type"])
+admission_wait = metrics.histogram(
+    "admission_queue_wait_seconds", "Time admitted requests queued for a concurrency slot", ["budget"]
+)
+admission = AdmissionController.from_env(on_wait=lambda budget, seconds: admission_wait.observe(seconds, budget=budget))
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_query")
 class QueryRequest(BaseModel):
     query: str
     db_type: str  
     collection_name: Optional[str] = None  
+    datasource: Optional[str] = None
 
 class ExecuteRequest(BaseModel):
     query: str
     db_type: str
     collection_name: Optional[str] = None
+    datasource: Optional[str] = None
+    # "records" (a dict per row), "columns" (column arrays) or "rows" (row tuples)
+    shape: str = "records"
+    # False skips the result cache, the query always runs
+    cache: bool = True
+
+class StreamExecuteRequest(ExecuteRequest):
+    format: str = "ndjson"
+    max_rows: Optional[int] = Field(None, ge=1)
+    batch_size: Optional[int] = Field(None, ge=1)
+
+class JobRequest(ExecuteRequest):
+    max_rows: Optional[int] = Field(None, ge=1)
+    batch_size: Optional[int] = Field(None, ge=1)
 
 class QueryResponse(BaseModel):
     generated_query: str
@@ -47,15 +138,35 @@ class QueryResponse(BaseModel):
     optimization_tips: str
     db_type: str
 
+class BatchQueryRequest(BaseModel):
+    items: List[QueryRequest]
+    concurrency: Optional[int] = None
+
+class BatchItemResult(BaseModel):
+    index: int
+    success: bool
+    result: Optional[QueryResponse] = None
+    error: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
 class ExecuteResponse(BaseModel):
     success: bool
     results: List[Dict[str, Any]]
     row_count: int
     error: Optional[str] = None
+    cost: Optional[Dict[str, Any]] = None
+    cached: bool = False
+    # Seconds since a cached result was stored
+    cache_age: Optional[float] = None
 
 class TableInfo(BaseModel):
     name: str
     count: int
+    db_type: Optional[str] = None
 
 class SchemaResponse(BaseModel):
     schema_info: Dict[str, Any]
@@ -64,63 +175,48 @@ class SchemaResponse(BaseModel):
 class InsightResponse(BaseModel):
     common_queries: List[str]
     frequent_tables: List[TableInfo]
-def extract_first_json(text: str) -> dict:
-    stack = []
-    start_idx = None
-
-    for idx, char in enumerate(text):
-        if char == '{':
-            if start_idx is None:
-                start_idx = idx
-            stack.append('{')
-        elif char == '}':
-            if stack:
-                stack.pop()
-                if not stack and start_idx is not None:
-                    json_str = text[start_idx:idx+1]
-                    try:
-                        return json.loads(json_str)
-                    except json.JSONDecodeError as e:
-                        raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
-    raise HTTPException(status_code=400, detail="No valid JSON found in text")
-
-def is_safe_sql_query(query: str) -> bool:
-    query_lower = query.lower().strip()
-    destructive_keywords = [
-        r'\bdrop\b', r'\bdelete\b', r'\btruncate\b', r'\bupdate\b',
-        r'\binsert\b', r'\balter\b', r'\bcreate\b', r'\breplace\b',
-        r'\bgrant\b', r'\brevoke\b'
-    ]
-    
-    for keyword in destructive_keywords:
-        if re.search(keyword, query_lower):
-            return False
-    
-    return True
-
-def is_safe_mongo_query(query_str: str) -> bool:
-    query_lower = query_str.lower()
-    destructive_keywords = [
-        'drop', 'remove', 'delete', 'bulkwrite', 'update',
-        'insert', 'replace', '$where'
-    ]
-    
-    for keyword in destructive_keywords:
-        if keyword in query_lower:
-            return False
-    
-    return True
-
-async def convert_nl_to_query(nl_query: str, db_type: str) -> Dict[str, str]:
-    
+
+class ResultCacheInvalidateRequest(BaseModel):
+    datasource: str
+    # Tables or collections to invalidate, every one of the datasource when omitted
+    tables: Optional[List[str]] = None
+
+class IndexApplyRequest(BaseModel):
+    datasource: str
+    ids: Optional[List[str]] = None
+    top: int = 1
+    dry_run: bool = True
+
+DEFAULT_SQL_SCHEMA = """- customers (customer_id, name, email, country, city, registration_date)
+- products (product_id, name, category, price, stock_quantity)
+- orders (order_id, customer_id, order_date, total_amount, status)
+- order_items (item_id, order_id, product_id, quantity, price)"""
+
+DEFAULT_MONGO_SCHEMA = """- users (user_id, name, email, age, country, registration_date)
+- events (event_id, user_id, event_type, timestamp, properties)
+- sessions (session_id, user_id, start_time, end_time, duration_minutes)"""
+
+def get_prompt_schema(db_type: str, question: Optional[str] = None, datasource: Optional[str] = None) -> str:
+    backend = "sql" if db_type.lower() == "sql" else "mongodb"
+    try:
+        catalog = datasources.get(backend, datasource).catalog
+    except DataSourceError:
+        if datasource:
+            raise
+        catalog = None
+    if catalog is not None and catalog.is_loaded(backend):
+        return catalog.render_schema(
+            backend, question, max_objects=PROMPT_MAX_TABLES, max_columns=PROMPT_MAX_COLUMNS
+        )
+    return DEFAULT_SQL_SCHEMA if backend == "sql" else DEFAULT_MONGO_SCHEMA
+
+def get_system_prompt(db_type: str, question: Optional[str] = None, datasource: Optional[str] = None) -> str:
+    schema = get_prompt_schema(db_type, question, datasource)
     if db_type.lower() == "sql":
-        system_prompt = """You are an expert SQL query generator. Convert natural language to MySQL SELECT queries only.
+        system_prompt = f"""You are an expert SQL query generator. Convert natural language to MySQL SELECT queries only.
         
 Database schema:
-- customers (customer_id, name, email, country, city, registration_date)
-- products (product_id, name, category, price, stock_quantity)
-- orders (order_id, customer_id, order_date, total_amount, status)
-- order_items (item_id, order_id, product_id, quantity, price)
+{schema}
 
 Rules:
 1. Generate ONLY SELECT queries
@@ -129,242 +225,648 @@ Rules:
 4. Provide clear explanation and optimization tips
 5. Return response in format: QUERY|||EXPLANATION|||OPTIMIZATION"""
     else:
-        system_prompt = """You are an expert MongoDB query generator. Convert natural language to MongoDB find/aggregate queries.
+        system_prompt = f"""You are an expert MongoDB query generator. Convert natural language to MongoDB find/aggregate queries.
         
 Database collections:
-- users (user_id, name, email, age, country, registration_date)
-- events (event_id, user_id, event_type, timestamp, properties)
-- sessions (session_id, user_id, start_time, end_time, duration_minutes)
+{schema}
 
 Rules:
 1. Generate ONLY find() or aggregate() queries
 2. Return as valid JSON object
 3. Provide clear explanation and optimization tips
 4. Return response in format: QUERY|||EXPLANATION|||OPTIMIZATION"""
-    
+    return system_prompt
+
+def build_messages(nl_query: str, db_type: str, datasource: Optional[str] = None) -> List[Dict[str, str]]:
+    system_prompt = get_system_prompt(db_type, nl_query, datasource)
+    messages = [{"role": "system", "content": system_prompt}]
+    # Similar questions that were answered and executed before, as worked examples
+    for example in similarity_index.examples(nl_query, db_type, datasource):
+        messages.append({"role": "user", "content": f"Convert this to a {db_type.upper()} query: {example['question']}"})
+        messages.append({"role": "assistant", "content": "|||".join(
+            [example["query"], example["explanation"], example["optimization"]]
+        )})
     user_prompt = f"Convert this to a {db_type.upper()} query: {nl_query}"
-    
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+def parse_completion(content: str) -> Dict[str, str]:
+    parts = content.split('|||')
+    if len(parts) >= 3:
+        return {
+            "query": parts[0].strip(),
+            "explanation": parts[1].strip(),
+            "optimization": parts[2].strip()
+        }
+    else:
+        # Fallback parsing
+        return {
+            "query": content.strip(),
+            "explanation": "Query generated successfully",
+            "optimization": "Consider adding indexes for better performance"
+        }
+
+async def convert_nl_to_query(nl_query: str, db_type: str, datasource: Optional[str] = None) -> Dict[str, str]:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {GROQ_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": model,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ]
-                }
-            ) as response:
-                result = await response.json()
-                logger.error(f"Groq raw response: {result}")
-                if "error" in result:
-                    raise Exception(result["error"].get("message", "Unknown Groq error"))
-                if "choices" not in result or len(result["choices"]) == 0:
-                    raise Exception("Groq API returned no 'choices' field")
-                content = result["choices"][0]["message"]["content"]
-
-
-                content = result['choices'][0]['message']['content']
-                
-                # Parse the response
-                parts = content.split('|||')
-                if len(parts) >= 3:
-                    return {
-                        "query": parts[0].strip(),
-                        "explanation": parts[1].strip(),
-                        "optimization": parts[2].strip()
-                    }
-                else:
-                    # Fallback parsing
-                    return {
-                        "query": content.strip(),
-                        "explanation": "Query generated successfully",
-                        "optimization": "Consider adding indexes for better performance"
-                    }
+        async with admission.slot("llm"):
+            with stage_timer.stage("convert", "llm", db_type):
+                result = await llm_client.chat(build_messages(nl_query, db_type, datasource))
+        logger.debug(f"Groq raw response: {result}")
+        if "choices" not in result or len(result["choices"]) == 0:
+            raise Exception("Groq API returned no 'choices' field")
+        content = result['choices'][0]['message']['content']
+
+        with stage_timer.stage("convert", "parse", db_type):
+            return parse_completion(content)
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Error calling Groq API: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to convert query: {str(e)}")
 
+def conversion_cache_key(nl_query: str, db_type: str, datasource: Optional[str] = None) -> str:
+    return make_cache_key(nl_query, db_type, llm_client.model, get_system_prompt(db_type, nl_query, datasource))
+
+async def cached_convert_nl_to_query(nl_query: str, db_type: str, datasource: Optional[str] = None) -> Dict[str, str]:
+    with stage_timer.stage("convert", "prompt", db_type):
+        key = conversion_cache_key(nl_query, db_type, datasource)
+    with stage_timer.stage("convert", "cache", db_type):
+        cached = await query_cache.get(key)
+    if cached is not None:
+        return cached
+    with stage_timer.stage("convert", "similarity", db_type):
+        similar = similarity_index.answer(nl_query, db_type, datasource)
+    if similar is not None:
+        await query_cache.set(key, similar, nl_query=normalize_question(nl_query), db_type=db_type.lower())
+        return similar
+
+    async def convert():
+        result = await convert_nl_to_query(nl_query, db_type, datasource)
+        await query_cache.set(key, result, nl_query=normalize_question(nl_query), db_type=db_type.lower())
+        return result
+
+    return await single_flight.do(key, convert)
+
+async def log_conversion(nl_query: str, db_type: str, result: Dict[str, str], datasource: Optional[str] = None):
+    similarity_index.observe(nl_query, db_type, datasource, result)
+    await history_writer.submit({
+        "id": str(uuid.uuid4()),
+        "event": "conversion",
+        "nl_query": nl_query,
+        "db_type": db_type,
+        "datasource": datasource,
+        "generated_query": result["query"],
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
 @api_router.post("/convert-query", response_model=QueryResponse)
 async def convert_query(request: QueryRequest):
+    started = time.perf_counter()
     try:
-        result = await convert_nl_to_query(request.query, request.db_type)
-        query_log = {
-            "id": str(uuid.uuid4()),
-            "nl_query": request.query,
-            "db_type": request.db_type,
-            "generated_query": result["query"],
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }
-        await db.query_history.insert_one(query_log)
-        
+        result = await cached_convert_nl_to_query(request.query, request.db_type, request.datasource)
+        await log_conversion(request.query, request.db_type, result, request.datasource)
+        stage_timer.record("convert", "total", time.perf_counter() - started, request.db_type)
+
         return QueryResponse(
             generated_query=result["query"],
             explanation=result["explanation"],
             optimization_tips=result["optimization"],
             db_type=request.db_type
         )
+    except DataSourceError as e:
+        stage_timer.record("convert", "total", time.perf_counter() - started, request.db_type, "error")
+        raise HTTPException(status_code=400, detail=str(e))
+    except AdmissionRejected:
+        stage_timer.record("convert", "total", time.perf_counter() - started, request.db_type, "rejected")
+        raise
     except Exception as e:
+        stage_timer.record("convert", "total", time.perf_counter() - started, request.db_type, "error")
         logger.error(f"Error in convert_query: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/execute-query", response_model=ExecuteResponse)
-async def execute_query(request: ExecuteRequest):
+async def stream_conversion(request: QueryRequest):
     try:
-        if request.db_type.lower() == "sql":
-            import re
-            query_str = re.sub(r'(?i)(QUERY:|FINAL RESPONSE:|EXPLANATION:|OPTIMIZATION:)', '', request.query)
-            query_str = re.sub(r'```sql|```|`', '', query_str, flags=re.IGNORECASE).strip()
-            sql_query = next((line.strip() for line in query_str.splitlines() if line.strip()), "")
-            if not sql_query:
-                raise HTTPException(status_code=400, detail="No valid SQL found in request")
-            if not is_safe_sql_query(sql_query):
-                raise HTTPException(status_code=400, detail="Destructive SQL queries are not allowed")
-            with engine.connect() as conn:
-                result = conn.execute(text(sql_query))
-                rows = [dict(row._mapping) for row in result]
-
-            return ExecuteResponse(success=True, results=rows, row_count=len(rows))
-
-        elif request.db_type.lower() == "mongodb":
-            import json
-            import re
-
-            query_str = request.query.strip()
-            query_str = re.sub(r"```json|```", "", query_str, flags=re.IGNORECASE | re.DOTALL)
-            query_str = re.sub(r"(?i)query:|explanation:|optimization:", "", query_str).strip()
-            
-            def extract_first_json(text: str) -> dict:
-                stack = []
-                start_idx = None
-                for idx, char in enumerate(text):
-                    if char == '{':
-                        if start_idx is None:
-                            start_idx = idx
-                        stack.append('{')
-                    elif char == '}':
-                        if stack:
-                            stack.pop()
-                            if not stack and start_idx is not None:
-                                json_str = text[start_idx:idx+1]
-                                try:
-                                    return json.loads(json_str)
-                                except json.JSONDecodeError as e:
-                                    raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
-                raise HTTPException(status_code=400, detail="No valid JSON found in query")
-            
-            query_obj = extract_first_json(query_str)
-            collection_name = request.collection_name or query_obj.get("find") or query_obj.get("aggregate") or "users"
-            collection = db[collection_name]
-
-            if "find" in query_obj:
-                filter_dict = query_obj.get("filter", {})
-                projection = query_obj.get("projection", {"_id": 0})
-                cursor = collection.find(filter_dict, projection).limit(100)
-            elif "aggregate" in query_obj:
-                pipeline = query_obj.get("pipeline", [])
-                cursor = collection.aggregate(pipeline)
-            else:
-                cursor = collection.find(query_obj, {"_id": 0}).limit(100)
+        key = conversion_cache_key(request.query, request.db_type, request.datasource)
+        result = await query_cache.get(key)
+        cached = result is not None
+        shared = False
+        if result is None:
+            result = similarity_index.answer(request.query, request.db_type, request.datasource)
+            if result is not None:
+                await query_cache.set(
+                    key, result, nl_query=normalize_question(request.query), db_type=request.db_type.lower()
+                )
+        flight = single_flight.current(key) if result is None else None
+        if flight is not None:
+            # Someone is already generating this exact question, wait for them
+            try:
+                result = await single_flight.wait(flight)
+                shared = True
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
 
-            results = await cursor.to_list(length=100)
-            return ExecuteResponse(success=True, results=results, row_count=len(results))
+        if result is not None:
+            yield sse_event("query_ready", {"query": result["query"]})
+        else:
+            flight = single_flight.begin(key)
+            try:
+                parser = SectionStreamParser()
+                async with admission.slot("llm"):
+                    started = time.perf_counter()
+                    first_token = True
+                    async for delta in llm_client.chat_stream(
+                        build_messages(request.query, request.db_type, request.datasource)
+                    ):
+                        if first_token:
+                            first_token = False
+                            stage_timer.record(
+                                "convert_stream", "llm_first_token", time.perf_counter() - started, request.db_type
+                            )
+                        for event in parser.feed(delta):
+                            yield sse_event(*stream_event_payload(*event))
+                    for event in parser.finish():
+                        yield sse_event(*stream_event_payload(*event))
+                stage_timer.record("convert_stream", "llm", time.perf_counter() - started, request.db_type)
+                with stage_timer.stage("convert_stream", "parse", request.db_type):
+                    result = parse_completion(parser.content)
+                await query_cache.set(
+                    key, result, nl_query=normalize_question(request.query), db_type=request.db_type.lower()
+                )
+                flight.set_result(result)
+            except Exception as e:
+                flight.set_exception(e)
+                raise
+            finally:
+                if not flight.done():
+                    flight.cancel()
+        await log_conversion(request.query, request.db_type, result, request.datasource)
 
+        response = QueryResponse(
+            generated_query=result["query"],
+            explanation=result["explanation"],
+            optimization_tips=result["optimization"],
+            db_type=request.db_type
+        )
+        yield sse_event("done", {**response.model_dump(), "cached": cached, "shared": shared})
+    except AdmissionRejected as e:
+        # Headers are already sent, the status goes in the event instead
+        yield sse_event("error", {**e.payload(), "status": e.status})
+    except Exception as e:
+        logger.error(f"Error in convert_query_stream: {e}")
+        yield sse_event("error", {"detail": str(e)})
+
+@api_router.post("/convert-query/stream")
+async def convert_query_stream(request: QueryRequest):
+    return StreamingResponse(
+        stream_conversion(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def convert_batch_item(index: int, item: QueryRequest, semaphore: asyncio.Semaphore) -> BatchItemResult:
+    async with semaphore:
+        try:
+            result = await cached_convert_nl_to_query(item.query, item.db_type, item.datasource)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            return BatchItemResult(index=index, success=False, error=detail)
+    await log_conversion(item.query, item.db_type, result, item.datasource)
+    return BatchItemResult(
+        index=index,
+        success=True,
+        result=QueryResponse(
+            generated_query=result["query"],
+            explanation=result["explanation"],
+            optimization_tips=result["optimization"],
+            db_type=item.db_type
+        )
+    )
+
+@api_router.post("/convert-query/batch", response_model=BatchQueryResponse)
+async def convert_query_batch(request: BatchQueryRequest):
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to convert")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    concurrency = min(request.concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    results = await asyncio.gather(*[
+        convert_batch_item(index, item, semaphore) for index, item in enumerate(request.items)
+    ])
+    succeeded = sum(1 for r in results if r.success)
+    return BatchQueryResponse(results=results, succeeded=succeeded, failed=len(results) - succeeded)
+
+def prepare_sql_query(raw_query: str) -> str:
+    query_str = clean_sql(raw_query)
+    sql_query = next((line.strip() for line in query_str.splitlines() if line.strip()), "")
+    if not sql_query:
+        raise HTTPException(status_code=400, detail="No valid SQL found in request")
+    verdict = analyze_sql(sql_query)
+    if not verdict.safe:
+        raise HTTPException(status_code=400, detail=f"Query rejected: {verdict.reason}")
+    return sql_query
+
+def prepare_mongo_query(raw_query: str, collection_name: Optional[str]) -> tuple:
+    try:
+        query_obj = parse_mongo(raw_query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not isinstance(query_obj, dict):
+        raise HTTPException(status_code=400, detail="The query must be a JSON object")
+    collection_name = collection_name or query_obj.get("find") or query_obj.get("aggregate") or "users"
+    verdict = analyze_mongo(query_obj, collection_name)
+    if not verdict.safe:
+        raise HTTPException(status_code=400, detail=f"Query rejected: {verdict.reason}")
+    return collection_name, query_obj
+
+def build_mongo_cursor(collection, query_obj: dict, limit: Optional[int] = 100, max_time_ms: Optional[int] = None,
+                       comment: Optional[str] = None):
+    # The comment tags the operation so a job can find it again for killOp
+    options = {"comment": comment} if comment else {}
+    if "find" in query_obj:
+        filter_dict = query_obj.get("filter", {})
+        projection = query_obj.get("projection", {"_id": 0})
+        cursor = collection.find(filter_dict, projection, **options)
+        if "hint" in query_obj:
+            cursor = cursor.hint(query_obj["hint"])
+    elif "aggregate" in query_obj:
+        pipeline = query_obj.get("pipeline", [])
+        options.update({key: query_obj[key] for key in ("hint", "allowDiskUse") if key in query_obj})
+        if max_time_ms:
+            options["maxTimeMS"] = max_time_ms
+        return collection.aggregate(pipeline, **options)
+    else:
+        cursor = collection.find(query_obj, {"_id": 0}, **options)
+    if max_time_ms:
+        cursor = cursor.max_time_ms(max_time_ms)
+    return cursor.limit(limit) if limit else cursor
+
+async def run_query(request: ExecuteRequest, http_request: Request) -> ExecuteResponse:
+    try:
+        db_type = request.db_type.lower()
+        if db_type not in ("sql", "mongodb"):
+            return ExecuteResponse(success=False, results=[], row_count=0, error=f"Invalid db_type: {request.db_type}")
+        source = datasources.get(db_type, request.datasource)
+        cache = None
+        if result_cache.enabled and request.cache and source.result_cache_ttl != 0:
+            with stage_timer.stage("execute", "result_cache", db_type):
+                cache = result_cache_lookup(source, db_type, request)
+            if cache is not None and cache[2] is not None:
+                entry = cache[2]
+                return entry.value.model_copy(update={"cached": True, "cache_age": round(entry.age(), 3)})
+        async with admission.slot(db_type), datasources.lease(db_type, request.datasource) as source:
+            if db_type == "sql":
+                response = await run_sql_query(source, request, http_request)
+            else:
+                response = await run_mongo_query(source, request)
+        if cache is not None and response.success:
+            key, tables, _, versions = cache
+            result_cache.set(
+                key, source.name, tables, versions, response, response.results, ttl=source.result_cache_ttl
+            )
+        return response
+
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Error executing query: {e}")
         return ExecuteResponse(success=False, results=[], row_count=0, error=str(e))
 
+def result_cache_lookup(source, db_type: str, request: ExecuteRequest) -> Optional[tuple]:
+    """Key, tables, cached entry (or None) and table versions for a query, None if it can't be cached."""
+    if db_type == "sql":
+        sql_query = prepare_sql_query(request.query)
+        query_text = normalize_sql(sql_query)
+        # Memoized, this is the verdict prepare_sql_query just computed
+        verdict = analyze_sql(sql_query)
+    else:
+        collection_name, query_obj = prepare_mongo_query(request.query, request.collection_name)
+        query_text = canonical_mongo(collection_name, query_obj)
+        verdict = analyze_mongo(query_obj, collection_name)
+    tables = ResultCache.tables_for(verdict.tables)
+    if is_volatile(db_type, query_text):
+        return None
+    key = ResultCache.make_key(source.name, db_type, query_text)
+    # Versions are taken before the query runs, a change while it runs makes its result stale
+    return key, tables, result_cache.get(key), result_cache.versions(source.name, tables)
+
+async def run_sql_query(source, request: ExecuteRequest, http_request: Request) -> ExecuteResponse:
+    db_type = "sql"
+    with stage_timer.stage("execute", "prepare", db_type):
+        sql_query = prepare_sql_query(request.query)
+    with stage_timer.stage("execute", "cost_guard", db_type):
+        cost = await source.cost_guard.check_sql(sql_query)
+    if cost["action"] == "blocked":
+        return ExecuteResponse(
+            success=False, results=[], row_count=0,
+            error=f"Query blocked by cost guard: {'; '.join(cost['reasons'])}", cost=cost
+        )
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    try:
+        rows = await source.executor.fetch_all(
+            cost["query"], is_disconnected=http_request.is_disconnected, timings=timings
+        )
+    except Exception:
+        stage_timer.record("execute", "db", time.perf_counter() - started, db_type, "error")
+        raise
+    elapsed = time.perf_counter() - started
+    # Whatever the worker didn't spend executing was spent waiting for it
+    stage_timer.record("execute", "db_wait", max(0.0, elapsed - sum(timings.values())), db_type)
+    stage_timer.record("execute", "db", timings.get("execute", 0.0), db_type)
+    stage_timer.record("execute", "convert_rows", timings.get("convert_rows", 0.0), db_type)
+
+    # Rows come straight from the driver, skip validating every one of them
+    return ExecuteResponse.model_construct(success=True, results=rows, row_count=len(rows), cost=cost)
+
+async def run_mongo_query(source, request: ExecuteRequest) -> ExecuteResponse:
+    db_type = "mongodb"
+    with stage_timer.stage("execute", "prepare", db_type):
+        collection_name, query_obj = prepare_mongo_query(request.query, request.collection_name)
+    with stage_timer.stage("execute", "cost_guard", db_type):
+        query_obj, cost = source.cost_guard.guard_mongo(query_obj)
+    with stage_timer.stage("execute", "optimize", db_type):
+        query_obj, cost["optimizations"] = source.optimizer.optimize(collection_name, query_obj)
+    with stage_timer.stage("execute", "db", db_type):
+        cursor = build_mongo_cursor(source.db[collection_name], query_obj, max_time_ms=cost["max_time_ms"])
+        results = await cursor.to_list(length=100)
+    return ExecuteResponse.model_construct(
+        success=True, results=results, row_count=len(results), cost=cost
+    )
+
+@api_router.post("/execute-query", response_model=ExecuteResponse)
+async def execute_query(request: ExecuteRequest, http_request: Request):
+    shape = request.shape.lower()
+    if shape not in RESULT_SHAPES:
+        raise HTTPException(status_code=400, detail=f"Invalid shape: {request.shape}")
+    started = time.perf_counter()
+    response = await run_query(request, http_request)
+    duration_ms = round(1000 * (time.perf_counter() - started), 2)
+    if response.success:
+        similarity_index.confirm(request.query, request.db_type, request.datasource)
+    executed_query = (response.cost or {}).get("query", request.query)
+    await history_writer.submit({
+        "id": str(uuid.uuid4()),
+        "event": "execution",
+        "db_type": request.db_type,
+        "datasource": request.datasource,
+        "query": executed_query,
+        "success": response.success,
+        "row_count": response.row_count,
+        "duration_ms": duration_ms,
+        "error": response.error,
+        "cached": response.cached,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    if SLOW_QUERY_MS and duration_ms >= SLOW_QUERY_MS:
+        slow_queries.inc(db_type=request.db_type.lower())
+        timing = current_timing()
+        slow_query_logger.warning(
+            f"Slow {request.db_type} query took {duration_ms} ms "
+            f"(rows={response.row_count}, success={response.success}, "
+            f"stages={timing.summary() if timing else {}}): {executed_query[:1000]}"
+        )
+    stage_timer.record(
+        "execute", "total", duration_ms / 1000, request.db_type, "ok" if response.success else "error"
+    )
+    with stage_timer.stage("execute", "serialize", request.db_type):
+        # Serialized here rather than by FastAPI so the cost shows up as a stage
+        if shape != "records":
+            return Response(encode_columnar(dict(response), shape), media_type="application/json")
+        return JSONResponse(response.model_dump(mode="json"))
+
+async def prepare_result_stream(source, request: ExecuteRequest, max_rows: int, batch_size: int,
+                                timeout: float, comment: Optional[str] = None) -> tuple:
+    """Validate a query for streaming.
+
+    Returns the query that will run and a coroutine function that starts it
+    and returns its column names (None for Mongo) and row batches.
+    """
+    if source.db_type == "sql":
+        sql_query = prepare_sql_query(request.query)
+        cost = await source.cost_guard.check_sql(sql_query)
+        if cost["action"] == "blocked":
+            raise HTTPException(
+                status_code=400, detail=f"Query blocked by cost guard: {'; '.join(cost['reasons'])}"
+            )
+
+        async def open_sql():
+            # Bounded by max_rows, so the LIMIT rewrite doesn't apply
+            stream = source.executor.stream(sql_query, batch_size=batch_size, max_rows=max_rows, timeout=timeout)
+            # The first item is the column list
+            columns = await stream.__anext__()
+            return columns, stream
+        return sql_query, open_sql
+
+    collection_name, query_obj = prepare_mongo_query(request.query, request.collection_name)
+    query_obj, _ = source.optimizer.optimize(collection_name, query_obj)
+
+    async def open_mongo():
+        cursor = build_mongo_cursor(
+            source.db[collection_name], query_obj, limit=max_rows,
+            max_time_ms=int(timeout * 1000), comment=comment,
+        ).batch_size(batch_size)
+        return None, mongo_batches(cursor, batch_size, max_rows)
+    return request.query, open_mongo
+
+@api_router.post("/execute-query/stream")
+async def execute_query_stream(request: StreamExecuteRequest):
+    fmt = request.format.lower()
+    if fmt not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format: {request.format}")
+    if fmt == "arrow" and not arrow_available():
+        raise HTTPException(status_code=400, detail="Arrow export requires pyarrow to be installed")
+    max_rows, batch_size = row_caps(request.max_rows, request.batch_size, STREAM_MAX_ROWS, STREAM_BATCH_SIZE)
+
+    try:
+        db_type = request.db_type.lower()
+        if db_type not in ("sql", "mongodb"):
+            raise HTTPException(status_code=400, detail=f"Invalid db_type: {request.db_type}")
+        source = datasources.get(db_type, request.datasource)
+        _, open_stream = await prepare_result_stream(
+            source, request, max_rows, batch_size, STREAM_STATEMENT_TIMEOUT
+        )
+        # Held until the export has been sent, not just until it started
+        slot = await admission.acquire(db_type)
+        try:
+            # For SQL this returns once the statement has executed, so SQL errors
+            # still surface as a 400
+            columns, batches = await open_stream()
+        except BaseException:
+            await slot.aclose()
+            raise
+    except (HTTPException, AdmissionRejected):
+        raise
+    except Exception as e:
+        logger.error(f"Error executing streamed query: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Keep the source from being evicted while the export is still running
+    batches = datasources.leased_stream(source, release_after(batches, slot))
+    if fmt == "arrow":
+        body, media_type = encode_arrow(batches, columns), ARROW_MEDIA_TYPE
+    else:
+        body, media_type = encode_ndjson(batches), NDJSON_MEDIA_TYPE
+    return StreamingResponse(body, media_type=media_type, headers={"X-Row-Cap": str(max_rows)})
+
+
+@api_router.post("/jobs", status_code=202)
+async def submit_query_job(request: JobRequest):
+    max_rows, batch_size = row_caps(request.max_rows, request.batch_size, STREAM_MAX_ROWS, STREAM_BATCH_SIZE)
+    job_id = str(uuid.uuid4())
+    comment = f"datawhiz-job:{job_id}"
+    try:
+        db_type = request.db_type.lower()
+        if db_type not in ("sql", "mongodb"):
+            raise HTTPException(status_code=400, detail=f"Invalid db_type: {request.db_type}")
+        source = datasources.get(db_type, request.datasource)
+        executed_query, open_stream = await prepare_result_stream(
+            source, request, max_rows, batch_size, JOBS_STATEMENT_TIMEOUT, comment=comment
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def open_job():
+        columns, batches = await open_stream()
+        return columns, datasources.leased_stream(source, batches)
+
+    # Closing a SQL stream kills the statement, Mongo needs an explicit killOp
+    kill = (lambda: source.kill_operations(comment)) if db_type == "mongodb" else None
+    try:
+        job = query_jobs.submit(
+            db_type, request.datasource, request.query, open_job, max_rows,
+            kill=kill, job_id=job_id, executed_query=executed_query,
+            # Taken once the job leaves the queue, an overloaded path fails the job
+            slot=lambda: admission.slot(db_type),
+        )
+    except JobError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.status()
+
+def get_query_job(job_id: str):
+    job = query_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    return job
+
+@api_router.get("/jobs/{job_id}")
+async def get_query_job_status(job_id: str):
+    return get_query_job(job_id).status()
+
+@api_router.get("/jobs/{job_id}/results")
+async def get_query_job_results(job_id: str, page: int = 1, page_size: int = 1000):
+    job = get_query_job(job_id)
+    if page < 1 or not 1 <= page_size <= JOBS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"page must be >= 1 and page_size between 1 and {JOBS_MAX_PAGE_SIZE}")
+    rows = job.rows
+    results = await query_jobs.page(job, page, page_size)
+    return Response(orjson.dumps({
+        "job_id": job.id,
+        "state": job.state,
+        "columns": job.columns,
+        "page": page,
+        "page_size": page_size,
+        "total_rows": rows,
+        # More rows may still arrive while the job runs
+        "has_more": page * page_size < rows or not job.finished,
+        "results": results,
+    }), media_type="application/json")
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_query_job(job_id: str):
+    get_query_job(job_id)
+    job = await query_jobs.cancel(job_id)
+    return job.status()
+
+@api_router.delete("/jobs/{job_id}")
+async def delete_query_job(job_id: str):
+    if not await query_jobs.delete(job_id):
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+    return {"deleted": job_id}
+
+async def record_query_job(job):
+    if job.state == "succeeded":
+        similarity_index.confirm(job.query, job.db_type, job.datasource)
+    duration = job.duration()
+    await history_writer.submit({
+        "id": str(uuid.uuid4()),
+        "event": "execution",
+        "db_type": job.db_type,
+        "datasource": job.datasource,
+        "query": job.executed_query,
+        "job_id": job.id,
+        "success": job.state == "succeeded",
+        "row_count": job.rows,
+        "duration_ms": round(1000 * duration, 2) if duration is not None else None,
+        "error": job.error or (f"Job {job.state}" if job.state != "succeeded" else None),
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+@api_router.get("/datasources")
+async def list_datasources():
+    return {"datasources": [
+        {"name": name, "db_type": options["type"]} for name, options in datasources.config.items()
+    ]}
 
 @api_router.get("/tables")
-async def get_sql_tables():
+async def get_sql_tables(datasource: Optional[str] = None):
     try:
-        inspector = inspect(engine)
-        tables = inspector.get_table_names()
+        tables = await datasources.get("sql", datasource).catalog.names("sql")
         return {"tables": tables}
+    except DataSourceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting tables: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/collections")
-async def get_mongo_collections():
+async def get_mongo_collections(datasource: Optional[str] = None):
     try:
-        collections = await db.list_collection_names()
+        collections = await datasources.get("mongodb", datasource).catalog.names("mongodb")
         return {"collections": collections}
+    except DataSourceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting collections: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/schema/{db_type}/{name}", response_model=SchemaResponse)
-async def get_schema(db_type: str, name: str):
+async def get_schema(db_type: str, name: str, datasource: Optional[str] = None):
     try:
         db_type = db_type.lower()
         if db_type not in ["sql", "mongodb"]:
             raise HTTPException(status_code=400, detail=f"Invalid db_type: {db_type}")
 
-        if db_type == "sql":
-            inspector = inspect(engine)
-            columns = inspector.get_columns(name)
-            
-            schema = {
-                "columns": [
-                    {
-                        "name": col["name"],
-                        "type": str(col["type"]),
-                        "nullable": col.get("nullable", True)
-                    }
-                    for col in columns
-                ]
-            }
-            
-            with engine.connect() as conn:
-                result = conn.execute(text(f"SELECT * FROM {name} LIMIT 5"))
-                sample_data = [dict(row._mapping) for row in result]
-            
-            return SchemaResponse(schema_info=schema, sample_data=sample_data)
-
-        elif db_type == "mongodb":
-            collection = db[name]
-            sample_doc = await collection.find_one({}, {"_id": 0})
-            
-            schema = {
-                "fields": [
-                    {"name": key, "type": type(value).__name__}
-                    for key, value in (sample_doc or {}).items()
-                ]
-            }
-            
-            cursor = collection.find({}, {"_id": 0}).limit(5)
-            sample_data = await cursor.to_list(length=5)
-            
-            return SchemaResponse(schema_info=schema, sample_data=sample_data)
+        entry = await datasources.get(db_type, datasource).catalog.get(db_type, name)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Unknown {db_type} object: {name}")
+
+        schema = {key: value for key, value in entry.items() if key not in ("name", "sample_data")}
+        return SchemaResponse(schema_info=schema, sample_data=entry["sample_data"])
 
+    except HTTPException:
+        raise
+    except DataSourceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting schema: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/insights", response_model=InsightResponse)
-async def get_insights():
+async def get_insights(bucket: str = "all", period: Optional[str] = None):
     try:
-        pipeline = [
-            {"$group": {"_id": "$nl_query", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 5}
-        ]
-        common_queries_cursor = db.query_history.aggregate(pipeline)
-        common_queries = [doc["_id"] async for doc in common_queries_cursor]
-        
+        if bucket not in ["all", "hour", "day"]:
+            raise HTTPException(status_code=400, detail=f"Invalid bucket: {bucket}")
+        top_questions = await insight_rollups.top("question", bucket, period)
+        common_queries = [doc["text"] for doc in top_questions]
+        top_tables = await insight_rollups.top("table", bucket, period)
         freq_tables = [
-    {"name": "customers", "count": 45, "db_type": "sql"},
-    {"name": "orders", "count": 38, "db_type": "sql"},
-    {"name": "products", "count": 32, "db_type": "sql"},
-    {"name": "users", "count": 28, "db_type": "mongodb"},
-    {"name": "events", "count": 15, "db_type": "mongodb"},
-]
+            {"name": doc["key"], "count": doc["count"], "db_type": doc["db_type"]}
+            for doc in top_tables
+        ]
         return InsightResponse(
             common_queries=common_queries if common_queries else [
                 "Show all customers from India",
@@ -373,196 +875,328 @@ async def get_insights():
             ],
             frequent_tables=freq_tables
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting insights: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/admin/llm-stats")
+async def get_llm_stats():
+    return llm_client.stats()
+
+def admin_sources(db_type: Optional[str] = None, datasource: Optional[str] = None):
+    """The named source, or every active one of ``db_type`` when none is named."""
+    if datasource is None:
+        return datasources.active(db_type)
+    options = datasources.config.get(datasource)
+    if options is None:
+        raise HTTPException(status_code=404, detail=f"Unknown datasource: {datasource}")
+    if db_type and options["type"] != db_type:
+        raise HTTPException(status_code=400, detail=f"Datasource {datasource} is {options['type']}, not {db_type}")
+    return [datasources.get(options["type"], datasource)]
+
+@api_router.get("/admin/datasources")
+async def get_datasource_stats(check: bool = False):
+    if check:
+        await asyncio.gather(*[source.health() for source in datasources.active()])
+    return datasources.stats()
+
+@api_router.post("/admin/datasources/{name}/health")
+async def check_datasource_health(name: str):
+    source = admin_sources(datasource=name)[0]
+    return {"name": name, **await source.health()}
+
+@api_router.post("/admin/datasources/evict")
+async def evict_idle_datasources():
+    return {"evicted": await datasources.evict_idle()}
+
+@api_router.get("/admin/sql-stats")
+async def get_sql_stats(datasource: Optional[str] = None):
+    return {source.name: source.executor.stats() for source in admin_sources("sql", datasource)}
+
+@api_router.get("/admin/schema-catalog")
+async def get_schema_catalog_stats(datasource: Optional[str] = None):
+    return {source.name: source.catalog.stats() for source in admin_sources(None, datasource)}
+
+@api_router.post("/admin/schema-catalog/refresh")
+async def refresh_schema_catalog(db_type: Optional[str] = None, datasource: Optional[str] = None):
+    return {
+        source.name: await source.catalog.refresh(source.db_type)
+        for source in admin_sources(db_type, datasource)
+    }
+
+@api_router.get("/admin/cost-guard")
+async def get_cost_guard_stats(datasource: Optional[str] = None):
+    return {source.name: source.cost_guard.stats() for source in admin_sources(None, datasource)}
+
+@api_router.get("/admin/mongo-optimizer")
+async def get_mongo_optimizer_stats(datasource: Optional[str] = None):
+    return {source.name: source.optimizer.stats() for source in admin_sources("mongodb", datasource)}
+
+@api_router.post("/admin/mongo-optimizer/explain")
+async def explain_mongo_optimizer(request: ExecuteRequest):
+    """Documents examined by a Mongo query as written and after optimization."""
+    source = admin_sources("mongodb", request.datasource or "mongodb")[0]
+    try:
+        collection_name, query_obj = prepare_mongo_query(request.query, request.collection_name)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"collection": collection_name, **await source.optimizer.explain(source.db, collection_name, query_obj)}
+
+@api_router.get("/admin/index-advisor")
+async def get_index_recommendations(datasource: Optional[str] = None, limit: int = 20):
+    try:
+        return {"datasources": await index_advisor.recommend(datasource, limit), **index_advisor.stats()}
+    except DataSourceError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error building index recommendations: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/index-advisor/apply")
+async def apply_index_recommendations(request: IndexApplyRequest):
+    try:
+        return await index_advisor.apply(request.datasource, request.ids, request.top, request.dry_run)
+    except DataSourceError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error applying index recommendations: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/admin/similarity-index")
+async def get_similarity_index_stats():
+    return similarity_index.stats()
+
+@api_router.get("/admin/history-writer")
+async def get_history_writer_stats():
+    return history_writer.stats()
+
+@api_router.get("/admin/admission")
+async def get_admission_stats():
+    return admission.stats()
+
+@api_router.get("/admin/query-jobs")
+async def get_query_job_stats():
+    return query_jobs.stats()
+
+@api_router.get("/admin/result-cache")
+async def get_result_cache_stats():
+    return result_cache.stats()
+
+@api_router.post("/admin/result-cache/invalidate")
+async def invalidate_result_cache(request: ResultCacheInvalidateRequest):
+    if request.datasource not in datasources.config:
+        raise HTTPException(status_code=404, detail=f"Unknown datasource: {request.datasource}")
+    dropped = result_cache.invalidate(request.datasource, request.tables)
+    return {"datasource": request.datasource, "tables": request.tables, "dropped": dropped}
+
+@api_router.delete("/admin/result-cache")
+async def purge_result_cache():
+    return {"purged": result_cache.clear()}
+
+@api_router.get("/admin/query-cache")
+async def get_query_cache_stats():
+    return {**query_cache.stats(), "single_flight": single_flight.stats()}
+
+@api_router.delete("/admin/query-cache")
+async def purge_query_cache():
+    try:
+        return await query_cache.purge()
+    except Exception as e:
+        logger.error(f"Error purging query cache: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _pick(stats: Dict[str, Any], keys: List[str]) -> Dict[tuple, Any]:
+    return {(key,): stats.get(key, 0) for key in keys}
+
+metrics.callback("llm_in_flight", "LLM calls holding a concurrency slot", lambda: llm_client.stats()["in_flight"])
+metrics.callback("llm_waiting", "LLM calls waiting for a concurrency slot", lambda: llm_client.stats()["waiting"])
+metrics.callback(
+    "llm_pool_connections", "LLM HTTP connections by state",
+    lambda: _pick(llm_client.stats()["pool"], ["acquired", "idle"]), ["state"],
+)
+metrics.callback(
+    "llm_events_total", "LLM client calls, upstream requests, retries and failures",
+    lambda: _pick(llm_client.stats(), ["calls", "requests", "retries", "errors", "rate_limited"]),
+    ["event"], kind="counter",
+)
+metrics.callback(
+    "llm_tokens_total", "Tokens reported by the LLM API",
+    lambda: {(kind,): llm_client.stats()[f"{kind}_tokens"] for kind in ("prompt", "completion")},
+    ["kind"], kind="counter",
+)
+def _per_source(db_type: Optional[str], stats_for, keys: List[str]) -> Dict[tuple, Any]:
+    values = {}
+    for source in datasources.active(db_type):
+        stats = stats_for(source)
+        for key in keys:
+            values[(source.name, key)] = stats.get(key, 0)
+    return values
+
+metrics.callback(
+    "sql_pool_connections", "SQL pool connections by datasource and state",
+    lambda: _per_source("sql", lambda s: s.executor.stats()["pool"], ["checkedout", "checkedin", "overflow"]),
+    ["datasource", "state"],
+)
+metrics.callback(
+    "sql_executor_tasks", "SQL executor work by datasource and state",
+    lambda: _per_source("sql", lambda s: s.executor.stats(), ["pending", "running"]), ["datasource", "state"],
+)
+metrics.callback(
+    "sql_queries_total", "SQL queries run through the executor and how they failed",
+    lambda: _per_source("sql", lambda s: s.executor.stats(), ["queries", "timeouts", "cancelled", "errors"]),
+    ["datasource", "event"], kind="counter",
+)
+metrics.callback(
+    "mongo_pool_connections", "MongoDB pool connections by datasource and state",
+    lambda: _per_source("mongodb", lambda s: s.pool_stats(), ["open", "checked_out"]), ["datasource", "state"],
+)
+metrics.callback(
+    "datasource_pool_utilization", "Checked out connections over pool capacity",
+    lambda: {(s.name, s.db_type): s.pool_stats().get("utilization") or 0 for s in datasources.active()},
+    ["datasource", "db_type"],
+)
+metrics.callback(
+    "datasource_in_use", "Requests currently holding each datasource",
+    lambda: {(s.name, s.db_type): s.in_use for s in datasources.active()}, ["datasource", "db_type"],
+)
+metrics.callback(
+    "datasources_total", "Datasources created and evicted for idleness",
+    lambda: _pick(datasources.stats(), ["created", "evicted"]), ["event"], kind="counter",
+)
+metrics.callback("history_queue_depth", "Query history entries waiting to be written",
+                 lambda: history_writer.stats()["queue_depth"])
+metrics.callback(
+    "history_entries_total", "Query history entries by result",
+    lambda: _pick(history_writer.stats(), ["enqueued", "written", "dropped"]), ["result"], kind="counter",
+)
+metrics.callback(
+    "query_cache_lookups_total", "Conversion cache lookups by result",
+    lambda: _pick(query_cache.stats(), ["local_hits", "shared_hits", "misses"]), ["result"], kind="counter",
+)
+metrics.callback("query_cache_local_entries", "Entries in the in-process conversion cache",
+                 lambda: query_cache.stats()["local_size"])
+metrics.callback(
+    "similarity_lookups_total", "Conversions answered from a similar question, given examples, or missed",
+    lambda: _pick(similarity_index.stats(), ["answered", "few_shot", "misses"]), ["result"], kind="counter",
+)
+metrics.callback("similarity_entries", "Question and query pairs in the similarity index",
+                 lambda: similarity_index.stats()["entries"])
+metrics.callback("single_flight_in_flight", "Conversions currently being generated",
+                 lambda: single_flight.stats()["in_flight"])
+metrics.callback(
+    "single_flight_calls_total", "Conversions that started a flight or joined one",
+    lambda: _pick(single_flight.stats(), ["leaders", "shared"]), ["role"], kind="counter",
+)
+metrics.callback(
+    "result_cache_lookups_total", "Execute-query result cache lookups by outcome",
+    lambda: _pick(result_cache.stats(), ["hits", "misses", "stale", "expired"]), ["outcome"], kind="counter",
+)
+metrics.callback("result_cache_bytes", "Serialized size of the cached query results",
+                 lambda: result_cache.stats()["bytes"])
+metrics.callback("result_cache_entries", "Query results in the result cache",
+                 lambda: result_cache.stats()["entries"])
+metrics.callback(
+    "admission_in_flight", "Requests holding a concurrency slot by budget",
+    lambda: {(name,): admission.budgets[name].in_flight for name in BUDGETS}, ["budget"],
+)
+metrics.callback(
+    "admission_queued", "Requests waiting for a concurrency slot by budget",
+    lambda: {(name,): admission.budgets[name].waiting for name in BUDGETS}, ["budget"],
+)
+metrics.callback(
+    "admission_requests_total", "Admission decisions by budget and outcome",
+    lambda: {
+        (name, outcome): admission.budgets[name].stats()[outcome]
+        for name in BUDGETS for outcome in ("admitted", "queued", "rejected", "timed_out")
+    },
+    ["budget", "outcome"], kind="counter",
+)
+metrics.callback(
+    "rate_limit_requests_total", "Requests checked against the per-client rate limit",
+    lambda: _pick(admission.rate_limiter.stats(), ["allowed", "limited"]), ["result"], kind="counter",
+)
+metrics.callback(
+    "query_jobs", "Query jobs by state", lambda: _pick(query_jobs.stats()["states"], list(JOB_STATES)), ["state"],
+)
+metrics.callback(
+    "query_jobs_finished_total", "Query jobs by how they finished, and expired results",
+    lambda: _pick(query_jobs.stats(), ["succeeded", "failed", "cancelled", "expired"]), ["outcome"], kind="counter",
+)
+metrics.callback("query_jobs_spilled_bytes", "Bytes of job results kept on local disk",
+                 lambda: query_jobs.stats()["spilled_bytes"])
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
 app.include_router(api_router)
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, e: AdmissionRejected):
+    return JSONResponse(e.payload(), status_code=e.status, headers=e.headers())
+
+# Innermost, so rate-limited responses still get CORS headers and metrics
+app.add_middleware(AdmissionMiddleware, controller=admission)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
+)
+app.add_middleware(
+    MetricsMiddleware,
+    histogram=http_request_duration,
+    server_timing=SERVER_TIMING_ENABLED,
+    route_for=route_template(app),
 )
 
 @app.on_event("startup")
 async def startup_db():
-    await init_sample_data()
+    await llm_client.start()
+    try:
+        await query_cache.ensure_indexes()
+        await insight_rollups.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating indexes: {e}")
+    history_writer.start()
+    datasources.start()
+    query_jobs.start()
+    result_cache.start(datasources)
+    try:
+        loaded = await similarity_index.load(db.query_history, limit=SIMILARITY_HISTORY_LIMIT)
+        logger.info(f"Similarity index loaded {loaded} question/query pairs")
+    except Exception as e:
+        logger.error(f"Error loading the similarity index: {e}")
+    await check_sample_data()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await query_jobs.close()
+    await result_cache.stop()
+    await history_writer.stop()
+    await datasources.close()
+    await llm_client.close()
     client.close()
 
-async def init_sample_data():
+async def check_sample_data():
+    """Warn about missing demo tables/collections, seeding is done by `python -m seeder`."""
     try:
-        from sqlalchemy import text as sql_text
-        with engine.connect() as conn:
-            conn.execute(sql_text("""
-                CREATE TABLE IF NOT EXISTS customers (
-                    customer_id INT PRIMARY KEY AUTO_INCREMENT,
-                    name VARCHAR(100),
-                    email VARCHAR(100),
-                    country VARCHAR(50),
-                    city VARCHAR(50),
-                    registration_date DATE
-                )
-            """))
-            
-            conn.execute(sql_text("""
-                CREATE TABLE IF NOT EXISTS products (
-                    product_id INT PRIMARY KEY AUTO_INCREMENT,
-                    name VARCHAR(100),
-                    category VARCHAR(50),
-                    price DECIMAL(10,2),
-                    stock_quantity INT
-                )
-            """))
-            
-            conn.execute(sql_text("""
-                CREATE TABLE IF NOT EXISTS orders (
-                    order_id INT PRIMARY KEY AUTO_INCREMENT,
-                    customer_id INT,
-                    order_date DATE,
-                    total_amount DECIMAL(10,2),
-                    status VARCHAR(20)
-                )
-            """))
-            
-            conn.execute(sql_text("""
-                CREATE TABLE IF NOT EXISTS order_items (
-                    item_id INT PRIMARY KEY AUTO_INCREMENT,
-                    order_id INT,
-                    product_id INT,
-                    quantity INT,
-                    price DECIMAL(10,2)
-                )
-            """))
-            
-            conn.commit()
-            result = conn.execute(sql_text("SELECT COUNT(*) as count FROM customers"))
-            count = result.fetchone()[0]
-            
-            if count == 0:
-                conn.execute(sql_text("""
-                    INSERT INTO customers (name, email, country, city, registration_date) VALUES
-                    ('Anant Singh', 'anant@gmail.com', 'India', 'Mumbai', '2025-01-15'),
-                    ('Sandhya Piath', 'sandhya@gmail.com', 'USA', 'New York', '2025-02-20'),
-                    ('Amit Patel', 'amit@gmail.com', 'India', 'Delhi', '2025-03-10'),
-                    ('Dhruv Mishra', 'dhruv@gmail.com', 'UK', 'London', '2025-04-05'),
-                    ('Shifa Khan', 'shifa@gmail.com', 'Dubai', 'Jumeirah', '2025-04-05'),
-                    ('Priya Singh', 'priya@gmail.com', 'India', 'Bangalore', '2025-05-12')
-                """))
-                
-                conn.execute(sql_text("""
-                    INSERT INTO products (name, category, price, stock_quantity) VALUES
-                    ('Laptop', 'Electronics', 899.99, 50),
-                    ('Smartphone', 'Electronics', 599.99, 100),
-                    ('Headphones', 'Accessories', 79.99, 200),
-                    ('Keyboard', 'Accessories', 49.99, 150),
-                    ('Mouse', 'Accessories', 29.99, 300)
-                """))
-                
-                conn.execute(sql_text("""
-                    INSERT INTO orders (customer_id, order_date, total_amount, status) VALUES
-                    (1, '2025-06-01', 979.98, 'delivered'),
-                    (2, '2025-06-05', 599.99, 'delivered'),
-                    (3, '2025-06-10', 129.98, 'shipped'),
-                    (4, '2025-06-15', 899.99, 'processing'),
-                    (5, '2025-06-20', 79.99, 'delivered')
-                """))
-                
-                conn.commit()
-                logger.info("MySQL sample data initialized")
-        
-        users_count = await db.users.count_documents({})
-        if users_count == 0:
-            await db.users.insert_many([
-                {
-                    "user_id": "U001",
-                    "name": "Arya Tiwari",
-                    "email": "arya@gmail.com",
-                    "age": 32,
-                    "country": "USA",
-                    "registration_date": "2025-01-15"
-                },
-                {
-                    "user_id": "U002",
-                    "name": "Pradeep Khushwaha",
-                    "email": "pradeep@gmail.com",
-                    "age": 28,
-                    "country": "UK",
-                    "registration_date": "2025-02-20"
-                },
-                {
-                    "user_id": "U003",
-                    "name": "Rahul Sharma",
-                    "email": "rahul@gmail.com",
-                    "age": 35,
-                    "country": "India",
-                    "registration_date": "2025-03-10"
-                },
-                {
-                    "user_id": "U004",
-                    "name": "Tasmayee Singh",
-                    "email": "tasmayee@gmail.com",
-                    "age": 29,
-                    "country": "Spain",
-                    "registration_date": "2025-04-05"
-                },
-                {
-                    "user_id": "U005",
-                    "name": "Krishna Jaiswal",
-                    "email": "krishna@gmail.com",
-                    "age": 41,
-                    "country": "China",
-                    "registration_date": "2025-05-12"
-                }
-            ])
-            
-            await db.events.insert_many([
-                {
-                    "event_id": "E001",
-                    "user_id": "U001",
-                    "event_type": "page_view",
-                    "timestamp": "2025-06-01T10:30:00Z",
-                    "properties": {"page": "/home"}
-                },
-                {
-                    "event_id": "E002",
-                    "user_id": "U002",
-                    "event_type": "purchase",
-                    "timestamp": "2025-06-02T14:20:00Z",
-                    "properties": {"amount": 99.99, "product": "Headphones"}
-                },
-                {
-                    "event_id": "E003",
-                    "user_id": "U003",
-                    "event_type": "signup",
-                    "timestamp": "2025-06-03T09:15:00Z",
-                    "properties": {"source": "google"}
-                }
-            ])
-            
-            await db.sessions.insert_many([
-                {
-                    "session_id": "S001",
-                    "user_id": "U001",
-                    "start_time": "2025-06-01T10:00:00Z",
-                    "end_time": "2025-06-01T10:45:00Z",
-                    "duration_minutes": 45
-                },
-                {
-                    "session_id": "S002",
-                    "user_id": "U002",
-                    "start_time": "2025-06-02T14:00:00Z",
-                    "end_time": "2025-06-02T15:30:00Z",
-                    "duration_minutes": 90
-                }
-            ])
-            
-            logger.info("MongoDB sample data initialized")
-    
+        missing = []
+        if "sql" in datasources.config:
+            source = datasources.get("sql")
+            missing += await source.executor.run(missing_sql_tables, source.engine)
+        if "mongodb" in datasources.config:
+            missing += await missing_mongo_collections(datasources.get("mongodb").db)
+        if missing:
+            logger.warning(
+                f"Missing sample tables/collections: {', '.join(missing)}. "
+                f"Load them with: python -m seeder --scale tiny"
+            )
     except Exception as e:
-        logger.error(f"Error initializing sample data: {e}")
\ No newline at end of file
+        logger.error(f"Error checking sample data: {e}")
@@ -0,0 +1,280 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """A gauge or counter read from ``fn`` at scrape time.
+
+    ``fn`` returns a number, or a dict mapping label value tuples to numbers.
+    """
+
+    def __init__(self, name, help_text, fn: Callable[[], Any], labelnames=(), kind: str = "gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        values = self.fn()
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry for a single process."""
+
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._metrics: List[_Metric] = []
+
+    def _name(self, name: str) -> str:
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(self._name(name), help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(self._name(name), help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name: str, help_text: str, fn: Callable[[], Any], labelnames: Sequence[str] = (),
+                 kind: str = "gauge") -> CallbackMetric:
+        metric = CallbackMetric(self._name(name), help_text, fn, labelnames, kind)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestTiming:
+    """Stage durations collected while serving one request."""
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+
+    def add(self, stage: str, seconds: float):
+        self.stages.append((stage, seconds))
+
+    def summary(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for stage, seconds in self.stages:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return {stage: round(1000 * seconds, 2) for stage, seconds in totals.items()}
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        parts = [f"{stage};dur={ms}" for stage, ms in self.summary().items()]
+        if total is not None:
+            parts.append(f"app;dur={round(1000 * total, 2)}")
+        return ", ".join(parts)
+
+
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current_timing.get()
+
+
+class StageTimer:
+    """Records how long each stage of a request path takes.
+
+    Every stage is observed in one histogram labelled by path, stage,
+    db_type and outcome, and added to the current request's timing so it
+    can be returned as a Server-Timing header.
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def record(self, path: str, stage: str, seconds: float, db_type: str = "", outcome: str = "ok"):
+        self.histogram.observe(seconds, path=path, stage=stage, db_type=(db_type or "").lower(), outcome=outcome)
+        timing = _current_timing.get()
+        if timing is not None:
+            timing.add(stage, seconds)
+
+    @contextmanager
+    def stage(self, path: str, stage: str, db_type: str = "") -> Iterator[None]:
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.record(path, stage, time.perf_counter() - started, db_type, outcome)
+
+
+def route_template(app) -> Callable[[Dict[str, Any]], str]:
+    """Map a served request to its route path, keeping label cardinality bounded."""
+    paths: Dict[Any, str] = {}
+
+    def route_for(scope: Dict[str, Any]) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in paths:
+            for route in app.routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    paths[endpoint] = route.path
+                    break
+            else:
+                paths[endpoint] = getattr(endpoint, "__name__", "unknown")
+        return paths[endpoint]
+
+    return route_for
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request.
+
+    Observes the request duration by route template and status, and with
+    ``server_timing`` adds a Server-Timing header listing the stages
+    recorded while the response was being produced.
+    """
+
+    def __init__(self, app, histogram: Histogram, server_timing: bool = False, route_for=None):
+        self.app = app
+        self.histogram = histogram
+        self.server_timing = server_timing
+        self.route_for = route_for or (lambda scope: scope.get("path", ""))
+        self.in_progress = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+        started = time.perf_counter()
+        status = {"code": 500}
+        self.in_progress += 1
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if self.server_timing:
+                    header = timing.server_timing(time.perf_counter() - started).encode("latin-1")
+                    message = {**message, "headers": list(message.get("headers", [])) + [
+                        (b"server-timing", header),
+                        (b"timing-allow-origin", b"*"),
+                    ]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_progress -= 1
+            _current_timing.reset(token)
+            self.histogram.observe(
+                time.perf_counter() - started,
+                method=scope.get("method", ""), route=self.route_for(scope), status=status["code"],
+            )
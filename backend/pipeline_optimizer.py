@@ -0,0 +1,456 @@
+import copy
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Stages a $match can be moved in front of when it doesn't touch what they change
+_MATCH_PASSES = {"$sort", "$project", "$addFields", "$set", "$unset", "$unwind", "$lookup"}
+# Stages that emit exactly one document per input, so a $limit can go before them
+_LIMIT_PASSES = {"$project", "$addFields", "$set", "$unset", "$lookup"}
+# Stages whose output is built only from the fields they reference
+_SHAPING = {"$group", "$count", "$bucket", "$bucketAuto", "$sortByCount"}
+# Stages that read every field of their input, or that we don't analyze
+_OPAQUE = {"$facet", "$out", "$merge", "$redact", "$replaceRoot", "$replaceWith", "$geoNear", "$where"}
+# Stages that hold their whole input in memory, these may need to spill
+_BLOCKING = {"$sort", "$group", "$bucket", "$bucketAuto", "$sortByCount", "$setWindowFields"}
+_WHOLE_DOCUMENT = ("$$ROOT", "$$CURRENT")
+
+
+class _Opaque(Exception):
+    pass
+
+
+def stage_name(stage: Dict[str, Any]) -> str:
+    return next(iter(stage)) if len(stage) == 1 else ""
+
+
+def _top(path: str) -> str:
+    return path.split(".", 1)[0]
+
+
+def _within(path: str, parent: str) -> bool:
+    return path == parent or path.startswith(parent + ".")
+
+
+def _overlaps(a: str, b: str) -> bool:
+    return _within(a, b) or _within(b, a)
+
+
+def match_fields(query: Any) -> Set[str]:
+    """Field paths a $match filter reads, raises _Opaque for $where/$expr."""
+    fields: Set[str] = set()
+    if not isinstance(query, dict):
+        return fields
+    for key, value in query.items():
+        if key in ("$and", "$or", "$nor"):
+            for clause in value:
+                fields |= match_fields(clause)
+        elif key in ("$where", "$expr", "$function"):
+            raise _Opaque(key)
+        elif key in ("$text", "$comment"):
+            continue
+        elif not key.startswith("$"):
+            fields.add(key)
+    return fields
+
+
+def _narrows_with_index(condition: Any) -> bool:
+    """Whether a top-level predicate picks a range of an index.
+
+    Null, missing-field and negated predicates match most of the index, or
+    documents a sparse index leaves out.
+    """
+    if condition is None:
+        return False
+    if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+        if any(key in ("$ne", "$nin", "$not") for key in condition):
+            return False
+        if "$exists" in condition and not condition["$exists"]:
+            return False
+        if "$eq" in condition and condition["$eq"] is None:
+            return False
+        if "$in" in condition and None in condition["$in"]:
+            return False
+    return True
+
+
+def _hintable(index: Dict[str, Any]) -> bool:
+    # Sparse and partial indexes leave documents out, hashed, text and geo
+    # keys can't serve ranges, a hint on them can drop results or scan it all
+    if index.get("sparse") or index.get("partial_filter"):
+        return False
+    return all(kind == "ordered" for kind in index.get("key_types") or ())
+
+
+def referenced_fields(value: Any) -> Set[str]:
+    """Top-level fields named by "$field" expressions anywhere in ``value``."""
+    fields: Set[str] = set()
+    if isinstance(value, str):
+        if value.startswith(_WHOLE_DOCUMENT):
+            raise _Opaque(value)
+        if value.startswith("$") and not value.startswith("$$") and len(value) > 1:
+            fields.add(_top(value[1:]))
+    elif isinstance(value, dict):
+        for item in value.values():
+            fields |= referenced_fields(item)
+    elif isinstance(value, list):
+        for item in value:
+            fields |= referenced_fields(item)
+    return fields
+
+
+def _unwind_path(spec: Any) -> Tuple[str, Optional[str]]:
+    if isinstance(spec, str):
+        return spec.lstrip("$"), None
+    return spec["path"].lstrip("$"), spec.get("includeArrayIndex")
+
+
+def _is_inclusion(projection: Dict[str, Any]) -> bool:
+    return any(key != "_id" and value not in (0, False) for key, value in projection.items())
+
+
+def _written_fields(stage: Dict[str, Any]) -> Optional[Set[str]]:
+    """Fields a stage changes, or None when a $match can't see through it."""
+    name = stage_name(stage)
+    spec = stage[name]
+    if name == "$sort":
+        return set()
+    if name in ("$addFields", "$set"):
+        return set(spec)
+    if name == "$unset":
+        return {spec} if isinstance(spec, str) else set(spec)
+    if name == "$unwind":
+        path, index_field = _unwind_path(spec)
+        return {path} | ({index_field} if index_field else set())
+    if name == "$lookup":
+        return {spec["as"]}
+    if name == "$project":
+        # Only fields passed through unchanged keep their value
+        if _is_inclusion(spec):
+            return {key for key, value in spec.items() if value not in (1, True)}
+        return {key for key in spec}
+    return None
+
+
+def _can_move_match(match: Dict[str, Any], stage: Dict[str, Any]) -> bool:
+    name = stage_name(stage)
+    if name not in _MATCH_PASSES:
+        return False
+    written = _written_fields(stage)
+    if written is None:
+        return False
+    try:
+        fields = match_fields(match)
+    except _Opaque:
+        return False
+    if name == "$project" and _is_inclusion(stage[name]):
+        kept = {key for key, value in stage[name].items() if value in (1, True)} | {"_id"}
+        if not all(any(_within(field, k) for k in kept) for field in fields):
+            return False
+    return not any(_overlaps(field, w) for field in fields for w in written)
+
+
+def _merge_matches(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    if not set(a) & set(b):
+        return {**a, **b}
+    return {"$and": [a, b]}
+
+
+class PipelineOptimizer:
+    """Rewrites Mongo queries before they run.
+
+    Aggregation pipelines get ``$match`` and ``$limit`` moved as early as
+    they can go, adjacent stages merged and, when a later stage shapes the
+    output, a leading ``$project`` of only the fields used. Index metadata
+    from the schema catalog picks a ``hint``, and blocking stages on large
+    collections get ``allowDiskUse``.
+    """
+
+    def __init__(
+        self,
+        schema_catalog=None,
+        enabled: bool = True,
+        hints: bool = True,
+        narrow_projections: bool = True,
+        disk_use_rows: int = 100_000,
+    ):
+        self.schema_catalog = schema_catalog
+        self.enabled = enabled
+        self.hints = hints
+        self.narrow_projections = narrow_projections
+        self.disk_use_rows = disk_use_rows
+        self._counters = {
+            "optimized": 0, "match_moved": 0, "limit_moved": 0, "merged": 0,
+            "projected": 0, "hinted": 0, "disk_use": 0, "errors": 0,
+        }
+
+    @classmethod
+    def from_env(cls, schema_catalog=None) -> "PipelineOptimizer":
+        return cls(
+            schema_catalog=schema_catalog,
+            enabled=os.getenv("MONGO_OPTIMIZER_ENABLED", "true").lower() in ("1", "true", "yes"),
+            hints=os.getenv("MONGO_OPTIMIZER_HINTS", "true").lower() in ("1", "true", "yes"),
+            narrow_projections=os.getenv("MONGO_OPTIMIZER_PROJECTIONS", "true").lower() in ("1", "true", "yes"),
+            disk_use_rows=int(os.getenv("MONGO_OPTIMIZER_DISK_USE_ROWS", "100000")),
+        )
+
+    # -- pipeline rewrites --------------------------------------------------
+
+    def _merge_adjacent(self, pipeline: List[Dict[str, Any]], changes: List[str]) -> List[Dict[str, Any]]:
+        merged: List[Dict[str, Any]] = []
+        for stage in pipeline:
+            name = stage_name(stage)
+            previous = stage_name(merged[-1]) if merged else None
+            if name == previous == "$match":
+                merged[-1] = {"$match": _merge_matches(merged[-1]["$match"], stage["$match"])}
+            elif name == previous == "$limit":
+                merged[-1] = {"$limit": min(merged[-1]["$limit"], stage["$limit"])}
+            elif name == previous == "$skip":
+                merged[-1] = {"$skip": merged[-1]["$skip"] + stage["$skip"]}
+            else:
+                merged.append(stage)
+                continue
+            changes.append(f"Merged adjacent {name} stages")
+            self._counters["merged"] += 1
+        return merged
+
+    def _move_matches(self, pipeline: List[Dict[str, Any]], changes: List[str]) -> List[Dict[str, Any]]:
+        pipeline = list(pipeline)
+        for i in range(len(pipeline)):
+            if stage_name(pipeline[i]) != "$match":
+                continue
+            j = i
+            while j > 0 and _can_move_match(pipeline[j]["$match"], pipeline[j - 1]):
+                pipeline[j - 1], pipeline[j] = pipeline[j], pipeline[j - 1]
+                j -= 1
+            if j != i:
+                changes.append(f"Moved $match from stage {i} to stage {j}")
+                self._counters["match_moved"] += 1
+        return pipeline
+
+    def _move_limits(self, pipeline: List[Dict[str, Any]], changes: List[str]) -> List[Dict[str, Any]]:
+        pipeline = list(pipeline)
+        for i in range(len(pipeline)):
+            if stage_name(pipeline[i]) != "$limit":
+                continue
+            j = i
+            while j > 0 and stage_name(pipeline[j - 1]) in _LIMIT_PASSES:
+                pipeline[j - 1], pipeline[j] = pipeline[j], pipeline[j - 1]
+                j -= 1
+            if j != i:
+                changes.append(f"Moved $limit from stage {i} to stage {j}")
+                self._counters["limit_moved"] += 1
+        return pipeline
+
+    @staticmethod
+    def _needed_fields(pipeline: List[Dict[str, Any]]) -> Optional[Tuple[Set[str], int]]:
+        """Input fields used up to the first shaping stage, and its position."""
+        needed: Set[str] = set()
+        try:
+            for i, stage in enumerate(pipeline):
+                name = stage_name(stage)
+                spec = stage.get(name)
+                if not name or name in _OPAQUE:
+                    return None
+                if name == "$match":
+                    needed |= {_top(field) for field in match_fields(spec)}
+                    needed |= referenced_fields(spec)
+                elif name == "$sort":
+                    needed |= {_top(field) for field in spec}
+                elif name == "$unwind":
+                    needed.add(_top(_unwind_path(spec)[0]))
+                elif name == "$lookup":
+                    if "localField" in spec:
+                        needed.add(_top(spec["localField"]))
+                    needed |= referenced_fields(spec.get("let", {}))
+                elif name in ("$addFields", "$set"):
+                    needed |= referenced_fields(spec)
+                elif name == "$project":
+                    if _is_inclusion(spec):
+                        # Nested and computed keys too, an extra input field is harmless
+                        needed |= {_top(key) for key, value in spec.items() if value not in (0, False)}
+                        needed |= referenced_fields(spec)
+                        if spec.get("_id", 1) not in (0, False):
+                            needed.add("_id")
+                        return needed, i
+                elif name in _SHAPING:
+                    needed |= referenced_fields(spec)
+                    return needed, i
+                elif name in ("$limit", "$skip", "$sample", "$unset"):
+                    continue
+                else:
+                    return None
+        except _Opaque:
+            return None
+        return None
+
+    def _narrow(self, pipeline: List[Dict[str, Any]], changes: List[str]) -> List[Dict[str, Any]]:
+        found = self._needed_fields(pipeline)
+        if found is None:
+            return pipeline
+        needed, shaping_at = found
+        # Keep the leading $match/$sort together so they can still use an index
+        insert_at = 0
+        while insert_at < len(pipeline) and stage_name(pipeline[insert_at]) in ("$match", "$sort"):
+            insert_at += 1
+        if not needed or all(stage_name(stage) in ("$limit", "$skip", "$sample")
+                             for stage in pipeline[insert_at:shaping_at]):
+            return pipeline
+        projection: Dict[str, Any] = {field: 1 for field in sorted(needed)}
+        projection.setdefault("_id", 0)
+        changes.append(f"Added $project of {', '.join(sorted(needed))} at stage {insert_at}")
+        self._counters["projected"] += 1
+        return pipeline[:insert_at] + [{"$project": projection}] + pipeline[insert_at:]
+
+    # -- index metadata -----------------------------------------------------
+
+    def _pick_index(self, collection: str, filter_dict: Dict[str, Any], sort: Dict[str, Any]) -> Optional[str]:
+        entry = self.schema_catalog.cached("mongodb", collection) if self.schema_catalog else None
+        if not entry or not entry.get("indexes"):
+            return None
+        try:
+            fields = match_fields(filter_dict)
+        except _Opaque:
+            return None
+        # Top-level equality/range fields can use an index prefix, $or branches can't
+        usable = [field for field in fields if field in filter_dict and _narrows_with_index(filter_dict[field])]
+        best, best_score = None, 0
+        for index in entry["indexes"]:
+            if not _hintable(index):
+                continue
+            score = 0
+            for column in index["columns"]:
+                if column in usable:
+                    score += 2
+                elif column in sort:
+                    score += 1
+                else:
+                    break
+            if score > best_score or (score == best_score and best and len(index["columns"]) < best[1]):
+                best, best_score = (index["name"], len(index["columns"])), score
+        # Only worth pinning when the index is driven by the filter
+        return best[0] if best and best_score >= 2 else None
+
+    def _needs_disk(self, collection: str, pipeline: List[Dict[str, Any]]) -> bool:
+        if not any(stage_name(stage) in _BLOCKING for stage in pipeline):
+            return False
+        entry = self.schema_catalog.cached("mongodb", collection) if self.schema_catalog else None
+        return bool(entry) and int(entry.get("row_estimate") or 0) >= self.disk_use_rows
+
+    # -- entry points -------------------------------------------------------
+
+    def optimize_pipeline(self, collection: str, pipeline: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        changes: List[str] = []
+        pipeline = self._merge_adjacent(pipeline, changes)
+        pipeline = self._move_matches(pipeline, changes)
+        pipeline = self._move_limits(pipeline, changes)
+        # Moving stages can bring two of a kind together
+        pipeline = self._merge_adjacent(pipeline, changes)
+        if self.narrow_projections:
+            pipeline = self._narrow(pipeline, changes)
+        return pipeline, changes
+
+    def optimize(self, collection: str, query_obj: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """Return the rewritten query and what was changed.
+
+        Hints and ``allowDiskUse`` are set on the query the way the find and
+        aggregate commands take them.
+        """
+        if not self.enabled or not isinstance(query_obj, dict):
+            return query_obj, []
+        try:
+            changes: List[str] = []
+            query_obj = copy.copy(query_obj)
+            hinted = "hint" in query_obj
+            if "aggregate" in query_obj:
+                pipeline, changes = self.optimize_pipeline(collection, list(query_obj.get("pipeline", [])))
+                query_obj["pipeline"] = pipeline
+                if self.hints and "hint" not in query_obj and pipeline and stage_name(pipeline[0]) == "$match":
+                    sort = pipeline[1]["$sort"] if len(pipeline) > 1 and stage_name(pipeline[1]) == "$sort" else {}
+                    hint = self._pick_index(collection, pipeline[0]["$match"], sort)
+                    if hint:
+                        query_obj["hint"] = hint
+                if "allowDiskUse" not in query_obj and self._needs_disk(collection, pipeline):
+                    query_obj["allowDiskUse"] = True
+                    changes.append("Set allowDiskUse for blocking stages on a large collection")
+                    self._counters["disk_use"] += 1
+            elif "find" in query_obj and self.hints and "hint" not in query_obj:
+                hint = self._pick_index(collection, query_obj.get("filter") or {}, query_obj.get("sort") or {})
+                if hint:
+                    query_obj["hint"] = hint
+            if "hint" in query_obj and not hinted:
+                changes.append(f"Hinted index {query_obj['hint']}")
+                self._counters["hinted"] += 1
+        except Exception as e:
+            # A pipeline we misread is still worth running as written
+            self._counters["errors"] += 1
+            logger.warning(f"Pipeline optimizer skipped a query: {e}")
+            return query_obj, []
+        if changes:
+            self._counters["optimized"] += 1
+        return query_obj, changes
+
+    # -- explain ------------------------------------------------------------
+
+    @staticmethod
+    def _execution_stats(explain: Dict[str, Any]) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"docs_examined": 0, "keys_examined": 0, "returned": None, "time_ms": None}
+
+        def visit(node):
+            if isinstance(node, dict):
+                if "executionStats" in node:
+                    found = node["executionStats"]
+                    stats["docs_examined"] += found.get("totalDocsExamined", 0)
+                    stats["keys_examined"] += found.get("totalKeysExamined", 0)
+                    if stats["returned"] is None:
+                        stats["returned"] = found.get("nReturned")
+                        stats["time_ms"] = found.get("executionTimeMillis")
+                    return
+                for value in node.values():
+                    visit(value)
+            elif isinstance(node, list):
+                for value in node:
+                    visit(value)
+
+        visit(explain)
+        return stats
+
+    @staticmethod
+    def _explain_command(collection: str, query_obj: Dict[str, Any]) -> Dict[str, Any]:
+        if "aggregate" in query_obj:
+            command = {"aggregate": collection, "pipeline": query_obj.get("pipeline", []), "cursor": {}}
+        else:
+            command = {
+                "find": collection,
+                "filter": query_obj.get("filter", {}) if "find" in query_obj else query_obj,
+                "projection": query_obj.get("projection", {"_id": 0}),
+            }
+        for key in ("hint", "allowDiskUse"):
+            if key in query_obj:
+                command[key] = query_obj[key]
+        return command
+
+    async def explain(self, db, collection: str, query_obj: Dict[str, Any]) -> Dict[str, Any]:
+        """Documents and keys examined by the query as written and as optimized."""
+        optimized, changes = self.optimize(collection, query_obj)
+        report: Dict[str, Any] = {"original": query_obj, "optimized": optimized, "changes": changes}
+        for label, query in (("before", query_obj), ("after", optimized)):
+            try:
+                explain = await db.command(
+                    "explain", self._explain_command(collection, query), verbosity="executionStats"
+                )
+                report[label] = self._execution_stats(explain)
+            except Exception as e:
+                report[label] = {"error": str(e)}
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "hints": self.hints,
+            "narrow_projections": self.narrow_projections,
+            "disk_use_rows": self.disk_use_rows,
+            **self._counters,
+        }
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Dots and commas inside numbers ("4.5", "1,000") are kept, everything else
+# that only changes the phrasing of the question is dropped.
+_PUNCTUATION = re.compile(r"(?<!\d)[.,](?!\d)|[?!;:\"'`]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    text = _PUNCTUATION.sub(" ", question.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(question: str, db_type: str, model: str, schema_prompt: str) -> str:
+    raw = json.dumps([normalize_question(question), db_type.lower(), model, fingerprint(schema_prompt)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LRUTTLCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self) -> int:
+        size = len(self._data)
+        self._data.clear()
+        return size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class QueryCache:
+    """Two-tier cache for NL -> query conversions.
+
+    The first tier is an in-process LRU with a TTL, the second a Mongo
+    collection shared by every worker. Entries are keyed on the normalized
+    question, db type, model and a fingerprint of the schema prompt.
+    """
+
+    def __init__(self, collection, max_entries: int = 1024, ttl_seconds: float = 3600.0):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.local = LRUTTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._counters = {"local_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0, "shared_errors": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("key", unique=True)
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.local.get(key)
+        if value is not None:
+            self._counters["local_hits"] += 1
+            return value
+
+        try:
+            doc = await self.collection.find_one(
+                {"key": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"_id": 0, "value": 1, "expires_at": 1},
+            )
+        except Exception as e:
+            self._counters["shared_errors"] += 1
+            logger.warning(f"Query cache lookup failed: {e}")
+            doc = None
+
+        if doc is None:
+            self._counters["misses"] += 1
+            return None
+
+        self._counters["shared_hits"] += 1
+        expires_at = doc["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+        self.local.set(key, doc["value"], ttl_seconds=max(0.0, remaining))
+        return doc["value"]
+
+    async def set(self, key: str, value: Dict[str, Any], **meta: Any):
+        self.local.set(key, value)
+        self._counters["stores"] += 1
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.update_one(
+                {"key": key},
+                {"$set": {
+                    "key": key,
+                    "value": value,
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                    **meta,
+                }},
+                upsert=True,
+            )
+        except Exception as e:
+            self._counters["shared_errors"] += 1
+            logger.warning(f"Query cache store failed: {e}")
+
+    async def purge(self) -> Dict[str, int]:
+        local = self.local.clear()
+        result = await self.collection.delete_many({})
+        return {"local_purged": local, "shared_purged": result.deleted_count}
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._counters["local_hits"] + self._counters["shared_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hits": hits,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "local_size": len(self.local),
+            "local_max_entries": self.local.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
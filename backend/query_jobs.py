@@ -0,0 +1,344 @@
+import asyncio
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import uuid
+from array import array
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+from result_format import orjson_default
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+# Starts the query: returns the column names (if known up front) and the row batches
+Opener = Callable[[], Awaitable[Tuple[Optional[List[str]], AsyncIterator[List[Dict[str, Any]]]]]]
+
+
+class JobError(Exception):
+    pass
+
+
+class ResultSpill:
+    """Rows of a job on local disk, one JSON document per line.
+
+    ``<id>.ndjson`` holds the rows and ``<id>.idx`` the end offset of each
+    row as a little-endian uint64. A page is read by memory-mapping both
+    files, so only the current batch and the requested page are ever held
+    in memory. Pages can be read while the job is still writing.
+    """
+
+    def __init__(self, directory: Path, job_id: str):
+        self.data_path = directory / f"{job_id}.ndjson"
+        self.index_path = directory / f"{job_id}.idx"
+        self._data = open(self.data_path, "wb")
+        self._index = open(self.index_path, "wb")
+        self.rows = 0
+        self.bytes = 0
+
+    def append(self, rows: List[Dict[str, Any]]):
+        ends = array("Q")
+        chunks = []
+        size = self.bytes
+        for row in rows:
+            line = orjson.dumps(row, default=orjson_default, option=orjson.OPT_APPEND_NEWLINE)
+            chunks.append(line)
+            size += len(line)
+            ends.append(size)
+        if sys.byteorder != "little":
+            ends.byteswap()
+        self._data.write(b"".join(chunks))
+        self._data.flush()
+        self._index.write(ends.tobytes())
+        self._index.flush()
+        # Only published once both files hold the rows, for concurrent readers
+        self.bytes = size
+        self.rows += len(rows)
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+    def read(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        stop = min(offset + limit, self.rows)
+        if offset >= stop:
+            return []
+        with open(self.index_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            start = struct.unpack_from("<Q", index, (offset - 1) * 8)[0] if offset else 0
+            end = struct.unpack_from("<Q", index, (stop - 1) * 8)[0]
+        with open(self.data_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunk = data[start:end]
+        return [orjson.loads(line) for line in chunk.splitlines()]
+
+    def remove(self):
+        self.close()
+        for path in (self.data_path, self.index_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class QueryJob:
+    def __init__(self, job_id: str, db_type: str, datasource: Optional[str], query: str, max_rows: int,
+                 executed_query: Optional[str] = None):
+        self.id = job_id
+        self.db_type = db_type
+        self.datasource = datasource
+        self.query = query
+        self.executed_query = executed_query or query
+        self.max_rows = max_rows
+        self.state = "queued"
+        self.error: Optional[str] = None
+        self.columns: Optional[List[str]] = None
+        self.spill: Optional[ResultSpill] = None
+        self.kill: Optional[Callable[[], Awaitable[Any]]] = None
+        self.task: Optional[asyncio.Task] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    @property
+    def rows(self) -> int:
+        return self.spill.rows if self.spill else 0
+
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def status(self) -> Dict[str, Any]:
+        duration = self.duration()
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "db_type": self.db_type,
+            "datasource": self.datasource,
+            "error": self.error,
+            "columns": self.columns,
+            "progress": {
+                "rows": self.rows,
+                "bytes": self.spill.bytes if self.spill else 0,
+                "max_rows": self.max_rows,
+                "capped": self.rows >= self.max_rows,
+                "duration_ms": round(1000 * duration, 2) if duration is not None else None,
+            },
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+        }
+
+
+class QueryJobs:
+    """Queries run in the background with their results spilled to disk.
+
+    A job is submitted with an opener that starts the query and returns its
+    row batches. At most ``max_running`` jobs execute at once, the rest wait
+    in "queued", and a job submitted with a ``slot`` holds that context (an
+    admission budget) while it runs. Batches are appended to a ResultSpill
+    as they arrive, so paging through a result never goes back to the
+    database. Cancelling a job closes its stream, which kills a SQL
+    statement on the server, and runs the job's ``kill`` callback (killOp
+    for Mongo). Finished jobs and their files are dropped ``ttl`` seconds
+    after they finish.
+
+    Jobs live in this process, clients must poll the worker that took them.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        ttl: float = 3600.0,
+        max_running: int = 4,
+        max_jobs: int = 1000,
+        cleanup_interval: float = 60.0,
+        on_finish: Optional[Callable[[QueryJob], Awaitable[None]]] = None,
+    ):
+        self.base_directory = directory
+        self.ttl = ttl
+        self.max_running = max_running
+        self.max_jobs = max_jobs
+        self.cleanup_interval = cleanup_interval
+        self.on_finish = on_finish
+        self.directory: Optional[Path] = None
+        self._jobs: Dict[str, QueryJob] = {}
+        self._slots = asyncio.Semaphore(max_running)
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> "QueryJobs":
+        return cls(
+            directory=os.getenv("QUERY_JOBS_DIR") or None,
+            ttl=float(os.getenv("QUERY_JOBS_TTL_SECONDS", "3600")),
+            max_running=int(os.getenv("QUERY_JOBS_MAX_RUNNING", "4")),
+            max_jobs=int(os.getenv("QUERY_JOBS_MAX_JOBS", "1000")),
+            **kwargs,
+        )
+
+    def _ensure_directory(self) -> Path:
+        if self.directory is None:
+            base = self.base_directory or tempfile.gettempdir()
+            os.makedirs(base, exist_ok=True)
+            # One directory per process, workers sharing QUERY_JOBS_DIR don't
+            # clean up each other's files
+            self.directory = Path(tempfile.mkdtemp(prefix="datawhiz-jobs-", dir=base))
+        return self.directory
+
+    def get(self, job_id: str) -> Optional[QueryJob]:
+        return self._jobs.get(job_id)
+
+    def submit(
+        self,
+        db_type: str,
+        datasource: Optional[str],
+        query: str,
+        opener: Opener,
+        max_rows: int,
+        kill: Optional[Callable[[], Awaitable[Any]]] = None,
+        job_id: Optional[str] = None,
+        executed_query: Optional[str] = None,
+        slot: Optional[Callable[[], AsyncContextManager[Any]]] = None,
+    ) -> QueryJob:
+        if len(self._jobs) >= self.max_jobs:
+            raise JobError(f"Too many query jobs, at most {self.max_jobs} are kept")
+        job = QueryJob(job_id or str(uuid.uuid4()), db_type, datasource, query, max_rows, executed_query)
+        job.kill = kill
+        self._jobs[job.id] = job
+        self._counters["submitted"] += 1
+        job.task = asyncio.ensure_future(self._run(job, opener, slot))
+        return job
+
+    async def _run(self, job: QueryJob, opener: Opener,
+                   slot: Optional[Callable[[], AsyncContextManager[Any]]] = None):
+        try:
+            async with self._slots, (slot() if slot is not None else nullcontext()):
+                job.state = "running"
+                job.started_at = time.time()
+                job.spill = ResultSpill(self._ensure_directory(), job.id)
+                job.columns, batches = await opener()
+                try:
+                    async for rows in batches:
+                        if not rows:
+                            continue
+                        if job.columns is None:
+                            job.columns = list(rows[0].keys())
+                        await asyncio.to_thread(job.spill.append, rows[:job.max_rows - job.rows])
+                        if job.rows >= job.max_rows:
+                            break
+                finally:
+                    # Closing the stream is what stops the query on the server
+                    await batches.aclose()
+                job.state = "succeeded"
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+        except Exception as e:
+            logger.error(f"Query job {job.id} failed: {e}")
+            job.state = "failed"
+            job.error = str(e)
+        finally:
+            if job.spill is not None:
+                job.spill.close()
+            if job.state not in FINISHED_STATES:
+                job.state = "cancelled"
+            job.finished_at = time.time()
+            job.expires_at = job.finished_at + self.ttl
+            self._counters[job.state] += 1
+            if self.on_finish is not None:
+                try:
+                    await self.on_finish(job)
+                except Exception as e:
+                    logger.warning(f"Query job {job.id} finish hook failed: {e}")
+
+    async def cancel(self, job_id: str) -> Optional[QueryJob]:
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        was_running = job.state == "running"
+        job.task.cancel()
+        if was_running and job.kill is not None:
+            try:
+                await job.kill()
+            except Exception as e:
+                logger.warning(f"Failed to kill query job {job.id} on the server: {e}")
+        await asyncio.gather(job.task, return_exceptions=True)
+        return job
+
+    async def delete(self, job_id: str) -> bool:
+        job = await self.cancel(job_id)
+        if job is None:
+            return False
+        self._drop(job)
+        return True
+
+    def _drop(self, job: QueryJob):
+        self._jobs.pop(job.id, None)
+        if job.spill is not None:
+            job.spill.remove()
+
+    async def page(self, job: QueryJob, page: int, page_size: int) -> List[Dict[str, Any]]:
+        if job.spill is None:
+            return []
+        return await asyncio.to_thread(job.spill.read, (page - 1) * page_size, page_size)
+
+    def expire(self) -> int:
+        now = time.time()
+        expired = [job for job in self._jobs.values() if job.expires_at is not None and job.expires_at <= now]
+        for job in expired:
+            self._drop(job)
+        self._counters["expired"] += len(expired)
+        return len(expired)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                self.expire()
+            except Exception as e:
+                logger.warning(f"Query job cleanup failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for job_id in list(self._jobs):
+            await self.cancel(job_id)
+        self._jobs.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def stats(self) -> Dict[str, Any]:
+        states = {state: 0 for state in JOB_STATES}
+        for job in self._jobs.values():
+            states[job.state] += 1
+        return {
+            "directory": str(self.directory) if self.directory else None,
+            "ttl": self.ttl,
+            "max_running": self.max_running,
+            "max_jobs": self.max_jobs,
+            "jobs": len(self._jobs),
+            "states": states,
+            "spilled_bytes": sum(job.spill.bytes for job in self._jobs.values() if job.spill),
+            **self._counters,
+        }
@@ -0,0 +1,364 @@
+import json
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Splits SQL into tokens in one pass, as plain strings so the scan stays in
+# the regex engine. Quoted strings and comments become single tokens, so
+# keywords inside them are never seen as code. Comment rules are the
+# intersection of MySQL and Postgres: "--" only counts when followed by
+# whitespace and "#" is not a comment at all, anything one of the dialects
+# might execute is scanned as code. A lone quote is an unterminated string.
+# Dotted names and runs of operators are single tokens to keep them few.
+_SQL_TOKEN = re.compile(
+    r"""
+      /\*.*?(?:\*/|\Z)
+    | --(?=\s|\Z)[^\n]*
+    | '(?:[^']|'')*'
+    | "(?:[^"]|"")*"
+    | `(?:[^`]|``)*`
+    | [A-Za-z_][A-Za-z0-9_$]*(?:\.[A-Za-z_][A-Za-z0-9_$]*)*
+    | \d+(?:\.\d*)?(?:[eE][-+]?\d+)?
+    | \.\d+
+    | [<>=!|&+*%^~]+
+    | \S
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# MySQL reads backslash escapes inside quotes, Postgres doesn't. A literal
+# holding a backslash must end in the same place under both readings.
+_BACKSLASH_LITERAL = {
+    "'": re.compile(r"'(?:[^'\\]|\\.|'')*'", re.DOTALL),
+    '"': re.compile(r'"(?:[^"\\]|\\.|"")*"', re.DOTALL),
+}
+_QUOTES = "'\"`"
+
+READ_STATEMENTS = frozenset({"select", "with", "show", "explain", "describe", "desc", "values", "table"})
+FORBIDDEN_KEYWORDS = frozenset({
+    "drop", "delete", "truncate", "update", "insert", "alter", "create", "replace",
+    "grant", "revoke", "rename", "merge", "into",
+})
+# MySQL string functions sharing a name with a statement, fine when called
+SHARED_FUNCTION_NAMES = frozenset({"replace", "insert"})
+FORBIDDEN_FUNCTIONS = frozenset({
+    "sleep", "benchmark", "pg_sleep", "load_file", "pg_read_file", "pg_read_binary_file", "lo_import", "lo_export",
+})
+AGGREGATE_FUNCTIONS = frozenset({"count", "sum", "avg", "min", "max"})
+# Words that can precede "(" without it being a function call
+_NOT_FUNCTIONS = frozenset({
+    "all", "and", "any", "as", "by", "case", "else", "except", "exists", "from", "in", "intersect", "join",
+    "lateral", "not", "on", "or", "over", "select", "some", "then", "union", "using", "values", "when", "where",
+    "with",
+})
+_KEYWORDS = frozenset({"from", "join", "limit", "fetch", "as"})
+# Words that end a FROM list, a comma after them is not another table
+_FROM_LIST_END = frozenset({
+    "where", "group", "order", "having", "limit", "union", "intersect", "except", "window", "on", "using",
+    "join", "inner", "left", "right", "full", "cross", "natural", "straight_join", "fetch", "offset", "for",
+    "select", "returning",
+})
+# Words the analyzer acts on, any other word is skipped after one set lookup
+_SPECIAL_WORDS = FORBIDDEN_KEYWORDS | FORBIDDEN_FUNCTIONS | _KEYWORDS | _FROM_LIST_END
+
+# Fences and section labels the LLM wraps generated queries in. The lookahead
+# on the first letter lets the engine skip most positions cheaply.
+_SQL_CLEANUP = re.compile(
+    r"(?=[qfeo`])(?:query:|final response:|explanation:|optimization:|```sql|```)", re.IGNORECASE
+)
+_MONGO_CLEANUP = re.compile(r"(?=[qeo`])(?:```json|```|query:|explanation:|optimization:)", re.IGNORECASE)
+# Top-level keys of a write command. build_mongo_cursor would treat such an
+# object as a filter, but it is never what the user asked for.
+MONGO_WRITE_COMMANDS = frozenset({
+    "insert", "update", "delete", "findandmodify", "drop", "dropdatabase", "create", "createindexes",
+    "dropindexes", "renamecollection", "mapreduce", "eval", "bulkwrite", "remove", "collmod",
+})
+# Operators that run server-side JavaScript or write to a collection
+MONGO_FORBIDDEN_OPERATORS = frozenset({"$where", "$function", "$accumulator", "$out", "$merge"})
+
+
+@dataclass(frozen=True)
+class Verdict:
+    """Outcome of analyzing a query, shared by the safety check and later stages.
+
+    ``tables`` are the tables (or collections) the query reads, unqualified
+    and in order of appearance. ``has_limit`` is set for a LIMIT (or FETCH)
+    on the outer query or a ``limit``/``$limit`` on a Mongo query.
+    """
+
+    safe: bool
+    db_type: str
+    statement: str
+    tables: Tuple[str, ...] = ()
+    has_limit: bool = False
+    limit: Optional[int] = None
+    reason: Optional[str] = None
+
+
+def _unquote(text: str) -> str:
+    quote = text[0]
+    return text[1:-1].replace(quote * 2, quote)
+
+
+def _ambiguous_escape(sql: str) -> bool:
+    for match in _SQL_TOKEN.finditer(sql):
+        text = match.group()
+        if "\\" in text and text[0] in _BACKSLASH_LITERAL:
+            other = _BACKSLASH_LITERAL[text[0]].match(sql, match.start())
+            if other is None or other.end() != match.end():
+                return True
+    return False
+
+
+def _code_tokens(sql: str) -> Tuple[List[str], Optional[str]]:
+    """Tokens outside comments, and the reason the text is unsafe if it is."""
+    tokens = _SQL_TOKEN.findall(sql)
+    if "\\" in sql and _ambiguous_escape(sql):
+        return tokens, "Ambiguous backslash escape in a quoted string"
+    if "--" in sql or "/*" in sql:
+        code = []
+        for token in tokens:
+            if token.startswith("/*!"):
+                return code, "MySQL executable comments are not allowed"
+            if not token.startswith(("--", "/*")):
+                code.append(token)
+        tokens = code
+    return tokens, None
+
+
+@lru_cache(maxsize=4096)
+def analyze_sql(sql: str) -> Verdict:
+    """Analyze one SQL statement, in a single pass over its tokens.
+
+    Read-only statements are allowed. Write keywords and server-side file or
+    sleep functions are rejected anywhere outside strings and comments, as is
+    a second statement after a semicolon.
+    """
+    tokens, reason = _code_tokens(sql)
+    statement = next((token.lower() for token in tokens if token[0].isalpha() or token[0] == "_"), "")
+    if reason is None:
+        if not statement:
+            reason = "No SQL statement found"
+        elif statement not in READ_STATEMENTS:
+            reason = f"{statement.upper()} statements are not allowed"
+
+    tables: List[str] = []
+    ctes = set()
+    # One entry per open parenthesis, True when it belongs to a function call
+    parens: List[bool] = []
+    # Depths with an open FROM list, where a comma starts another table
+    from_lists = set()
+    expect_table = False
+    has_limit = False
+    limit = None
+    ended = False
+    # The previous token lowercased if it was a word, else ""
+    previous = ""
+    count = len(tokens)
+    i = -1
+    while reason is None and i + 1 < count:
+        i += 1
+        token = tokens[i]
+        if ended and token != ";":
+            reason = "Multiple statements are not allowed"
+            break
+        first = token[0]
+        if first.isalpha() or first == "_":
+            word = token.lower()
+            if not expect_table and word not in _SPECIAL_WORDS and "." not in word:
+                previous = word
+                continue
+            following = tokens[i + 1] if i + 1 < count else ""
+            if "." in word:
+                # A qualified name is never a keyword, but can name a function
+                if following == "(" and word.rsplit(".", 1)[1] in FORBIDDEN_FUNCTIONS:
+                    reason = f"{word.upper()}() is not allowed"
+                elif expect_table:
+                    i = _table(tokens, i, tables)
+                    expect_table = False
+                previous = word
+                continue
+            if word in FORBIDDEN_KEYWORDS and not (following == "(" and word in SHARED_FUNCTION_NAMES):
+                reason = f"{word.upper()} is not allowed"
+            elif following == "(" and word in FORBIDDEN_FUNCTIONS:
+                reason = f"{word.upper()}() is not allowed"
+            elif expect_table and word not in _NOT_FUNCTIONS:
+                i = _table(tokens, i, tables)
+                expect_table = False
+                word = ""
+            elif word in _KEYWORDS:
+                if word == "from" or word == "join":
+                    if not (parens and parens[-1]):
+                        expect_table = True
+                        from_lists.add(len(parens))
+                elif parens:
+                    # LIMIT, FETCH and CTE names only count on the outer query
+                    pass
+                elif word == "limit" and following.lower() != "all":
+                    has_limit = True
+                    # MySQL's "LIMIT offset, count" puts the count second
+                    if i + 3 < count and tokens[i + 2] == ",":
+                        following = tokens[i + 3]
+                    if following.isdigit():
+                        limit = int(following)
+                elif word == "fetch" and following.lower() in ("first", "next"):
+                    has_limit = True
+                elif word == "as" and following == "(" and statement == "with" and i:
+                    name = tokens[i - 1]
+                    ctes.add(_unquote(name).lower() if name[0] in _QUOTES else name.lower())
+            elif word in _FROM_LIST_END:
+                from_lists.discard(len(parens))
+            previous = word
+            continue
+        if first in _QUOTES:
+            if len(token) == 1:
+                reason = "Unterminated quoted string"
+            elif expect_table and first != "'":
+                i = _table(tokens, i, tables)
+                expect_table = False
+        elif token == "(":
+            parens.append(bool(previous) and previous not in _NOT_FUNCTIONS)
+            expect_table = False
+        elif token == ")":
+            from_lists.discard(len(parens))
+            if parens:
+                parens.pop()
+        elif token == ",":
+            if len(parens) in from_lists:
+                expect_table = True
+        elif token == ";":
+            ended = not parens
+        previous = ""
+
+    seen = []
+    for name in tables:
+        if name.lower() not in ctes and name not in seen:
+            seen.append(name)
+    return Verdict(
+        safe=reason is None,
+        db_type="sql",
+        statement=statement,
+        tables=tuple(seen),
+        has_limit=has_limit,
+        limit=limit,
+        reason=reason,
+    )
+
+
+def _table(tokens: List[str], i: int, tables: List[str]) -> int:
+    """Record the table named at ``tokens[i]``, returns the index of its last token."""
+    # schema.table (or db.schema.table) names its last part
+    while i + 2 < len(tokens) and tokens[i + 1] == "." and tokens[i + 2][0] not in "().,;":
+        i += 2
+    name = tokens[i]
+    # A table function such as generate_series() is not a table
+    if i + 1 == len(tokens) or tokens[i + 1] != "(":
+        tables.append(_unquote(name) if name[0] in _QUOTES else name.rsplit(".", 1)[-1])
+    return i
+
+
+def needs_full_read(sql: str) -> bool:
+    """Whether the statement reads its whole input even under a LIMIT:
+    ORDER BY, GROUP BY, DISTINCT or an aggregate function call. Strings,
+    comments and columns that happen to share a name don't count."""
+    tokens, _ = _code_tokens(sql)
+    for i, token in enumerate(tokens):
+        word = token.lower()
+        following = tokens[i + 1].lower() if i + 1 < len(tokens) else ""
+        if word == "distinct" or (word in ("order", "group") and following == "by"):
+            return True
+        if word in AGGREGATE_FUNCTIONS and following == "(":
+            return True
+    return False
+
+
+def clean_sql(text: str) -> str:
+    """Generated SQL without fences and section labels. Backticks quoting
+    identifiers are kept, only a pair around the whole text is removed."""
+    text = _SQL_CLEANUP.sub("", text).strip()
+    if text.startswith("`"):
+        text = text.strip("`").strip()
+    return text
+
+
+def strip_trailing(sql: str) -> str:
+    """The statement without trailing comments, semicolons and whitespace,
+    so a clause can be appended without ending up inside a comment."""
+    end = 0
+    for match in _SQL_TOKEN.finditer(sql):
+        if not match.group().startswith(("--", "/*", ";")):
+            end = match.end()
+    return sql[:end]
+
+
+def parse_mongo(text: str) -> Dict[str, Any]:
+    """The first JSON object in generated text, with fences and section labels removed."""
+    text = _MONGO_CLEANUP.sub("", text)
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No valid JSON found in text")
+    try:
+        query_obj, _ = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON: {e}") from None
+    return query_obj
+
+
+def analyze_mongo(query_obj: Any, collection_name: Optional[str] = None) -> Verdict:
+    """Analyze a Mongo query object as build_mongo_cursor would run it."""
+    if not isinstance(query_obj, dict):
+        return Verdict(safe=False, db_type="mongodb", statement="", reason="The query must be a JSON object")
+    if "find" in query_obj:
+        statement = "find"
+    elif "aggregate" in query_obj:
+        statement = "aggregate"
+    else:
+        statement = "filter"
+
+    tables = [collection_name] if collection_name else []
+    for key in ("find", "aggregate"):
+        if isinstance(query_obj.get(key), str):
+            tables.append(query_obj[key])
+    reason = None
+    if statement == "filter":
+        command = next((key for key in query_obj if key.lower() in MONGO_WRITE_COMMANDS), None)
+        if command is not None:
+            reason = f"{command} commands are not allowed"
+
+    stack: List[Any] = [query_obj]
+    while stack and reason is None:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        for key, value in node.items():
+            if key in MONGO_FORBIDDEN_OPERATORS:
+                reason = f"{key} is not allowed"
+                break
+            if key in ("$lookup", "$graphLookup") and isinstance(value, dict) and isinstance(value.get("from"), str):
+                tables.append(value["from"])
+            elif key == "$unionWith":
+                collection = value.get("coll") if isinstance(value, dict) else value
+                if isinstance(collection, str):
+                    tables.append(collection)
+            if isinstance(value, (dict, list)):
+                stack.append(value)
+
+    limit = None
+    if statement == "find" and isinstance(query_obj.get("limit"), int) and query_obj["limit"] > 0:
+        limit = query_obj["limit"]
+    elif statement == "aggregate" and isinstance(query_obj.get("pipeline"), list):
+        stages = [stage["$limit"] for stage in query_obj["pipeline"] if isinstance(stage, dict) and "$limit" in stage]
+        if stages and isinstance(stages[-1], int):
+            limit = stages[-1]
+    return Verdict(
+        safe=reason is None,
+        db_type="mongodb",
+        statement=statement,
+        tables=tuple(dict.fromkeys(tables)),
+        has_limit=limit is not None,
+        limit=limit,
+        reason=reason,
+    )
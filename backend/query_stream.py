@@ -0,0 +1,80 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+SECTION_SEPARATOR = "|||"
+SECTIONS = ("query", "explanation", "optimization")
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class SectionStreamParser:
+    """Splits a streamed QUERY|||EXPLANATION|||OPTIMIZATION completion.
+
+    ``feed`` takes raw content deltas and returns ``(kind, section, text)``
+    tuples: ``("token", section, text)`` for content and
+    ``("section_done", section, full_text)`` once a separator closes a
+    section. A separator split across deltas is held back until it can be
+    recognised.
+    """
+
+    def __init__(self):
+        self.index = 0
+        self.sections: List[str] = [""]
+        self._pending = ""
+
+    @property
+    def section(self) -> str:
+        return SECTIONS[min(self.index, len(SECTIONS) - 1)]
+
+    def _emit_text(self, text: str, events: List[Tuple[str, str, str]]):
+        if text:
+            self.sections[-1] += text
+            events.append(("token", self.section, text))
+
+    def feed(self, delta: str) -> List[Tuple[str, str, str]]:
+        events: List[Tuple[str, str, str]] = []
+        buffer = self._pending + delta
+        self._pending = ""
+        while self.index < len(SECTIONS) - 1:
+            position = buffer.find(SECTION_SEPARATOR)
+            if position == -1:
+                break
+            self._emit_text(buffer[:position], events)
+            events.append(("section_done", self.section, self.sections[-1].strip()))
+            self.index += 1
+            self.sections.append("")
+            buffer = buffer[position + len(SECTION_SEPARATOR):]
+
+        if self.index < len(SECTIONS) - 1:
+            # Hold back a trailing partial separator such as "|" or "||"
+            keep = 0
+            for size in range(len(SECTION_SEPARATOR) - 1, 0, -1):
+                if buffer.endswith(SECTION_SEPARATOR[:size]):
+                    keep = size
+                    break
+            if keep:
+                self._pending = buffer[-keep:]
+                buffer = buffer[:-keep]
+        self._emit_text(buffer, events)
+        return events
+
+    def finish(self) -> List[Tuple[str, str, str]]:
+        events: List[Tuple[str, str, str]] = []
+        self._emit_text(self._pending, events)
+        self._pending = ""
+        events.append(("section_done", self.section, self.sections[-1].strip()))
+        return events
+
+    @property
+    def content(self) -> str:
+        return SECTION_SEPARATOR.join(self.sections)
+
+
+def stream_event_payload(kind: str, section: str, text: str) -> Tuple[str, Dict[str, Any]]:
+    if kind == "token":
+        return "token", {"section": section, "text": text}
+    if section == "query":
+        return "query_ready", {"query": text}
+    return "section", {"section": section, "text": text}
@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+from pymongo.errors import OperationFailure
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from result_format import orjson_default
+
+logger = logging.getLogger(__name__)
+
+_SQL_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+_SQL_SPACE = re.compile(r"\s+")
+_SQL_PUNCT_SPACE = re.compile(r"\s*([,()=<>+*/-])\s*")
+# Results of these change on every run, queries using them are never cached
+_SQL_VOLATILE = re.compile(
+    r"\b(?:now|rand|random|uuid|sysdate|curdate|curtime|current_date|current_time|current_timestamp"
+    r"|localtime|localtimestamp|utc_date|utc_time|utc_timestamp|unix_timestamp)\b",
+    re.IGNORECASE,
+)
+_MONGO_VOLATILE = ('"$$NOW"', '"$$CLUSTER_TIME"', '"$rand"', '"$sample"')
+# Key order of a filter doesn't matter, everywhere else it may (sort, projection, stages)
+_UNORDERED_KEYS = {"filter", "$match"}
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and drop the trailing semicolon, leaving literals alone.
+
+    Identifiers keep their case, MySQL table names are case-sensitive on
+    most platforms.
+    """
+    parts = []
+    last = 0
+    for match in _SQL_LITERAL.finditer(sql):
+        parts.append(_normalize_sql_code(sql[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(_normalize_sql_code(sql[last:]))
+    return "".join(parts).strip().rstrip(";").rstrip()
+
+
+def _normalize_sql_code(code: str) -> str:
+    return _SQL_PUNCT_SPACE.sub(r"\1", _SQL_SPACE.sub(" ", code))
+
+
+def _canonical(value: Any, unordered: bool = False) -> Any:
+    if isinstance(value, dict):
+        items = [(key, _canonical(item, key in _UNORDERED_KEYS or unordered)) for key, item in value.items()]
+        return dict(sorted(items) if unordered else items)
+    if isinstance(value, list):
+        return [_canonical(item, unordered) for item in value]
+    return value
+
+
+def canonical_mongo(collection_name: str, query_obj: Dict[str, Any]) -> str:
+    # A bare query object is a filter
+    unordered = not ("find" in query_obj or "aggregate" in query_obj)
+    body = _canonical(query_obj, unordered)
+    return json.dumps([collection_name, body], separators=(",", ":"), default=str)
+
+
+def is_volatile(db_type: str, query_text: str) -> bool:
+    if db_type == "sql":
+        return bool(_SQL_VOLATILE.search(query_text))
+    return any(marker in query_text for marker in _MONGO_VOLATILE)
+
+
+class CachedResult:
+    __slots__ = ("key", "datasource", "tables", "versions", "value", "size", "stored_at", "expires_at")
+
+    def __init__(self, key: str, datasource: str, tables: Tuple[str, ...], versions: Tuple[int, ...],
+                 value: Any, size: int, ttl: float):
+        self.key = key
+        self.datasource = datasource
+        self.tables = tables
+        self.versions = versions
+        self.value = value
+        self.size = size
+        self.stored_at = time.monotonic()
+        self.expires_at = self.stored_at + ttl
+
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+
+class ResultCache:
+    """In-process cache of execute-query results.
+
+    Entries are keyed on the datasource and the normalized SQL or the
+    canonical Mongo query, and evicted least recently used first once their
+    serialized size passes ``max_bytes``. Each entry has a TTL, and is
+    stale as soon as one of the tables or collections it read from changes
+    version. Versions are bumped by ``invalidate`` (the admin endpoint), by
+    a change stream on each Mongo source, and by polling MySQL's
+    UPDATE_TIME (with information_schema_stats_expiry turned off for the
+    polling session) or Postgres' row change counters every
+    ``poll_interval`` seconds. Other SQL dialects rely on the TTL and
+    explicit invalidation.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_entry_bytes: int = 4 * 1024 * 1024,
+        ttl: float = 60.0,
+        poll_interval: float = 5.0,
+        change_streams: bool = True,
+        exclude_collections: Optional[Iterable[str]] = None,
+    ):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.change_streams = change_streams
+        self.exclude_collections = list(exclude_collections or [])
+        self.bytes = 0
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        # (datasource, table) -> version, and datasource -> epoch for whole-source bumps
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._epochs: Dict[str, int] = {}
+        self._markers: Dict[str, Dict[str, Any]] = {}
+        self._recent: Dict[str, Set[str]] = {}
+        self._watchers: Dict[str, asyncio.Task] = {}
+        self._no_change_stream: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {
+            "hits": 0, "misses": 0, "stale": 0, "expired": 0, "stores": 0, "skipped": 0,
+            "evictions": 0, "invalidations": 0,
+        }
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> "ResultCache":
+        return cls(
+            enabled=os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"),
+            max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            max_entry_bytes=int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024))),
+            ttl=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "60")),
+            poll_interval=float(os.getenv("RESULT_CACHE_POLL_SECONDS", "5")),
+            change_streams=os.getenv("RESULT_CACHE_CHANGE_STREAMS", "true").lower() in ("1", "true", "yes"),
+            **kwargs,
+        )
+
+    @staticmethod
+    def make_key(datasource: str, db_type: str, normalized_query: str) -> str:
+        raw = json.dumps([datasource, db_type, normalized_query])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def tables_for(tables: Iterable[str]) -> Tuple[str, ...]:
+        """Normalized form of the tables in a query verdict, used for versions and invalidation."""
+        return tuple(sorted({table.lower() for table in tables}))
+
+    def versions(self, datasource: str, tables: Tuple[str, ...]) -> Tuple[int, ...]:
+        """Current versions, taken before running a query so a change during the run makes its result stale."""
+        return (self._epochs.get(datasource, 0),) + tuple(
+            self._versions.get((datasource, table), 0) for table in tables
+        )
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._counters["expired"] += 1
+            self._remove(entry)
+            return None
+        if entry.versions != self.versions(entry.datasource, entry.tables):
+            self._counters["stale"] += 1
+            self._remove(entry)
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return entry
+
+    def set(self, key: str, datasource: str, tables: Tuple[str, ...], versions: Tuple[int, ...],
+            value: Any, results: List[Dict[str, Any]], ttl: Optional[float] = None) -> bool:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or versions != self.versions(datasource, tables):
+            self._counters["skipped"] += 1
+            return False
+        size = len(orjson.dumps(results, default=orjson_default))
+        if size > self.max_entry_bytes:
+            self._counters["skipped"] += 1
+            return False
+        old = self._entries.get(key)
+        if old is not None:
+            self._remove(old)
+        self._entries[key] = CachedResult(key, datasource, tables, versions, value, size, ttl)
+        self.bytes += size
+        self._counters["stores"] += 1
+        while self.bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries.values())))
+            self._counters["evictions"] += 1
+        return True
+
+    def _remove(self, entry: CachedResult):
+        if self._entries.pop(entry.key, None) is not None:
+            self.bytes -= entry.size
+
+    def invalidate(self, datasource: str, tables: Optional[Iterable[str]] = None) -> int:
+        """Bump the version of ``tables`` (every table when None), returns the entries dropped."""
+        if tables is None:
+            self._epochs[datasource] = self._epochs.get(datasource, 0) + 1
+            names = None
+        else:
+            names = {table.lower() for table in tables}
+            for table in names:
+                self._versions[(datasource, table)] = self._versions.get((datasource, table), 0) + 1
+        self._counters["invalidations"] += 1
+        dropped = [
+            entry for entry in self._entries.values()
+            if entry.datasource == datasource and (names is None or names.intersection(entry.tables))
+        ]
+        for entry in dropped:
+            self._remove(entry)
+        return len(dropped)
+
+    def clear(self) -> int:
+        size = len(self._entries)
+        self._entries.clear()
+        self.bytes = 0
+        return size
+
+    @staticmethod
+    def _change_markers_sync(engine) -> Optional[Dict[str, Any]]:
+        with engine.connect() as conn:
+            dialect = conn.dialect.name
+            if dialect == "mysql":
+                try:
+                    # MySQL 8 serves UPDATE_TIME from a cache refreshed once a day by default
+                    conn.exec_driver_sql("SET SESSION information_schema_stats_expiry = 0")
+                except DBAPIError:
+                    # Older servers read it live and have no such variable
+                    pass
+                rows = conn.execute(text(
+                    "SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()"
+                ))
+            elif dialect == "postgresql":
+                rows = conn.execute(text(
+                    "SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables"
+                ))
+            else:
+                return None
+            return {str(name).lower(): marker for name, marker in rows}
+
+    async def _poll(self, source):
+        markers = await source.executor.run(self._change_markers_sync, source.engine)
+        if markers is None:
+            return
+        previous = self._markers.get(source.name)
+        self._markers[source.name] = markers
+        if previous is None:
+            return
+        changed = {table for table, marker in markers.items() if previous.get(table) != marker}
+        changed |= set(previous) - set(markers)
+        # UPDATE_TIME has one second resolution, a second write in the same
+        # second leaves it unchanged, so changed tables are bumped once more
+        bump = changed | self._recent.get(source.name, set())
+        self._recent[source.name] = changed
+        if bump:
+            self.invalidate(source.name, bump)
+
+    async def _watch(self, source):
+        pipeline = [{"$match": {"ns.coll": {"$nin": self.exclude_collections}}}] if self.exclude_collections else []
+        try:
+            async with source.db.watch(pipeline) as stream:
+                async for change in stream:
+                    collection = (change.get("ns") or {}).get("coll")
+                    self.invalidate(source.name, [collection] if collection else None)
+        except asyncio.CancelledError:
+            raise
+        except (OperationFailure, NotImplementedError) as e:
+            # Standalone servers have no change streams, don't keep retrying
+            self._no_change_stream.add(source.name)
+            logger.info(f"No change stream for {source.name}, its results rely on the TTL: {e}")
+        except Exception as e:
+            logger.warning(f"Change stream for {source.name} stopped, restarting on the next poll: {e}")
+        finally:
+            # Changes may have been missed while nothing was watching
+            self.invalidate(source.name)
+
+    async def refresh_sources(self, sources: List[Any]):
+        active = {source.name: source for source in sources}
+        for name, task in list(self._watchers.items()):
+            if task.done() or active.get(name) is None:
+                task.cancel()
+                del self._watchers[name]
+        # Entries of a closed source are no longer kept up to date
+        for name in {entry.datasource for entry in self._entries.values()} - set(active):
+            self.invalidate(name)
+        for name in set(self._markers) - set(active):
+            self._markers.pop(name, None)
+            self._recent.pop(name, None)
+
+        for source in sources:
+            try:
+                if source.db_type == "sql":
+                    await self._poll(source)
+                elif (self.change_streams and source.name not in self._watchers
+                      and source.name not in self._no_change_stream):
+                    self._watchers[source.name] = asyncio.create_task(self._watch(source))
+            except Exception as e:
+                logger.warning(f"Result cache could not check {source.name} for changes: {e}")
+
+    async def _loop(self, datasources):
+        while True:
+            await self.refresh_sources(datasources.active())
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self, datasources):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop(datasources))
+
+    async def stop(self):
+        tasks = list(self._watchers.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._watchers.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._counters["hits"] + self._counters["misses"] + self._counters["stale"] + self._counters["expired"]
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "max_entry_bytes": self.max_entry_bytes,
+            "ttl": self.ttl,
+            "hit_ratio": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            "polled_sources": sorted(self._markers),
+            "change_streams": sorted(name for name, task in self._watchers.items() if not task.done()),
+            **self._counters,
+        }
@@ -0,0 +1,100 @@
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from bson import ObjectId
+
+RESULT_SHAPES = ("records", "columns", "rows")
+
+# bool before int and datetime before date, they are subclasses
+_TYPE_NAMES = (
+    (bool, "boolean"),
+    (int, "integer"),
+    (float, "number"),
+    (Decimal, "decimal"),
+    (str, "string"),
+    (datetime, "datetime"),
+    (date, "date"),
+    (ObjectId, "objectid"),
+    (dict, "object"),
+    (list, "array"),
+)
+
+
+def orjson_default(value: Any) -> Any:
+    # orjson encodes datetime/date itself, these are the types it doesn't know
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+def value_type(value: Any) -> str:
+    for cls, name in _TYPE_NAMES:
+        if isinstance(value, cls):
+            return name
+    return "null" if value is None else type(value).__name__
+
+
+def column_names(rows: List[Dict[str, Any]]) -> Tuple[List[str], bool]:
+    """Return the column names and whether every row has exactly those keys."""
+    if not rows:
+        return [], True
+    first = rows[0].keys()
+    if all(row.keys() == first for row in rows):
+        return list(first), True
+    # Documents don't share one schema, take every key in first-seen order
+    return list(dict.fromkeys(chain.from_iterable(rows))), False
+
+
+def column_types(rows: List[Dict[str, Any]], names: List[str]) -> List[str]:
+    types: List[Optional[str]] = [None] * len(names)
+    missing = len(names)
+    for row in rows:
+        for i, name in enumerate(names):
+            if types[i] is None and row.get(name) is not None:
+                types[i] = value_type(row[name])
+                missing -= 1
+        if not missing:
+            break
+    return [t or "null" for t in types]
+
+
+def _row_getter(names: List[str], uniform: bool):
+    if uniform and len(names) > 1:
+        return itemgetter(*names)
+    if uniform and names:
+        name = names[0]
+        return lambda row: (row[name],)
+    return lambda row: tuple(row.get(name) for name in names)
+
+
+def to_columnar(rows: List[Dict[str, Any]], shape: str) -> Dict[str, Any]:
+    """Column names and types once, then column arrays or row tuples."""
+    names, uniform = column_names(rows)
+    columns = [{"name": name, "type": kind} for name, kind in zip(names, column_types(rows, names))]
+    getter = _row_getter(names, uniform)
+    tuples = [getter(row) for row in rows]
+    if shape == "columns":
+        data = [list(column) for column in zip(*tuples)] if tuples else [[] for _ in names]
+    else:
+        data = tuples
+    return {"columns": columns, "data": data}
+
+
+def encode_columnar(response: Dict[str, Any], shape: str) -> bytes:
+    """Encode an execute-query result without per-row model validation.
+
+    ``response`` holds the ExecuteResponse fields; ``results`` is replaced
+    by ``columns`` and ``data`` in the requested shape.
+    """
+    body = {key: value for key, value in response.items() if key != "results"}
+    body["shape"] = shape
+    body.update(to_columnar(response.get("results") or [], shape))
+    return orjson.dumps(body, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,192 @@
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+STREAM_FORMATS = ("ndjson", "arrow")
+
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _arrow_value(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return {k: _arrow_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_arrow_value(v) for v in value]
+    return value
+
+
+def row_caps(max_rows: Optional[int], batch_size: Optional[int], cap: int, default_batch_size: int) -> Tuple[int, int]:
+    """The row cap and batch size for a streamed result, within ``cap``.
+
+    Missing values take the defaults, anything below 1 is raised to 1.
+    """
+    max_rows = max(1, min(cap if max_rows is None else max_rows, cap))
+    batch_size = max(1, min(default_batch_size if batch_size is None else batch_size, max_rows))
+    return max_rows, batch_size
+
+
+async def mongo_batches(cursor, batch_size: int, max_rows: Optional[int]) -> AsyncIterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    sent = 0
+    try:
+        async for doc in cursor:
+            batch.append(doc)
+            sent += 1
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+            if max_rows is not None and sent >= max_rows:
+                break
+        if batch:
+            yield batch
+    finally:
+        # Also when the consumer stops early, so the server cursor is killed
+        await cursor.close()
+
+
+async def encode_ndjson(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    try:
+        async for rows in batches:
+            if rows:
+                yield "".join(json.dumps(row, default=json_default) + "\n" for row in rows).encode("utf-8")
+    except Exception as e:
+        # Headers are already sent, report the failure as the last line
+        yield (json.dumps({"error": str(e)}) + "\n").encode("utf-8")
+
+
+def _arrow_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=json_default)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _infer_arrow_type(values: List[Any]):
+    import pyarrow as pa
+
+    values = [v for v in values if v is not None]
+    if not values:
+        # All null so far, string holds whatever comes later
+        return pa.string()
+    try:
+        inferred = pa.array(values).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed types
+        return pa.string()
+    if pa.types.is_null(inferred):
+        return pa.string()
+    if pa.types.is_decimal(inferred):
+        # The sample's precision may be too narrow for later rows
+        return pa.decimal128(38, inferred.scale)
+    return inferred
+
+
+def _arrow_batch(schema, rows: List[Dict[str, Any]]):
+    import pyarrow as pa
+
+    extra = set().union(*rows) - set(schema.names)
+    if extra:
+        raise ValueError(
+            f"Fields {sorted(extra)} first appear after the schema was fixed, export as ndjson instead"
+        )
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        if pa.types.is_string(field.type):
+            arrays.append(pa.array([_arrow_text(v) for v in values], type=field.type))
+            continue
+        try:
+            arrays.append(pa.array(values, type=field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ValueError(f"Column {field.name!r} changed type from {field.type}: {e}") from None
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+async def encode_arrow(batches: AsyncIterator[List[Dict[str, Any]]], columns: Optional[List[str]] = None,
+                       schema_rows: int = 10_000) -> AsyncIterator[bytes]:
+    """Encode row batches as an Arrow IPC stream.
+
+    Rows are buffered until the schema can be inferred: once every one of
+    ``columns`` has held a value, or after ``schema_rows`` rows when the
+    columns aren't known up front (Mongo). Columns that are all null or mix
+    types are sent as strings. A failure after the headers went out ends
+    the stream with an empty batch carrying an "error" metadata key.
+    """
+    import pyarrow as pa
+
+    sink = io.BytesIO()
+    writer = None
+    schema = None
+    pending: List[Dict[str, Any]] = []
+    valued = set()
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    def start():
+        nonlocal schema
+        names = list(columns) if columns is not None else list(dict.fromkeys(k for row in pending for k in row))
+        schema = pa.schema([(name, _infer_arrow_type([row.get(name) for row in pending])) for name in names])
+        return pa.ipc.new_stream(sink, schema)
+
+    try:
+        async for rows in batches:
+            if not rows:
+                continue
+            rows = [_arrow_value(row) for row in rows]
+            if writer is None:
+                pending.extend(rows)
+                if columns is not None:
+                    valued.update(k for row in rows for k, v in row.items() if v is not None)
+                    ready = valued.issuperset(columns)
+                else:
+                    ready = False
+                if not ready and len(pending) < schema_rows:
+                    continue
+                writer = start()
+                rows, pending = pending, []
+            writer.write_batch(_arrow_batch(schema, rows))
+            yield drain()
+        if writer is None:
+            writer = start()
+            if pending:
+                writer.write_batch(_arrow_batch(schema, pending))
+        writer.close()
+    except Exception as e:
+        # Headers are already sent, report the failure in the stream itself
+        if writer is None:
+            schema = pa.schema([("error", pa.string())])
+            writer = pa.ipc.new_stream(sink, schema)
+            writer.write_batch(pa.RecordBatch.from_pydict({"error": [str(e)]}, schema=schema))
+        else:
+            writer.write_batch(pa.RecordBatch.from_pylist([], schema=schema), custom_metadata={"error": str(e)})
+        writer.close()
+    yield drain()
+
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
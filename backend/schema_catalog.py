@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text_value: str) -> set:
+    words = set()
+    for word in _WORD.findall(text_value.lower()):
+        words.add(word)
+        # Cheap plural folding so "orders" matches "order_id" and vice versa
+        if len(word) > 3 and word.endswith("s"):
+            words.add(word[:-1])
+        else:
+            words.add(word + "s")
+    return words
+
+
+def _type_name(value: Any) -> str:
+    return type(value).__name__
+
+
+def infer_fields(docs: List[Dict[str, Any]], max_depth: int = 2) -> List[Dict[str, Any]]:
+    """Infer field names and types from a sample of documents.
+
+    Nested documents are flattened with dotted names up to ``max_depth``
+    levels. Each field reports every type seen, most common first, and the
+    share of sampled documents that contain it.
+    """
+    types: Dict[str, Counter] = {}
+    presence: Counter = Counter()
+
+    def visit(doc: Dict[str, Any], prefix: str, depth: int):
+        for key, value in doc.items():
+            name = f"{prefix}{key}"
+            types.setdefault(name, Counter())[_type_name(value)] += 1
+            presence[name] += 1
+            if isinstance(value, dict) and depth < max_depth:
+                visit(value, f"{name}.", depth + 1)
+
+    for doc in docs:
+        visit(doc, "", 1)
+
+    total = len(docs) or 1
+    return [
+        {
+            "name": name,
+            "type": "|".join(t for t, _ in counter.most_common()),
+            "presence": round(presence[name] / total, 3),
+        }
+        for name, counter in types.items()
+    ]
+
+
+def _mongo_index(name: str, info: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "columns": [key for key, _ in info["key"]],
+        "unique": bool(info.get("unique")),
+        # Indexes that leave documents out or don't keep values in order
+        # can't answer every filter on their columns
+        "sparse": bool(info.get("sparse")),
+        "partial_filter": info.get("partialFilterExpression"),
+        "key_types": ["ordered" if kind in (1, -1) else str(kind) for _, kind in info["key"]],
+    }
+
+
+class SchemaCatalog:
+    """Cached description of the SQL tables and Mongo collections.
+
+    Holds columns, types, indexes, row-count estimates and a few sample rows
+    for both backends. Refreshed in the background every
+    ``refresh_interval`` seconds and on demand, and used both by the schema
+    endpoints and to build the LLM system prompt. A lookup of an unknown
+    name refreshes at most once every ``miss_refresh_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        sql_executor=None,
+        mongo_db=None,
+        refresh_interval: float = 300.0,
+        mongo_sample_size: int = 200,
+        sample_rows: int = 5,
+        exclude_collections: Optional[List[str]] = None,
+        miss_refresh_interval: float = 30.0,
+    ):
+        self.sql_executor = sql_executor
+        self.mongo_db = mongo_db
+        self.refresh_interval = refresh_interval
+        self.mongo_sample_size = mongo_sample_size
+        self.sample_rows = sample_rows
+        self.exclude_collections = set(exclude_collections or [])
+        self.miss_refresh_interval = miss_refresh_interval
+        self._entries: Dict[str, Dict[str, Dict[str, Any]]] = {"sql": {}, "mongodb": {}}
+        self._refreshed_at: Dict[str, Optional[float]] = {"sql": None, "mongodb": None}
+        # Last refresh started by a lookup miss, successful or not
+        self._miss_refreshed_at: Dict[str, float] = {"sql": 0.0, "mongodb": 0.0}
+        self._locks = {"sql": asyncio.Lock(), "mongodb": asyncio.Lock()}
+        self._task: Optional[asyncio.Task] = None
+        self._counters = {"refreshes": 0, "refresh_errors": 0, "misses": 0, "miss_refreshes": 0}
+
+    def _backends(self, db_type: Optional[str]) -> List[str]:
+        backends = []
+        if self.sql_executor is not None:
+            backends.append("sql")
+        if self.mongo_db is not None:
+            backends.append("mongodb")
+        if db_type is not None:
+            backends = [b for b in backends if b == db_type.lower()]
+        return backends
+
+    # -- refreshing -------------------------------------------------------
+
+    def _load_sql_sync(self) -> Dict[str, Dict[str, Any]]:
+        engine = self.sql_executor.engine
+        quote = engine.dialect.identifier_preparer.quote
+        entries = {}
+        with engine.connect() as conn:
+            inspector = inspect(conn)
+            estimates = self._sql_row_estimates(conn)
+            for table in inspector.get_table_names():
+                columns = inspector.get_columns(table)
+                indexes = [
+                    {"name": ix["name"], "columns": ix["column_names"], "unique": bool(ix.get("unique"))}
+                    for ix in inspector.get_indexes(table)
+                ]
+                primary_key = inspector.get_pk_constraint(table).get("constrained_columns") or []
+                if primary_key:
+                    indexes.insert(0, {"name": "PRIMARY", "columns": primary_key, "unique": True})
+                foreign_keys = [
+                    {
+                        "columns": fk["constrained_columns"],
+                        "references": fk["referred_table"],
+                        "referred_columns": fk["referred_columns"],
+                    }
+                    for fk in inspector.get_foreign_keys(table)
+                ]
+                row_estimate = estimates.get(table)
+                if row_estimate is None:
+                    row_estimate = conn.execute(text(f"SELECT COUNT(*) FROM {quote(table)}")).scalar()
+                result = conn.execute(text(f"SELECT * FROM {quote(table)} LIMIT {int(self.sample_rows)}"))
+                entries[table] = {
+                    "name": table,
+                    "columns": [
+                        {"name": col["name"], "type": str(col["type"]), "nullable": col.get("nullable", True)}
+                        for col in columns
+                    ],
+                    "indexes": indexes,
+                    "foreign_keys": foreign_keys,
+                    "row_estimate": row_estimate,
+                    "sample_data": [dict(row._mapping) for row in result],
+                }
+        return entries
+
+    def _sql_row_estimates(self, conn) -> Dict[str, int]:
+        dialect = conn.dialect.name
+        if dialect == "mysql":
+            rows = conn.execute(text(
+                "SELECT TABLE_NAME, TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()"
+            ))
+        elif dialect == "postgresql":
+            rows = conn.execute(text(
+                "SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r'"
+            ))
+        else:
+            return {}
+        return {name: int(count or 0) for name, count in rows}
+
+    async def _load_mongo(self) -> Dict[str, Dict[str, Any]]:
+        entries = {}
+        for name in await self.mongo_db.list_collection_names():
+            if name in self.exclude_collections or name.startswith("system."):
+                continue
+            collection = self.mongo_db[name]
+            docs = await collection.aggregate(
+                [{"$sample": {"size": self.mongo_sample_size}}, {"$project": {"_id": 0}}]
+            ).to_list(length=self.mongo_sample_size)
+            index_info = await collection.index_information()
+            entries[name] = {
+                "name": name,
+                "fields": infer_fields(docs),
+                "indexes": [_mongo_index(ix_name, info) for ix_name, info in index_info.items()],
+                "row_estimate": await collection.estimated_document_count(),
+                "sample_data": await collection.find({}, {"_id": 0}).limit(self.sample_rows).to_list(
+                    length=self.sample_rows
+                ),
+            }
+        return entries
+
+    async def refresh(self, db_type: Optional[str] = None) -> Dict[str, Any]:
+        summary = {}
+        for backend in self._backends(db_type):
+            async with self._locks[backend]:
+                started = time.perf_counter()
+                try:
+                    if backend == "sql":
+                        entries = await self.sql_executor.run(self._load_sql_sync)
+                    else:
+                        entries = await self._load_mongo()
+                except Exception as e:
+                    self._counters["refresh_errors"] += 1
+                    logger.error(f"Error refreshing {backend} schema catalog: {e}")
+                    summary[backend] = {"error": str(e)}
+                    continue
+                self._entries[backend] = entries
+                self._refreshed_at[backend] = time.time()
+                self._counters["refreshes"] += 1
+                summary[backend] = {
+                    "objects": len(entries),
+                    "duration_ms": round(1000 * (time.perf_counter() - started), 2),
+                }
+        return summary
+
+    async def _ensure_loaded(self, db_type: str):
+        if self._refreshed_at.get(db_type) is None:
+            await self.refresh(db_type)
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # -- reading ----------------------------------------------------------
+
+    async def names(self, db_type: str) -> List[str]:
+        db_type = db_type.lower()
+        await self._ensure_loaded(db_type)
+        return list(self._entries.get(db_type, {}))
+
+    async def get(self, db_type: str, name: str) -> Optional[Dict[str, Any]]:
+        db_type = db_type.lower()
+        await self._ensure_loaded(db_type)
+        entry = self._entries.get(db_type, {}).get(name)
+        if entry is None and db_type in self._backends(db_type):
+            self._counters["misses"] += 1
+            # Might have been created since the last refresh
+            if await self._refresh_for_miss(db_type):
+                entry = self._entries.get(db_type, {}).get(name)
+        return entry
+
+    async def _refresh_for_miss(self, db_type: str) -> bool:
+        lock = self._locks[db_type]
+        if lock.locked():
+            # Wait for the refresh already running instead of queueing another
+            async with lock:
+                return True
+        last = max(self._refreshed_at[db_type] or 0.0, self._miss_refreshed_at[db_type])
+        if time.time() - last < self.miss_refresh_interval:
+            return False
+        self._miss_refreshed_at[db_type] = time.time()
+        self._counters["miss_refreshes"] += 1
+        await self.refresh(db_type)
+        return True
+
+    def cached_names(self, db_type: str) -> List[str]:
+        return list(self._entries.get(db_type.lower(), {}))
+
+    def cached(self, db_type: str, name: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(db_type.lower(), {}).get(name)
+
+    def is_loaded(self, db_type: str) -> bool:
+        return bool(self._entries.get(db_type.lower()))
+
+    def relevant_names(self, db_type: str, question: str, max_objects: int) -> List[str]:
+        entries = self._entries.get(db_type.lower(), {})
+        if len(entries) <= max_objects:
+            return list(entries)
+
+        question_words = _words(question)
+        scores = {}
+        for name, entry in entries.items():
+            score = 3 * len(_words(name) & question_words)
+            for column in entry.get("columns") or entry.get("fields") or []:
+                score += len(_words(column["name"]) & question_words)
+            if score:
+                scores[name] = score
+        if not scores:
+            return list(entries)[:max_objects]
+
+        selected = sorted(scores, key=scores.get, reverse=True)[:max_objects]
+        # Pull in directly related tables so the model can still join
+        for name in list(selected):
+            for fk in entries[name].get("foreign_keys", []):
+                if fk["references"] in entries and fk["references"] not in selected and len(selected) < max_objects:
+                    selected.append(fk["references"])
+        return selected
+
+    def render_schema(self, db_type: str, question: Optional[str] = None,
+                      max_objects: int = 8, max_columns: int = 40) -> str:
+        db_type = db_type.lower()
+        entries = self._entries.get(db_type, {})
+        names = self.relevant_names(db_type, question or "", max_objects) if question else list(entries)
+        lines = []
+        for name in names:
+            entry = entries[name]
+            if db_type == "sql":
+                columns = [f"{c['name']} {c['type']}" for c in entry["columns"][:max_columns]]
+            else:
+                columns = [f"{f['name']}: {f['type']}" for f in entry["fields"][:max_columns]]
+            line = f"- {name} ({', '.join(columns)})"
+            for fk in entry.get("foreign_keys", []):
+                line += f"; {', '.join(fk['columns'])} -> {fk['references']}({', '.join(fk['referred_columns'])})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def fingerprint(self, db_type: str) -> str:
+        entries = self._entries.get(db_type.lower(), {})
+        shape = {name: entry.get("columns") or entry.get("fields") for name, entry in entries.items()}
+        return hashlib.sha256(json.dumps(shape, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "refresh_interval": self.refresh_interval,
+            "miss_refresh_interval": self.miss_refresh_interval,
+            "backends": {
+                backend: {
+                    "objects": len(self._entries[backend]),
+                    "refreshed_at": self._refreshed_at[backend],
+                    "fingerprint": self.fingerprint(backend),
+                }
+                for backend in ("sql", "mongodb")
+            },
+        }
@@ -0,0 +1,370 @@
+"""Synthetic sample data for the SQL and MongoDB demo schemas.
+
+Generates customers/products/orders/order_items and users/events/sessions
+at a named scale, with skew similar to real shop data: a few customers and
+products account for most orders, most activity is recent and event types
+are far from uniform. Rows are produced in fixed-size chunks, each with its
+own seeded RNG, so a run is reproducible however the chunks are scheduled.
+SQL chunks are bulk-inserted from a thread pool with multi-row INSERTs and
+Mongo chunks with concurrent unordered insert_many calls.
+
+    python -m seeder --scale small
+    python -m seeder --scale large --only sql --workers 8 --reset
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import Column, Date, Integer, MetaData, Numeric, String, Table, func, inspect, select
+
+logger = logging.getLogger(__name__)
+
+SCALES: Dict[str, Dict[str, int]] = {
+    "tiny": {"customers": 100, "products": 50, "orders": 300,
+             "users": 100, "events": 500, "sessions": 200},
+    "small": {"customers": 10_000, "products": 1_000, "orders": 50_000,
+              "users": 10_000, "events": 100_000, "sessions": 20_000},
+    "medium": {"customers": 100_000, "products": 5_000, "orders": 1_000_000,
+               "users": 100_000, "events": 2_000_000, "sessions": 300_000},
+    "large": {"customers": 1_000_000, "products": 20_000, "orders": 10_000_000,
+              "users": 1_000_000, "events": 20_000_000, "sessions": 3_000_000},
+    "xlarge": {"customers": 5_000_000, "products": 50_000, "orders": 50_000_000,
+               "users": 5_000_000, "events": 100_000_000, "sessions": 10_000_000},
+}
+SQL_TABLES = ("customers", "products", "orders", "order_items")
+MONGO_COLLECTIONS = ("users", "events", "sessions")
+
+metadata = MetaData()
+customers = Table(
+    "customers", metadata,
+    Column("customer_id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String(100)),
+    Column("email", String(100)),
+    Column("country", String(50)),
+    Column("city", String(50)),
+    Column("registration_date", Date),
+)
+products = Table(
+    "products", metadata,
+    Column("product_id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String(100)),
+    Column("category", String(50)),
+    Column("price", Numeric(10, 2)),
+    Column("stock_quantity", Integer),
+)
+orders = Table(
+    "orders", metadata,
+    Column("order_id", Integer, primary_key=True, autoincrement=True),
+    Column("customer_id", Integer),
+    Column("order_date", Date),
+    Column("total_amount", Numeric(10, 2)),
+    Column("status", String(20)),
+)
+order_items = Table(
+    "order_items", metadata,
+    Column("item_id", Integer, primary_key=True, autoincrement=True),
+    Column("order_id", Integer),
+    Column("product_id", Integer),
+    Column("quantity", Integer),
+    Column("price", Numeric(10, 2)),
+)
+
+CITIES = {
+    "India": ["Mumbai", "Delhi", "Bangalore", "Hyderabad", "Pune", "Chennai"],
+    "USA": ["New York", "San Francisco", "Chicago", "Austin", "Seattle"],
+    "UK": ["London", "Manchester", "Leeds", "Bristol"],
+    "Germany": ["Berlin", "Munich", "Hamburg"],
+    "Spain": ["Madrid", "Barcelona", "Valencia"],
+    "China": ["Shanghai", "Beijing", "Shenzhen"],
+    "Brazil": ["Sao Paulo", "Rio de Janeiro"],
+    "Dubai": ["Jumeirah", "Deira", "Marina"],
+}
+COUNTRIES = list(CITIES)
+COUNTRY_WEIGHTS = [30, 25, 12, 8, 6, 9, 5, 5]
+FIRST_NAMES = ["Anant", "Sandhya", "Amit", "Dhruv", "Shifa", "Priya", "Arya", "Rahul", "Tasmayee", "Krishna",
+               "Olivia", "Liam", "Emma", "Noah", "Sofia", "Lucas", "Mia", "Wei", "Ana", "Omar"]
+LAST_NAMES = ["Singh", "Patel", "Mishra", "Khan", "Sharma", "Tiwari", "Jaiswal", "Smith", "Garcia", "Muller",
+              "Chen", "Silva", "Brown", "Lopez", "Wang", "Ali"]
+CATEGORIES = {"Electronics": 400.0, "Accessories": 40.0, "Books": 20.0, "Home": 80.0, "Toys": 30.0, "Sports": 60.0}
+CATEGORY_WEIGHTS = [20, 30, 15, 15, 10, 10]
+STATUSES = ["delivered", "shipped", "processing", "cancelled"]
+STATUS_WEIGHTS = [70, 12, 10, 8]
+EVENT_TYPES = ["page_view", "click", "purchase", "signup", "logout"]
+EVENT_WEIGHTS = [60, 25, 5, 3, 7]
+SOURCES = ["google", "direct", "newsletter", "facebook", "referral"]
+
+START_DATE = date(2023, 1, 1)
+SPAN_DAYS = 1000
+CHUNK_SIZE = 10_000
+
+
+def skewed_id(rng: random.Random, n: int, skew: float = 2.5) -> int:
+    """An id in 1..n where low ids are picked far more often (power-law)."""
+    return min(n, 1 + int(n * rng.random() ** skew))
+
+
+def recent_day(rng: random.Random) -> date:
+    # Growth curve: later days are more likely than earlier ones
+    return START_DATE + timedelta(days=int(SPAN_DAYS * rng.random() ** 0.5))
+
+
+def recent_time(rng: random.Random) -> datetime:
+    day = recent_day(rng)
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(86_400))
+
+
+def _iso(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _chunk_rng(seed: int, table: str, start: int) -> random.Random:
+    return random.Random(f"{seed}:{table}:{start}")
+
+
+def _person(rng: random.Random, i: int) -> Dict[str, str]:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {"name": f"{first} {last}", "email": f"{first.lower()}.{last.lower()}{i}@example.com"}
+
+
+def customer_rows(sizes: Dict[str, int], start: int, end: int, seed: int) -> List[Dict[str, Any]]:
+    rng = _chunk_rng(seed, "customers", start)
+    rows = []
+    for i in range(start, end):
+        country = rng.choices(COUNTRIES, COUNTRY_WEIGHTS)[0]
+        rows.append({"customer_id": i, **_person(rng, i), "country": country,
+                     "city": rng.choice(CITIES[country]), "registration_date": recent_day(rng)})
+    return rows
+
+
+def product_price(product_id: int, seed: int) -> tuple:
+    """Category and price of a product, derivable from its id alone."""
+    rng = _chunk_rng(seed, "product_price", product_id)
+    category = rng.choices(list(CATEGORIES), CATEGORY_WEIGHTS)[0]
+    return category, round(CATEGORIES[category] * rng.lognormvariate(0, 0.6), 2)
+
+
+def product_rows(sizes: Dict[str, int], start: int, end: int, seed: int) -> List[Dict[str, Any]]:
+    rng = _chunk_rng(seed, "products", start)
+    rows = []
+    for i in range(start, end):
+        category, price = product_price(i, seed)
+        rows.append({"product_id": i, "name": f"{category} item {i}", "category": category,
+                     "price": price, "stock_quantity": int(rng.expovariate(1 / 200))})
+    return rows
+
+
+def order_rows(sizes: Dict[str, int], start: int, end: int, seed: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Orders and their line items, so totals always match the items."""
+    rng = _chunk_rng(seed, "orders", start)
+    prices: Dict[int, float] = {}
+    order_list, items = [], []
+    for i in range(start, end):
+        total = 0.0
+        for _ in range(rng.choices((1, 2, 3, 4, 5), (40, 30, 15, 10, 5))[0]):
+            product_id = skewed_id(rng, sizes["products"], 3.0)
+            if product_id not in prices:
+                prices[product_id] = product_price(product_id, seed)[1]
+            quantity = rng.choices((1, 2, 3), (75, 18, 7))[0]
+            total += prices[product_id] * quantity
+            # item_id is left to the database, a chunk can't know it up front
+            items.append({"order_id": i, "product_id": product_id, "quantity": quantity,
+                          "price": prices[product_id]})
+        order_list.append({"order_id": i, "customer_id": skewed_id(rng, sizes["customers"]),
+                           "order_date": recent_day(rng), "total_amount": round(total, 2),
+                           "status": rng.choices(STATUSES, STATUS_WEIGHTS)[0]})
+    return {"orders": order_list, "order_items": items}
+
+
+def user_docs(sizes: Dict[str, int], start: int, end: int, seed: int) -> List[Dict[str, Any]]:
+    rng = _chunk_rng(seed, "users", start)
+    return [
+        {"user_id": f"U{i:07d}", **_person(rng, i), "age": int(rng.triangular(18, 75, 30)),
+         "country": rng.choices(COUNTRIES, COUNTRY_WEIGHTS)[0],
+         "registration_date": recent_day(rng).isoformat()}
+        for i in range(start, end)
+    ]
+
+
+def _event_properties(rng: random.Random, event_type: str, sizes: Dict[str, int]) -> Dict[str, Any]:
+    if event_type == "purchase":
+        return {"amount": round(40 * rng.lognormvariate(0, 0.8), 2),
+                "product": f"P{skewed_id(rng, sizes['products'], 3.0)}"}
+    if event_type == "signup":
+        return {"source": rng.choices(SOURCES, (40, 25, 15, 12, 8))[0]}
+    if event_type == "click":
+        return {"element": rng.choice(["buy_button", "search", "banner", "nav"])}
+    return {"page": f"/{rng.choice(['home', 'product', 'cart', 'search', 'account'])}"}
+
+
+def event_docs(sizes: Dict[str, int], start: int, end: int, seed: int) -> List[Dict[str, Any]]:
+    rng = _chunk_rng(seed, "events", start)
+    docs = []
+    for i in range(start, end):
+        event_type = rng.choices(EVENT_TYPES, EVENT_WEIGHTS)[0]
+        docs.append({"event_id": f"E{i:09d}", "user_id": f"U{skewed_id(rng, sizes['users']):07d}",
+                     "event_type": event_type, "timestamp": _iso(recent_time(rng)),
+                     "properties": _event_properties(rng, event_type, sizes)})
+    return docs
+
+
+def session_docs(sizes: Dict[str, int], start: int, end: int, seed: int) -> List[Dict[str, Any]]:
+    rng = _chunk_rng(seed, "sessions", start)
+    docs = []
+    for i in range(start, end):
+        started = recent_time(rng)
+        minutes = max(1, int(rng.expovariate(1 / 20)))
+        docs.append({"session_id": f"S{i:08d}", "user_id": f"U{skewed_id(rng, sizes['users']):07d}",
+                     "start_time": _iso(started), "end_time": _iso(started + timedelta(minutes=minutes)),
+                     "duration_minutes": minutes})
+    return docs
+
+
+def _chunks(total: int, chunk_size: int) -> Iterable[tuple]:
+    for start in range(1, total + 1, chunk_size):
+        yield start, min(total + 1, start + chunk_size)
+
+
+def missing_sql_tables(engine) -> List[str]:
+    existing = set(inspect(engine).get_table_names())
+    return [name for name in SQL_TABLES if name not in existing]
+
+
+async def missing_mongo_collections(db) -> List[str]:
+    existing = set(await db.list_collection_names())
+    return [name for name in MONGO_COLLECTIONS if name not in existing]
+
+
+def _insert_sync(engine, table_rows: Dict[str, List[Dict[str, Any]]], batch_size: int) -> int:
+    inserted = 0
+    with engine.begin() as conn:
+        for name, rows in table_rows.items():
+            table = metadata.tables[name]
+            for offset in range(0, len(rows), batch_size):
+                # executemany, which SQLAlchemy and the MySQL driver send as multi-row INSERTs
+                conn.execute(table.insert(), rows[offset:offset + batch_size])
+            inserted += len(rows)
+    return inserted
+
+
+def seed_sql(engine, sizes: Dict[str, int], seed: int = 42, workers: int = 4, batch_size: int = 1000,
+             chunk_size: int = CHUNK_SIZE, reset: bool = False) -> Dict[str, int]:
+    """Create the SQL tables and fill every empty one, returns rows inserted per table."""
+    if reset:
+        metadata.drop_all(engine)
+    metadata.create_all(engine)
+    if engine.dialect.name == "sqlite":
+        # One writer at a time, parallel chunks would only fight over the lock
+        workers = 1
+
+    with engine.connect() as conn:
+        empty = {name for name in SQL_TABLES
+                 if not conn.execute(select(func.count()).select_from(metadata.tables[name])).scalar()}
+    plan: List[tuple] = []
+    if "customers" in empty:
+        plan += [(customer_rows, "customers", s, e) for s, e in _chunks(sizes["customers"], chunk_size)]
+    if "products" in empty:
+        plan += [(product_rows, "products", s, e) for s, e in _chunks(sizes["products"], chunk_size)]
+    if "orders" in empty and "order_items" in empty:
+        plan += [(order_rows, None, s, e) for s, e in _chunks(sizes["orders"], chunk_size)]
+    for name in SQL_TABLES:
+        if name not in empty:
+            logger.info(f"{name} already has rows, skipping (use --reset to reload)")
+
+    counts = {name: 0 for name in SQL_TABLES}
+
+    def load(task: tuple) -> Dict[str, int]:
+        generate, name, start, end = task
+        generated = generate(sizes, start, end, seed)
+        table_rows = generated if name is None else {name: generated}
+        _insert_sync(engine, table_rows, batch_size)
+        return {table: len(rows) for table, rows in table_rows.items()}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="seed") as pool:
+        for done in pool.map(load, plan):
+            for table, count in done.items():
+                counts[table] += count
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    logger.info(f"SQL seeded {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s): {counts}")
+    return counts
+
+
+async def seed_mongo(db, sizes: Dict[str, int], seed: int = 42, concurrency: int = 4,
+                     chunk_size: int = CHUNK_SIZE, reset: bool = False) -> Dict[str, int]:
+    """Fill every empty collection, returns documents inserted per collection."""
+    generators: Dict[str, Callable] = {"users": user_docs, "events": event_docs, "sessions": session_docs}
+    counts = {name: 0 for name in MONGO_COLLECTIONS}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def load(name: str, start: int, end: int):
+        async with semaphore:
+            docs = await asyncio.to_thread(generators[name], sizes, start, end, seed)
+            await db[name].insert_many(docs, ordered=False)
+            counts[name] += len(docs)
+
+    started = time.perf_counter()
+    tasks = []
+    for name in MONGO_COLLECTIONS:
+        if reset:
+            await db[name].drop()
+        elif await db[name].estimated_document_count():
+            logger.info(f"{name} already has documents, skipping (use --reset to reload)")
+            continue
+        tasks += [load(name, s, e) for s, e in _chunks(sizes[name], chunk_size)]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    logger.info(f"MongoDB seeded {total} documents in {elapsed:.1f}s "
+                f"({total / elapsed if elapsed else 0:.0f} docs/s): {counts}")
+    return counts
+
+
+def scale_sizes(scale: str, overrides: Optional[Dict[str, Optional[int]]] = None) -> Dict[str, int]:
+    sizes = dict(SCALES[scale])
+    for name, value in (overrides or {}).items():
+        if value is not None:
+            sizes[name] = value
+    return sizes
+
+
+async def _run(args):
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / ".env")
+    sizes = scale_sizes(args.scale, {name: getattr(args, name) for name in SCALES["tiny"]})
+    if args.only in (None, "sql"):
+        from sql_executor import create_sql_engine
+
+        engine = create_sql_engine(os.environ["SQL_DATABASE_URL"])
+        await asyncio.to_thread(seed_sql, engine, sizes, args.seed, args.workers, args.batch_size,
+                                args.chunk_size, args.reset)
+        engine.dispose()
+    if args.only in (None, "mongo"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        await seed_mongo(client[os.environ["DB_NAME"]], sizes, args.seed, args.workers, args.chunk_size, args.reset)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=list(SCALES), default="tiny")
+    parser.add_argument("--only", choices=["sql", "mongo"], help="seed just one of the databases")
+    parser.add_argument("--reset", action="store_true", help="drop and reload the demo tables/collections")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4, help="parallel SQL loaders / Mongo inserts")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per INSERT statement")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per transaction / insert_many")
+    for name in SCALES["tiny"]:
+        parser.add_argument(f"--{name}", type=int, help=f"override the number of {name}")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(parser.parse_args()))
@@ -0,0 +1,420 @@
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\d+(?:\.\d+)?|\w+")
+_QUOTED = re.compile(r"\"[^\"]*\"|'[^']*'")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?$")
+_SQL_STRING = re.compile(r"'((?:[^'\\]|\\.|'')*)'")
+_JSON_STRING = re.compile(r"\"((?:[^\"\\]|\\.)*)\"(\s*:)?")
+_JSON_KEY_BEFORE = re.compile(r"\"([$\w]+)\"\s*:\s*$")
+# Values of these keys name collections and fields, they are never literals from the question
+_STRUCTURAL_KEYS = {"find", "aggregate", "from", "localField", "foreignField", "as", "path", "$unwind"}
+_QUERY_NUMBER = re.compile(r"(?<![\w.$])(\d+(?:\.\d+)?)(?![\w.])")
+_FENCE = re.compile(r"```(?:sql|json)?|`", re.IGNORECASE)
+_TRAILING_LIMIT = re.compile(r"\s+limit\s+\d+\s*;?\s*$", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+# Words that only change the phrasing. Negations and comparisons are kept, they change the answer.
+STOPWORDS = {
+    "a", "all", "an", "any", "are", "can", "data", "details", "display", "do", "entries", "every", "fetch",
+    "find", "for", "from", "get", "give", "i", "in", "is", "list", "me", "of", "please", "records",
+    "return", "rows", "see", "show", "that", "the", "there", "to", "us", "want", "what", "which", "who",
+}
+
+# Words that turn a value into a condition, a question may not add or drop any of them
+OPERATOR_WORDS = {
+    "above", "after", "before", "below", "besides", "between", "bottom", "but", "except", "excluding",
+    "fewer", "greater", "higher", "least", "less", "lower", "more", "most", "neither", "never", "no",
+    "nor", "not", "other", "outside", "over", "than", "top", "under", "unlike", "until", "without",
+}
+
+
+def query_key(db_type: str, query: str) -> str:
+    """Key a generated query and the query later executed from it compare equal on.
+
+    SQL runs only its first line, and the cost guard may add a LIMIT.
+    """
+    text = _FENCE.sub("", query).strip()
+    if db_type == "sql":
+        text = next((line for line in text.splitlines() if line.strip()), "")
+        text = _TRAILING_LIMIT.sub("", text.rstrip().rstrip(";"))
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+@dataclass
+class Token:
+    text: str
+    original: str
+    literal: bool
+
+
+def tokenize(question: str) -> List[Token]:
+    quoted = [(m.start(), m.end()) for m in _QUOTED.finditer(question)]
+    tokens = []
+    for i, match in enumerate(_TOKEN.finditer(question)):
+        original = match.group(0)
+        in_quotes = any(start < match.start() < end for start, end in quoted)
+        # A capital past the first word usually marks a name or a value
+        capital = i > 0 and any(c.isupper() for c in original)
+        literal = in_quotes or capital or bool(_NUMBER.match(original))
+        tokens.append(Token(original.lower(), original, literal))
+    return tokens
+
+
+def _transfer_case(value: str, literal: str, typed: str) -> str:
+    """Write ``value`` the way the stored literal relates to what was typed."""
+    if literal == typed:
+        return value
+    if literal == typed.lower():
+        return value.lower()
+    if literal == typed.upper():
+        return value.upper()
+    if literal == typed.title():
+        return value.title()
+    return value
+
+
+@dataclass
+class Slot:
+    """A literal in the stored query that came from the question."""
+    tokens: List[int]
+    literal: str
+    typed: str
+    numeric: bool
+    spans: List[Tuple[int, int, str]] = field(default_factory=list)
+    # Lowercased values this slot held in questions whose query executed
+    values: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class Template:
+    scope: Tuple[str, str]
+    question: str
+    query: str
+    explanation: str
+    optimization: str
+    shape: Counter
+    slots: List[Slot]
+    uses: int = 1
+
+    def render(self, fillers: List[str]) -> Dict[str, str]:
+        spans = []
+        for slot, filler in zip(self.slots, fillers):
+            value = _transfer_case(filler, slot.literal, slot.typed)
+            for start, end, kind in slot.spans:
+                if kind == "sql":
+                    escaped = value.replace("'", "''")
+                elif kind == "json":
+                    escaped = json.dumps(value)[1:-1]
+                else:
+                    escaped = value
+                spans.append((start, end, escaped))
+        query = self.query
+        for start, end, escaped in sorted(spans, reverse=True):
+            query = query[:start] + escaped + query[end:]
+        explanation = self.explanation
+        for slot, filler in zip(self.slots, fillers):
+            explanation = re.sub(re.escape(slot.literal), lambda _: filler, explanation, flags=re.IGNORECASE)
+        return {"query": query, "explanation": explanation, "optimization": self.optimization}
+
+
+def _query_literals(db_type: str, query: str) -> List[Tuple[str, int, int, str]]:
+    """(value, start, end, kind) for each string and number literal in ``query``."""
+    pattern = _SQL_STRING if db_type == "sql" else _JSON_STRING
+    kind = "sql" if db_type == "sql" else "json"
+    literals = []
+    strings = []
+    for match in pattern.finditer(query):
+        strings.append((match.start(), match.end()))
+        if kind == "json":
+            if match.group(2):
+                # Followed by a colon, so it's a key
+                continue
+            key = _JSON_KEY_BEFORE.search(query, max(0, match.start() - 64), match.start())
+            if match.group(1).startswith("$") or (key and key.group(1) in _STRUCTURAL_KEYS):
+                continue
+        literals.append((match.group(1), match.start(1), match.end(1), kind))
+    for match in _QUERY_NUMBER.finditer(query):
+        if not any(start <= match.start() < end for start, end in strings):
+            literals.append((match.group(1), match.start(1), match.end(1), "number"))
+    return literals
+
+
+def _find_run(tokens: List[Token], words: List[str], used: Set[int]) -> Optional[List[int]]:
+    for i in range(len(tokens) - len(words) + 1):
+        indexes = list(range(i, i + len(words)))
+        if not used & set(indexes) and [tokens[j].text for j in indexes] == words:
+            return indexes
+    return None
+
+
+def build_template(scope: Tuple[str, str], question: str, result: Dict[str, str]) -> Template:
+    tokens = tokenize(question)
+    query = result["query"]
+    slots: List[Slot] = []
+    by_value: Dict[str, Slot] = {}
+    used: Set[int] = set()
+    for value, start, end, kind in _query_literals(scope[0], query):
+        words = [t.lower() for t in _TOKEN.findall(value)]
+        # Only values typed as words can be found in the question, dates and codes aren't
+        if not words or value.lower() != " ".join(words):
+            continue
+        slot = by_value.get(value.lower())
+        if slot is None:
+            indexes = _find_run(tokens, words, used)
+            if indexes is None:
+                continue
+            used.update(indexes)
+            typed = " ".join(tokens[i].original for i in indexes)
+            slot = Slot(indexes, value, typed, kind == "number", values={value.lower()})
+            by_value[value.lower()] = slot
+            slots.append(slot)
+        slot.spans.append((start, end, kind))
+    slots.sort(key=lambda s: s.tokens[0])
+    shape = Counter(t.text for i, t in enumerate(tokens) if i not in used and t.text not in STOPWORDS)
+    return Template(
+        scope, question, query, result.get("explanation", ""), result.get("optimization", ""), shape, slots
+    )
+
+
+def _runs(indexes: List[int]) -> List[List[int]]:
+    runs: List[List[int]] = []
+    for i in indexes:
+        if runs and runs[-1][-1] == i - 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    return runs
+
+
+class SimilarityIndex:
+    """In-process TF-IDF index over question -> query pairs that executed.
+
+    A question whose wording, ignoring the literal values, is close enough
+    to a stored one is answered from that pair with its literals swapped,
+    without calling the LLM. Less similar pairs are handed to the prompt as
+    examples. Conversions are held as pending until their query executes
+    successfully, then indexed.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        few_shot_min: float = 0.3,
+        few_shot_k: int = 3,
+        max_entries: int = 5000,
+        max_pending: int = 2000,
+        require_execution: bool = True,
+        known_values_only: bool = True,
+        max_slot_values: int = 256,
+    ):
+        self.threshold = threshold
+        self.few_shot_min = few_shot_min
+        self.few_shot_k = few_shot_k
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+        self.require_execution = require_execution
+        # Only swap in text values a slot has held before, a new name may be
+        # a different kind of value (a city where the query filters countries)
+        self.known_values_only = known_values_only
+        self.max_slot_values = max_slot_values
+        self._templates: "OrderedDict[tuple, Template]" = OrderedDict()
+        self._postings: Dict[str, Set[tuple]] = defaultdict(set)
+        self._df: Counter = Counter()
+        self._pending: "OrderedDict[tuple, Tuple[str, Dict[str, str]]]" = OrderedDict()
+        self._counters = {"added": 0, "answered": 0, "few_shot": 0, "misses": 0}
+
+    @classmethod
+    def from_env(cls) -> "SimilarityIndex":
+        return cls(
+            threshold=float(os.getenv("SIMILARITY_THRESHOLD", "0.9")),
+            few_shot_min=float(os.getenv("SIMILARITY_FEW_SHOT_MIN", "0.3")),
+            few_shot_k=int(os.getenv("SIMILARITY_FEW_SHOT_K", "3")),
+            max_entries=int(os.getenv("SIMILARITY_MAX_ENTRIES", "5000")),
+            require_execution=os.getenv("SIMILARITY_REQUIRE_EXECUTION", "true").lower() in ("1", "true", "yes"),
+            known_values_only=os.getenv("SIMILARITY_KNOWN_VALUES_ONLY", "true").lower() in ("1", "true", "yes"),
+        )
+
+    @staticmethod
+    def scope(db_type: str, datasource: Optional[str]) -> Tuple[str, str]:
+        db_type = "sql" if db_type.lower() == "sql" else "mongodb"
+        return db_type, datasource or db_type
+
+    # -- building ---------------------------------------------------------
+
+    def _idf(self, token: str) -> float:
+        return math.log((len(self._templates) + 1) / (self._df.get(token, 0) + 1)) + 1
+
+    def _remove(self, key: tuple):
+        template = self._templates.pop(key)
+        for token in template.shape:
+            self._df[token] -= 1
+            self._postings[token].discard(key)
+            if not self._df[token]:
+                del self._df[token]
+                del self._postings[token]
+
+    def add(self, question: str, db_type: str, datasource: Optional[str], result: Dict[str, str]):
+        template = build_template(self.scope(db_type, datasource), question, result)
+        if not template.shape:
+            return
+        # Same wording and the same query once its literals are taken out
+        masked = template.query
+        for start, end, _ in sorted((s for slot in template.slots for s in slot.spans), reverse=True):
+            masked = masked[:start] + "?" + masked[end:]
+        key = (template.scope, tuple(sorted(template.shape.items())), query_key(template.scope[0], masked))
+        existing = self._templates.get(key)
+        if existing is not None:
+            existing.uses += 1
+            for slot, other in zip(existing.slots, template.slots):
+                if len(slot.values) < self.max_slot_values:
+                    slot.values |= other.values
+            self._templates.move_to_end(key)
+            return
+        self._templates[key] = template
+        for token in template.shape:
+            self._df[token] += 1
+            self._postings[token].add(key)
+        self._counters["added"] += 1
+        while len(self._templates) > self.max_entries:
+            self._remove(next(iter(self._templates)))
+
+    def observe(self, question: str, db_type: str, datasource: Optional[str], result: Dict[str, str]):
+        """Record a conversion, indexed once its query executes unless execution isn't required."""
+        if not self.require_execution:
+            self.add(question, db_type, datasource, result)
+            return
+        scope = self.scope(db_type, datasource)
+        key = (scope, query_key(scope[0], result["query"]))
+        self._pending[key] = (question, result)
+        self._pending.move_to_end(key)
+        while len(self._pending) > self.max_pending:
+            self._pending.popitem(last=False)
+
+    def confirm(self, query: str, db_type: str, datasource: Optional[str]):
+        """Index the conversion that produced ``query``, which just executed successfully."""
+        scope = self.scope(db_type, datasource)
+        pending = self._pending.pop((scope, query_key(scope[0], query)), None)
+        if pending is not None:
+            self.add(pending[0], db_type, datasource, pending[1])
+
+    async def load(self, history_collection, limit: int = 20_000) -> int:
+        """Rebuild from query_history, pairing conversions with successful executions."""
+        executed: Set[tuple] = set()
+        conversions = []
+        cursor = history_collection.find(
+            {"event": {"$in": ["conversion", "execution"]}},
+            {"_id": 0, "event": 1, "nl_query": 1, "generated_query": 1, "query": 1,
+             "db_type": 1, "datasource": 1, "success": 1},
+        ).sort("timestamp", -1).limit(limit)
+        async for entry in cursor:
+            scope = self.scope(str(entry.get("db_type") or "sql"), entry.get("datasource"))
+            if entry.get("event") == "execution":
+                if entry.get("success") and entry.get("query"):
+                    executed.add((scope, query_key(scope[0], entry["query"])))
+            elif entry.get("nl_query") and entry.get("generated_query"):
+                conversions.append((scope, entry))
+        # Oldest first, so the newest pairs are the last to be evicted
+        for scope, entry in reversed(conversions):
+            result = {"query": entry["generated_query"], "explanation": "", "optimization": ""}
+            if not self.require_execution or (scope, query_key(scope[0], result["query"])) in executed:
+                self.add(entry["nl_query"], scope[0], scope[1], result)
+        return len(self._templates)
+
+    # -- lookups ----------------------------------------------------------
+
+    def _vector(self, counts: Counter) -> Dict[str, float]:
+        vector = {token: count * self._idf(token) for token, count in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {token: v / norm for token, v in vector.items()}
+
+    def _cosine(self, a: Counter, b: Counter) -> float:
+        va, vb = self._vector(a), self._vector(b)
+        return sum(weight * vb.get(token, 0.0) for token, weight in va.items())
+
+    def _align(self, tokens: List[Token], template: Template) -> Optional[Tuple[Counter, List[str]]]:
+        """Split the question into the template's wording and one filler per slot."""
+        operators = Counter(t.text for t in tokens if t.text in OPERATOR_WORDS)
+        if operators != Counter({w: n for w, n in template.shape.items() if w in OPERATOR_WORDS}):
+            # "except India" or "outside India" is not "from India"
+            return None
+        leftover = [i for i, t in enumerate(tokens) if t.text not in STOPWORDS and t.text not in template.shape]
+        if any(not tokens[i].literal for i in leftover):
+            # Only values can differ, any other word changes the question
+            return None
+        runs = _runs(leftover)
+        if len(runs) != len(template.slots):
+            return None
+        fillers = []
+        for run, slot in zip(runs, template.slots):
+            filler = " ".join(tokens[i].original for i in run)
+            if len(run) != len(slot.tokens) or slot.numeric != bool(_NUMBER.match(filler)):
+                return None
+            if self.known_values_only and not slot.numeric and filler.lower() not in slot.values:
+                return None
+            fillers.append(filler)
+        used = {i for run in runs for i in run}
+        shape = Counter(t.text for i, t in enumerate(tokens) if i not in used and t.text not in STOPWORDS)
+        return shape, fillers
+
+    def _candidates(self, scope: Tuple[str, str], counts: Counter) -> List[Tuple[float, tuple]]:
+        keys: Set[tuple] = set()
+        for token in counts:
+            keys |= self._postings.get(token, set())
+        scored = [(self._cosine(counts, self._templates[k].shape), k) for k in keys if k[0] == scope]
+        scored.sort(reverse=True)
+        return scored
+
+    def answer(self, question: str, db_type: str, datasource: Optional[str]) -> Optional[Dict[str, Any]]:
+        """A query built from a stored pair when one is confidently the same question."""
+        tokens = tokenize(question)
+        counts = Counter(t.text for t in tokens if t.text not in STOPWORDS)
+        for _, key in self._candidates(self.scope(db_type, datasource), counts)[:20]:
+            template = self._templates[key]
+            aligned = self._align(tokens, template)
+            if aligned is None:
+                continue
+            shape, fillers = aligned
+            confidence = self._cosine(shape, template.shape)
+            if confidence >= self.threshold:
+                self._counters["answered"] += 1
+                template.uses += 1
+                return {**template.render(fillers), "similarity": round(confidence, 3), "matched": template.question}
+        self._counters["misses"] += 1
+        return None
+
+    def examples(self, question: str, db_type: str, datasource: Optional[str]) -> List[Dict[str, str]]:
+        """The closest stored pairs, for the prompt."""
+        counts = Counter(t.text for t in tokenize(question) if t.text not in STOPWORDS)
+        found = []
+        for score, key in self._candidates(self.scope(db_type, datasource), counts)[:self.few_shot_k]:
+            if score < self.few_shot_min:
+                break
+            template = self._templates[key]
+            found.append({
+                "question": template.question, "query": template.query,
+                "explanation": template.explanation, "optimization": template.optimization,
+            })
+        if found:
+            self._counters["few_shot"] += 1
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._templates),
+            "pending": len(self._pending),
+            "vocabulary": len(self._df),
+            "threshold": self.threshold,
+            "few_shot_min": self.few_shot_min,
+            "require_execution": self.require_execution,
+            "known_values_only": self.known_values_only,
+            **self._counters,
+        }
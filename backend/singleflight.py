@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one upstream call.
+
+    The first caller for a key starts the work as its own task; every caller
+    that arrives while it is running awaits the same result. The work is not
+    tied to the first caller, so a disconnecting client does not fail the
+    others.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self._counters = {"leaders": 0, "shared": 0}
+
+    def _register(self, key: Hashable, flight: asyncio.Future):
+        self._flights[key] = flight
+
+        def done(f: asyncio.Future):
+            if self._flights.get(key) is f:
+                del self._flights[key]
+            # Nobody may be waiting any more, don't warn about it
+            if not f.cancelled():
+                f.exception()
+
+        flight.add_done_callback(done)
+
+    def current(self, key: Hashable) -> Optional[asyncio.Future]:
+        return self._flights.get(key)
+
+    def begin(self, key: Hashable) -> asyncio.Future:
+        """Register a flight that the caller resolves itself."""
+        flight = asyncio.get_running_loop().create_future()
+        self._register(key, flight)
+        self._counters["leaders"] += 1
+        return flight
+
+    async def wait(self, flight: asyncio.Future) -> Any:
+        self._counters["shared"] += 1
+        return await asyncio.shield(flight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = asyncio.ensure_future(fn())
+                self._register(key, flight)
+                self._counters["leaders"] += 1
+            else:
+                self._counters["shared"] += 1
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if flight.cancelled() and not (task and task.cancelling()):
+                    # The flight we joined was abandoned, start our own
+                    continue
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._flights), **self._counters}
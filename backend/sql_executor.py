@@ -0,0 +1,325 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class QueryTimeoutError(Exception):
+    pass
+
+
+class QueryCancelledError(Exception):
+    pass
+
+
+def create_sql_engine(url: str, **overrides: Any) -> Engine:
+    backend = make_url(url).get_backend_name()
+    options: Dict[str, Any] = {
+        "pool_pre_ping": os.getenv("SQL_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle": int(os.getenv("SQL_POOL_RECYCLE_SECONDS", "1800")),
+    }
+    if backend == "sqlite":
+        # SQLite connections are handed across executor threads
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options.update(
+            pool_size=int(os.getenv("SQL_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("SQL_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("SQL_POOL_TIMEOUT_SECONDS", "30")),
+        )
+    options.update(overrides)
+    return create_engine(url, **options)
+
+
+class _QueryHandle:
+    def __init__(self):
+        self.dbapi_connection = None
+        self.connection_id = None
+        self.cancelled = False
+        # Optional dict filled with "execute" and "convert_rows" seconds
+        self.timings: Optional[Dict[str, float]] = None
+        self.lock = threading.Lock()
+
+
+class SQLExecutor:
+    """Runs blocking SQLAlchemy work on a bounded thread pool.
+
+    Queries get a server-side statement timeout where the dialect supports
+    one, and are killed on the server when they time out or the caller
+    goes away.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        max_workers: Optional[int] = None,
+        statement_timeout: float = 30.0,
+        poll_interval: float = 0.25,
+    ):
+        self.engine = engine
+        if max_workers is None:
+            pool = engine.pool
+            size = getattr(pool, "size", lambda: 5)()
+            overflow = max(0, getattr(pool, "_max_overflow", 0))
+            max_workers = size + overflow
+        self.max_workers = max_workers
+        self.statement_timeout = statement_timeout
+        self.poll_interval = poll_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sql")
+        # pending/running are updated from the loop and the worker threads
+        self._gauge_lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._counters = {"queries": 0, "timeouts": 0, "cancelled": 0, "errors": 0}
+
+    @classmethod
+    def from_env(cls, engine: Engine) -> "SQLExecutor":
+        workers = os.getenv("SQL_EXECUTOR_WORKERS")
+        return cls(
+            engine,
+            max_workers=int(workers) if workers else None,
+            statement_timeout=float(os.getenv("SQL_STATEMENT_TIMEOUT_SECONDS", "30")),
+        )
+
+    @property
+    def dialect(self) -> str:
+        return self.engine.dialect.name
+
+    def _tracked(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any) -> Any:
+            with self._gauge_lock:
+                self._pending -= 1
+                self._running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._gauge_lock:
+                    self._running -= 1
+        return wrapper
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        with self._gauge_lock:
+            self._pending += 1
+        return await loop.run_in_executor(self._pool, self._tracked(fn), *args)
+
+    def _apply_statement_timeout(self, conn, timeout: float):
+        ms = int(timeout * 1000)
+        if self.dialect == "mysql":
+            conn.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {ms}")
+        elif self.dialect == "postgresql":
+            conn.exec_driver_sql(f"SET statement_timeout = {ms}")
+
+    def _attach(self, conn, handle: _QueryHandle):
+        raw = conn.connection.dbapi_connection
+        with handle.lock:
+            handle.dbapi_connection = raw
+            thread_id = getattr(raw, "thread_id", None)
+            if callable(thread_id):
+                handle.connection_id = thread_id()
+            if handle.cancelled:
+                raise QueryCancelledError("Query cancelled before it started")
+
+    def _fetch_all_sync(self, sql: str, params: Optional[Dict[str, Any]], timeout: float,
+                        handle: _QueryHandle) -> List[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            self._attach(conn, handle)
+            self._apply_statement_timeout(conn, timeout)
+            try:
+                started = time.perf_counter()
+                rows = conn.execute(text(sql), params or {}).fetchall()
+                fetched = time.perf_counter()
+                records = [dict(row._mapping) for row in rows]
+                if handle.timings is not None:
+                    handle.timings["execute"] = fetched - started
+                    handle.timings["convert_rows"] = time.perf_counter() - fetched
+                return records
+            finally:
+                with handle.lock:
+                    handle.dbapi_connection = None
+
+    def _kill_connection_query(self, connection_id: int):
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql(f"KILL QUERY {int(connection_id)}")
+
+    def _kill_sync(self, handle: _QueryHandle):
+        with handle.lock:
+            handle.cancelled = True
+            raw = handle.dbapi_connection
+            connection_id = handle.connection_id
+        if raw is None:
+            return
+        try:
+            if self.dialect == "mysql" and connection_id is not None:
+                self._kill_connection_query(connection_id)
+            elif self.dialect == "sqlite":
+                raw.interrupt()
+            elif hasattr(raw, "cancel"):
+                raw.cancel()
+        except Exception as e:
+            logger.warning(f"Failed to cancel SQL query: {e}")
+
+    async def _kill(self, handle: _QueryHandle):
+        # Not on self._pool: a saturated pool must still be able to cancel
+        await asyncio.to_thread(self._kill_sync, handle)
+
+    async def fetch_all(
+        self,
+        sql: str,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> List[Dict[str, Any]]:
+        timeout = self.statement_timeout if timeout is None else timeout
+        handle = _QueryHandle()
+        handle.timings = timings
+        self._counters["queries"] += 1
+        future = asyncio.ensure_future(self.run(self._fetch_all_sync, sql, params, timeout, handle))
+        # The result is dropped when we give up on a query, don't warn about it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=self.poll_interval)
+                if done:
+                    return future.result()
+                if time.monotonic() >= deadline:
+                    self._counters["timeouts"] += 1
+                    await self._kill(handle)
+                    raise QueryTimeoutError(f"Query exceeded the {timeout:g}s statement timeout")
+                if is_disconnected is not None and await is_disconnected():
+                    self._counters["cancelled"] += 1
+                    await self._kill(handle)
+                    raise QueryCancelledError("Client disconnected, query cancelled")
+        except asyncio.CancelledError:
+            self._counters["cancelled"] += 1
+            await asyncio.shield(self._kill(handle))
+            raise
+        except (QueryTimeoutError, QueryCancelledError):
+            raise
+        except Exception:
+            self._counters["errors"] += 1
+            raise
+
+    async def stream(
+        self,
+        sql: str,
+        params: Optional[Dict[str, Any]] = None,
+        batch_size: int = 1000,
+        max_rows: Optional[int] = None,
+        timeout: Optional[float] = None,
+        queue_size: int = 4,
+    ) -> AsyncIterator[Any]:
+        """Stream a result set from a server-side cursor.
+
+        Yields the column names first, then lists of row dicts of at most
+        ``batch_size`` rows. At most ``queue_size`` batches are buffered, so
+        memory use does not grow with the size of the result.
+        """
+        timeout = self.statement_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        handle = _QueryHandle()
+
+        def put(item: Any) -> bool:
+            while not handle.cancelled:
+                future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+                try:
+                    future.result(timeout=self.poll_interval)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if not future.cancel():
+                        return True
+            return False
+
+        def produce():
+            finished = False
+            try:
+                with self.engine.connect() as conn:
+                    self._attach(conn, handle)
+                    self._apply_statement_timeout(conn, timeout)
+                    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                        text(sql), params or {}
+                    )
+                    if not put(list(result.keys())):
+                        return
+                    sent = 0
+                    stopped_early = False
+                    for partition in result.partitions(batch_size):
+                        rows = [dict(row._mapping) for row in partition]
+                        if max_rows is not None and sent + len(rows) >= max_rows:
+                            # Rows may remain even when the cap falls on a
+                            # partition boundary, so always stop the statement
+                            stopped_early = True
+                            put(rows[:max_rows - sent])
+                            break
+                        if not put(rows):
+                            return
+                        sent += len(rows)
+                    finished = put(_END)
+                    if stopped_early and handle.connection_id is not None:
+                        # Closing an unbuffered MySQL cursor reads the remaining
+                        # rows, stop the statement on the server instead
+                        self._kill_connection_query(handle.connection_id)
+            except Exception as e:
+                if finished:
+                    logger.warning(f"Error closing streamed SQL result: {e}")
+                else:
+                    put(e)
+            finally:
+                with handle.lock:
+                    handle.dbapi_connection = None
+                if not finished:
+                    put(_END)
+
+        self._counters["queries"] += 1
+        task = asyncio.ensure_future(self.run(produce))
+        producer_done = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    producer_done = True
+                    break
+                if isinstance(item, Exception):
+                    producer_done = True
+                    self._counters["errors"] += 1
+                    raise item
+                yield item
+        finally:
+            if not producer_done and not task.done():
+                self._counters["cancelled"] += 1
+                await asyncio.shield(self._kill(handle))
+
+    def stats(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        pool_stats = {"status": pool.status()}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(pool, name, None)
+            if callable(method):
+                pool_stats[name] = method()
+        return {
+            "dialect": self.dialect,
+            "max_workers": self.max_workers,
+            "pending": self._pending,
+            "running": self._running,
+            "statement_timeout": self.statement_timeout,
+            "pool": pool_stats,
+            **self._counters,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, Budget, RateLimiter
+
+
+def scope(client="10.0.0.1", headers=()):
+    return {
+        "type": "http",
+        "client": (client, 51000),
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    }
+
+
+def test_client_key_defaults_to_the_peer_address():
+    controller = AdmissionController({})
+    assert controller.client_key(scope()) == "10.0.0.1"
+    # A client picked header is ignored unless the operator configured it
+    assert controller.client_key(scope(headers=[("x-client-id", "rotated-1")])) == "10.0.0.1"
+    assert controller.client_key({"type": "http", "headers": []}) == "unknown"
+
+
+def test_client_key_uses_the_configured_proxy_header():
+    controller = AdmissionController({}, client_header="X-Forwarded-For")
+    assert controller.client_key(scope(client="10.0.0.2", headers=[("x-forwarded-for", "203.0.113.7")])) == "203.0.113.7"
+    # Entries a client sent itself come before the one the proxy appended
+    spoofed = scope(client="10.0.0.2", headers=[("x-forwarded-for", "1.2.3.4, 203.0.113.7")])
+    assert controller.client_key(spoofed) == "203.0.113.7"
+    assert controller.client_key(scope(client="10.0.0.2")) == "10.0.0.2"
+
+
+def test_from_env_trusts_no_header_by_default(monkeypatch):
+    monkeypatch.delenv("RATE_LIMIT_CLIENT_HEADER", raising=False)
+    assert AdmissionController.from_env().client_header is None
+    monkeypatch.setenv("RATE_LIMIT_CLIENT_HEADER", "X-Real-IP")
+    assert AdmissionController.from_env().client_header == "x-real-ip"
+
+
+def test_rate_limit_per_client():
+    controller = AdmissionController({}, RateLimiter(rate=1, burst=2))
+    controller.check_rate("a")
+    controller.check_rate("a")
+    with pytest.raises(AdmissionRejected) as info:
+        controller.check_rate("a")
+    assert info.value.status == 429
+    assert 0 < info.value.retry_after <= 1
+    controller.check_rate("b")
+
+
+def test_budget_rejects_when_the_queue_times_out():
+    async def scenario():
+        budget = Budget("sql", limit=1, max_wait=0.05)
+        async with budget.slot():
+            with pytest.raises(AdmissionRejected) as info:
+                async with budget.slot():
+                    pass
+        async with budget.slot():
+            pass
+        return info.value, budget.stats()
+
+    error, stats = asyncio.run(scenario())
+    assert error.status == 503
+    assert stats["admitted"] == 2
+    assert stats["timed_out"] == 1
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
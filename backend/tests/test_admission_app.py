@@ -0,0 +1,71 @@
+import asyncio
+
+import httpx
+
+from admission import Budget
+from benchmarks.fake_llm import FakeLLMConfig
+from benchmarks.load_test import start_local_app
+
+QUERY = {"query": "SELECT customer_id, name FROM customers LIMIT 5", "db_type": "sql"}
+
+
+async def wait_for_job(client: httpx.AsyncClient, job_id: str) -> dict:
+    for _ in range(200):
+        status = (await client.get(f"/api/jobs/{job_id}")).json()
+        if status["state"] in ("succeeded", "failed", "cancelled"):
+            return status
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+# One test for the whole app: main binds its asyncio state to the first loop it runs on
+def test_stream_jobs_and_convert_take_admission_slots(tmp_path):
+    async def scenario():
+        main, cleanup = await start_local_app("tiny", str(tmp_path), FakeLLMConfig(latency=0, tokens_per_second=0))
+        main.admission.budgets["sql"] = sql = Budget("sql", 1, 0.1)
+        main.admission.budgets["llm"] = llm = Budget("llm", 1, 0.1)
+        transport = httpx.ASGITransport(app=main.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30)
+        try:
+            response = await client.post("/api/execute-query/stream", json=QUERY)
+            assert response.status_code == 200
+            assert len(response.text.splitlines()) == 5
+            # Non-positive caps are rejected before anything runs
+            for cap in ({"max_rows": -5}, {"max_rows": 0}, {"batch_size": -1}):
+                response = await client.post("/api/execute-query/stream", json={**QUERY, **cap})
+                assert response.status_code == 422
+            response = await client.post("/api/execute-query/stream", json={**QUERY, "max_rows": 2})
+            assert len(response.text.splitlines()) == 2
+            assert response.headers["X-Row-Cap"] == "2"
+            for cap in ({"max_rows": -5}, {"batch_size": 0}):
+                assert (await client.post("/api/jobs", json={**QUERY, **cap})).status_code == 422
+            job = (await client.post("/api/jobs", json=QUERY)).json()
+            done = await wait_for_job(client, job["job_id"])
+            assert done["state"] == "succeeded"
+            assert done["progress"]["rows"] == 5
+            assert not done["progress"]["capped"]
+            # Both released their slot once the rows were out
+            assert sql.stats()["admitted"] == 3
+            assert sql.in_flight == 0
+
+            async with main.admission.slot("sql"):
+                response = await client.post("/api/execute-query/stream", json=QUERY)
+                assert response.status_code == 503
+                assert "Retry-After" in response.headers
+                job = (await client.post("/api/jobs", json=QUERY)).json()
+                failed = await wait_for_job(client, job["job_id"])
+                assert failed["state"] == "failed"
+                assert "overloaded" in failed["error"]
+            assert sql.in_flight == 0
+
+            async with main.admission.slot("llm"):
+                response = await client.post(
+                    "/api/convert-query", json={"query": "Show all orders over 100", "db_type": "sql"}
+                )
+                assert response.status_code == 503
+            assert llm.in_flight == 0
+        finally:
+            await client.aclose()
+            await cleanup()
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import asyncio
+
+from cost_guard import CostGuard, add_limit, has_limit
+from query_safety import analyze_sql, needs_full_read
+
+
+def test_add_limit_after_trailing_comments():
+    cases = {
+        "SELECT * FROM customers": "SELECT * FROM customers LIMIT 1000",
+        "SELECT * FROM customers;  ": "SELECT * FROM customers LIMIT 1000",
+        "SELECT * FROM customers -- all rows": "SELECT * FROM customers LIMIT 1000",
+        "SELECT * FROM customers; -- all rows\n": "SELECT * FROM customers LIMIT 1000",
+        "SELECT * FROM customers /* all rows */ ;": "SELECT * FROM customers LIMIT 1000",
+        "SELECT * -- every column\nFROM customers": "SELECT * -- every column\nFROM customers LIMIT 1000",
+        "SELECT '--;' AS marker FROM customers": "SELECT '--;' AS marker FROM customers LIMIT 1000",
+    }
+    for sql, expected in cases.items():
+        limited = add_limit(sql, 1000)
+        assert limited == expected
+        assert has_limit(limited)
+        assert analyze_sql(limited).limit == 1000
+
+
+def test_needs_full_read_looks_at_code_only():
+    assert needs_full_read("SELECT * FROM orders ORDER BY created_at DESC LIMIT 10")
+    assert needs_full_read("SELECT status, COUNT(*) FROM orders GROUP BY status")
+    assert needs_full_read("SELECT DISTINCT city FROM customers LIMIT 10")
+    assert needs_full_read("SELECT max (total) FROM orders")
+    assert not needs_full_read("SELECT * FROM customers WHERE city = 'Max' LIMIT 10")
+    assert not needs_full_read("SELECT * FROM customers WHERE note = 'order by date' LIMIT 10")
+    assert not needs_full_read("SELECT count, o.sum, \"max\" FROM stats LIMIT 10")
+    assert not needs_full_read("SELECT * FROM orders -- group by status\nLIMIT 10")
+
+
+def test_bounded_lookup_on_a_large_table_is_allowed():
+    class Explained(CostGuard):
+        async def explain(self, sql):
+            return 50_000_000, [{"table": "customers", "scan": "ALL", "key": None, "rows": 50_000_000}]
+
+    guard = Explained(sql_executor=object(), max_rows=10_000_000)
+    lookup = asyncio.run(guard.check_sql("SELECT * FROM customers WHERE city = 'Max' LIMIT 10"))
+    assert lookup["action"] == "allowed"
+    sorted_scan = asyncio.run(guard.check_sql("SELECT * FROM customers ORDER BY city LIMIT 10"))
+    assert sorted_scan["action"] == "blocked"
@@ -0,0 +1,65 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from insights_rollup import InsightRollups
+
+
+def conversion(question, query, timestamp="2024-05-01T10:00:00+00:00"):
+    return {"event": "conversion", "db_type": "sql", "nl_query": question,
+            "generated_query": query, "timestamp": timestamp}
+
+
+def test_backfill_swaps_in_a_rebuilt_collection():
+    async def scenario():
+        db = AsyncMongoMockClient()["insights_test"]
+        known = {"sql": ["customers", "orders"]}
+        rollups = InsightRollups(db.query_rollups, buckets=("day",), known_names=lambda t: known.get(t, []))
+        await rollups.ensure_indexes()
+        await db.query_history.insert_many([
+            conversion("Show customers", "SELECT * FROM customers"),
+            conversion("Show customers", "SELECT * FROM customers"),
+            conversion("Orders per customer", "SELECT * FROM orders o JOIN customers c ON c.id = o.customer_id"),
+            # "information_schema" is not a real table of the source
+            conversion("List tables", "SELECT * FROM information_schema.tables"),
+            {"event": "execution", "db_type": "sql", "query": "SELECT * FROM orders"},
+        ])
+        # Stale counts from before are replaced, not added to
+        await db.query_rollups.insert_one({"kind": "table", "bucket": "all", "period": "all",
+                                           "db_type": "sql", "key": "stale", "count": 99})
+        result = await rollups.backfill(db.query_history)
+        tables = await rollups.top("table", limit=10)
+        questions = await rollups.top("question", limit=10)
+        names = await db.list_collection_names()
+        indexes = await db.query_rollups.index_information()
+        return result, tables, questions, names, indexes
+
+    result, tables, questions, names, indexes = asyncio.run(scenario())
+    assert result["history_entries"] == 4
+    assert result["replayed"] == 0
+    assert [(t["key"], t["count"]) for t in tables] == [("customers", 3), ("orders", 1)]
+    assert questions[0]["count"] == 2
+    assert "query_rollups_backfill" not in names
+    assert len(indexes) == 3
+
+
+def test_backfill_replays_conversions_logged_while_it_ran():
+    async def scenario():
+        db = AsyncMongoMockClient()["insights_test"]
+        rollups = InsightRollups(db.query_rollups, buckets=())
+        await db.query_history.insert_one(conversion("Show customers", "SELECT * FROM customers"))
+        ensure_indexes = rollups.ensure_indexes
+
+        async def log_then_ensure_indexes(collection=None):
+            # A live conversion arrives once the rebuild has started
+            await db.query_history.insert_one(conversion("Show orders", "SELECT * FROM orders"))
+            await rollups.record(conversion("Show orders", "SELECT * FROM orders"))
+            await ensure_indexes(collection)
+
+        rollups.ensure_indexes = log_then_ensure_indexes
+        result = await rollups.backfill(db.query_history)
+        return result, await rollups.top("table", limit=10)
+
+    result, tables = asyncio.run(scenario())
+    assert result["replayed"] == 1
+    assert sorted((t["key"], t["count"]) for t in tables) == [("customers", 1), ("orders", 1)]
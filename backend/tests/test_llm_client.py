@@ -0,0 +1,143 @@
+import asyncio
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.fake_llm import FakeLLMConfig, start_fake_llm
+from llm_client import LLMClient, LLMError, parse_retry_after
+
+MESSAGES = [{"role": "system", "content": "convert"}, {"role": "user", "content": "Show customers"}]
+
+
+def run_against_fake(config: FakeLLMConfig, scenario, **client_options):
+    async def main():
+        runner, base_url, state = await start_fake_llm(config)
+        client = LLMClient("test", "fake", base_url=base_url, backoff_base=0.01, backoff_max=0.05, **client_options)
+        try:
+            return await scenario(client, state)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after("soon") is None
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(later, usegmt=True)) <= 30
+    earlier = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(earlier, usegmt=True)) == 0.0
+
+
+def test_retries_rate_limited_requests():
+    async def scenario(client, state):
+        results = [await client.chat(MESSAGES) for _ in range(4)]
+        return results, state.requests, client.stats()
+
+    results, requests, stats = run_against_fake(FakeLLMConfig(latency=0, error_rate=0.5), scenario)
+    assert all(r["choices"][0]["message"]["content"] for r in results)
+    # Every second request is refused, the first call goes through directly
+    assert requests == 7
+    assert stats["calls"] == 4
+    assert stats["requests"] == 7
+    assert stats["retries"] == 3
+    assert stats["rate_limited"] == 3
+    assert stats["errors"] == 0
+
+
+def test_waits_for_retry_after():
+    async def scenario(client, state):
+        await client.chat(MESSAGES)
+        started = time.perf_counter()
+        await client.chat(MESSAGES)
+        return time.perf_counter() - started
+
+    # Backoff alone is at most 50ms, the server asks for 300ms
+    elapsed = run_against_fake(FakeLLMConfig(latency=0, error_rate=0.5, retry_after="0.3"), scenario)
+    assert elapsed >= 0.3
+
+
+def test_gives_up_after_max_retries():
+    async def scenario(client, state):
+        with pytest.raises(LLMError) as info:
+            await client.chat(MESSAGES)
+        return info.value, state.requests, client.stats()
+
+    error, requests, stats = run_against_fake(FakeLLMConfig(latency=0, error_rate=1), scenario, max_retries=2)
+    assert error.status == 429
+    assert requests == 3
+    assert stats["retries"] == 2
+    assert stats["errors"] == 1
+
+
+def test_non_json_client_error_is_not_retried():
+    async def scenario(client, state):
+        with pytest.raises(LLMError) as info:
+            await client.chat(MESSAGES)
+        return info.value, state.requests, client.stats()
+
+    error, requests, stats = run_against_fake(FakeLLMConfig(latency=0, error_rate=1, error_status=400), scenario)
+    assert error.status == 400
+    assert "<html>" in str(error)
+    assert requests == 1
+    assert stats["errors"] == 1
+
+
+def test_semaphore_queues_calls():
+    async def scenario(client, state):
+        tasks = [asyncio.ensure_future(client.chat(MESSAGES)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        during = client.stats()
+        await asyncio.gather(*tasks)
+        return during, client.stats()
+
+    during, after = run_against_fake(FakeLLMConfig(latency=0.2, tokens_per_second=0), scenario, max_concurrency=2)
+    assert during["in_flight"] == 2
+    assert during["waiting"] == 3
+    assert after["in_flight"] == 0
+    assert after["waiting"] == 0
+    assert after["calls"] == 5
+    assert after["avg_latency_ms"] >= 200
+    assert after["prompt_tokens"] > 0 and after["completion_tokens"] > 0
+    assert set(after["pool"]) == {"limit", "acquired", "idle"}
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario(client, state):
+        running = asyncio.ensure_future(client.chat(MESSAGES))
+        queued = asyncio.ensure_future(client.chat(MESSAGES))
+        await asyncio.sleep(0.05)
+        assert client.stats()["waiting"] == 1
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        waiting = client.stats()["waiting"]
+        await running
+        # The slot is free again
+        await client.chat(MESSAGES)
+        return waiting, client.stats()
+
+    waiting, stats = run_against_fake(FakeLLMConfig(latency=0.2, tokens_per_second=0), scenario, max_concurrency=1)
+    assert waiting == 0
+    assert stats["waiting"] == 0
+    assert stats["in_flight"] == 0
+    assert stats["calls"] == 2
+
+
+def test_stream_yields_the_completion():
+    async def scenario(client, state):
+        deltas = [delta async for delta in client.chat_stream(MESSAGES)]
+        return deltas, state.streams, client.stats()
+
+    deltas, streams, stats = run_against_fake(FakeLLMConfig(latency=0, tokens_per_second=0), scenario)
+    assert "".join(deltas).startswith("SELECT * FROM customers")
+    assert streams == 1
+    assert stats["in_flight"] == 0
+    assert stats["calls"] == 1
@@ -0,0 +1,63 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from pipeline_optimizer import PipelineOptimizer
+from schema_catalog import SchemaCatalog
+
+
+def catalog_for(setup) -> SchemaCatalog:
+    async def load():
+        db = AsyncMongoMockClient()["optimizer_test"]
+        await db.users.insert_one({"email": "a@example.com", "age": 30, "region": "eu", "country": "IN"})
+        await setup(db.users)
+        catalog = SchemaCatalog(mongo_db=db)
+        await catalog.refresh("mongodb")
+        return catalog
+
+    return asyncio.run(load())
+
+
+def hint_for(catalog: SchemaCatalog, filter_dict):
+    query, _ = PipelineOptimizer(catalog).optimize("users", {"find": "users", "filter": filter_dict})
+    return query.get("hint")
+
+
+def test_catalog_records_index_properties():
+    async def setup(users):
+        await users.create_index("email", sparse=True)
+        await users.create_index([("region", "hashed")])
+        await users.create_index("age", partialFilterExpression={"age": {"$gt": 18}})
+
+    indexes = {ix["name"]: ix for ix in catalog_for(setup).cached("mongodb", "users")["indexes"]}
+    assert indexes["email_1"]["sparse"] is True
+    assert indexes["region_hashed"]["key_types"] == ["hashed"]
+    assert indexes["age_1"]["partial_filter"] == {"age": {"$gt": 18}}
+    assert indexes["_id_"] == {"name": "_id_", "columns": ["_id"], "unique": False, "sparse": False,
+                               "partial_filter": None, "key_types": ["ordered"]}
+
+
+def test_sparse_partial_and_hashed_indexes_are_never_hinted():
+    async def setup(users):
+        await users.create_index("email", sparse=True)
+        await users.create_index([("region", "hashed")])
+        await users.create_index("age", partialFilterExpression={"age": {"$gt": 18}})
+
+    catalog = catalog_for(setup)
+    assert hint_for(catalog, {"email": None}) is None
+    assert hint_for(catalog, {"email": "a@example.com"}) is None
+    assert hint_for(catalog, {"region": {"$gte": "a"}}) is None
+    assert hint_for(catalog, {"age": {"$gt": 30}}) is None
+
+
+def test_null_missing_and_negated_predicates_do_not_drive_a_hint():
+    async def setup(users):
+        await users.create_index("email")
+        await users.create_index("country")
+
+    catalog = catalog_for(setup)
+    assert hint_for(catalog, {"email": "a@example.com"}) == "email_1"
+    assert hint_for(catalog, {"country": {"$in": ["IN", "US"]}}) == "country_1"
+    for condition in (None, {"$exists": False}, {"$ne": "x"}, {"$nin": ["x"]}, {"$eq": None},
+                      {"$in": [None, "x"]}, {"$not": {"$eq": "x"}}):
+        assert hint_for(catalog, {"email": condition}) is None
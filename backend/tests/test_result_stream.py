@@ -0,0 +1,100 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import pyarrow as pa
+
+from result_stream import encode_arrow, encode_ndjson, row_caps
+
+
+async def source(*batches, error=None):
+    for batch in batches:
+        yield batch
+    if error is not None:
+        raise error
+
+
+def read_arrow(batches, columns=None, schema_rows=10_000):
+    async def collect():
+        return b"".join([chunk async for chunk in encode_arrow(batches, columns, schema_rows)])
+
+    reader = pa.ipc.open_stream(asyncio.run(collect()))
+    rows, errors = [], []
+    while True:
+        try:
+            batch, metadata = reader.read_next_batch_with_custom_metadata()
+        except StopIteration:
+            break
+        rows.extend(batch.to_pylist())
+        if metadata and b"error" in metadata:
+            errors.append(metadata[b"error"].decode())
+    return reader.schema, rows, errors
+
+
+def test_arrow_waits_for_a_value_in_every_known_column():
+    batches = source([{"id": 1, "amount": None}], [{"id": 2, "amount": Decimal("12.50")}])
+    schema, rows, errors = read_arrow(batches, columns=["id", "amount"])
+    assert schema.field("id").type == pa.int64()
+    assert pa.types.is_decimal(schema.field("amount").type)
+    assert [row["amount"] for row in rows] == [None, Decimal("12.50")]
+    assert errors == []
+
+
+def test_arrow_null_and_mixed_columns_become_strings():
+    batches = source([{"id": 1, "note": None, "value": 1}], [{"id": 2, "note": None, "value": "n/a"}])
+    schema, rows, errors = read_arrow(batches, columns=["id", "note", "value"])
+    assert schema.field("note").type == pa.string()
+    assert schema.field("value").type == pa.string()
+    assert [row["value"] for row in rows] == ["1", "n/a"]
+    assert errors == []
+
+
+def test_arrow_includes_mongo_keys_first_seen_in_later_batches():
+    batches = source([{"name": "a"}], [{"name": "b", "tags": ["x"], "meta": {"k": 1}}])
+    schema, rows, errors = read_arrow(batches)
+    assert schema.names == ["name", "tags", "meta"]
+    assert rows[1] == {"name": "b", "tags": ["x"], "meta": {"k": 1}}
+    assert rows[0]["tags"] is None
+    assert errors == []
+
+
+def test_arrow_reports_a_late_new_key_or_type_change():
+    _, rows, errors = read_arrow(source([{"name": "a"}], [{"name": "b", "age": 3}]), schema_rows=1)
+    assert rows == [{"name": "a"}]
+    assert len(errors) == 1 and "age" in errors[0]
+
+    _, rows, errors = read_arrow(source([{"id": 1}], [{"id": "two"}]), columns=["id"])
+    assert rows == [{"id": 1}]
+    assert len(errors) == 1 and "'id'" in errors[0]
+
+
+def test_arrow_reports_source_errors():
+    schema, rows, errors = read_arrow(source(error=RuntimeError("connection lost")))
+    assert schema.names == ["error"]
+    assert rows == [{"error": "connection lost"}]
+
+    _, rows, errors = read_arrow(source([{"id": 1}], error=RuntimeError("connection lost")), columns=["id"])
+    assert rows == [{"id": 1}]
+    assert errors == ["connection lost"]
+
+
+def test_arrow_empty_result():
+    schema, rows, errors = read_arrow(source(), columns=["id"])
+    assert schema.names == ["id"]
+    assert rows == [] and errors == []
+
+
+def test_ndjson_reports_errors_as_the_last_line():
+    async def collect():
+        return b"".join([chunk async for chunk in encode_ndjson(source([{"id": 1}], error=RuntimeError("boom")))])
+
+    lines = [json.loads(line) for line in asyncio.run(collect()).splitlines()]
+    assert lines == [{"id": 1}, {"error": "boom"}]
+
+
+def test_row_caps_stay_positive_and_within_the_cap():
+    assert row_caps(None, None, 1000, 100) == (1000, 100)
+    assert row_caps(50, None, 1000, 100) == (50, 50)
+    assert row_caps(5000, 10, 1000, 100) == (1000, 10)
+    assert row_caps(-5, -1, 1000, 100) == (1, 1)
+    assert row_caps(0, 0, 1000, 100) == (1, 1)
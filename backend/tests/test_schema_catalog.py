@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from schema_catalog import SchemaCatalog
+from sql_executor import SQLExecutor, create_sql_engine
+
+
+@pytest.fixture
+def executor(tmp_path):
+    engine = create_sql_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT)"))
+    executor = SQLExecutor(engine, max_workers=2)
+    yield executor
+    executor.shutdown()
+    engine.dispose()
+
+
+def create_orders(executor):
+    with executor.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY)"))
+
+
+def test_unknown_names_refresh_at_most_once_per_interval(executor):
+    catalog = SchemaCatalog(sql_executor=executor, miss_refresh_interval=60)
+
+    async def scenario():
+        assert (await catalog.get("sql", "customers"))["name"] == "customers"
+        # Loaded just now, so a miss doesn't refresh again yet
+        assert await asyncio.gather(*[catalog.get("sql", f"missing_{i}") for i in range(20)]) == [None] * 20
+        create_orders(executor)
+        assert await catalog.get("sql", "orders") is None
+        catalog.miss_refresh_interval = 0
+        assert (await catalog.get("sql", "orders"))["name"] == "orders"
+
+    asyncio.run(scenario())
+    stats = catalog.stats()
+    assert stats["refreshes"] == 2
+    assert stats["misses"] == 22
+    assert stats["miss_refreshes"] == 1
+
+
+def test_concurrent_misses_share_one_refresh(executor):
+    catalog = SchemaCatalog(sql_executor=executor, miss_refresh_interval=0)
+
+    async def scenario():
+        await catalog.refresh("sql")
+        create_orders(executor)
+        return await asyncio.gather(*[catalog.get("sql", "orders") for _ in range(10)])
+
+    entries = asyncio.run(scenario())
+    assert all(entry["name"] == "orders" for entry in entries)
+    assert catalog.stats()["refreshes"] == 2
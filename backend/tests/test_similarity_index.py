@@ -0,0 +1,50 @@
+from similarity_index import SimilarityIndex
+
+CUSTOMERS = {"query": "SELECT * FROM customers WHERE country = 'India'", "explanation": "", "optimization": ""}
+
+
+def customers_index(**options) -> SimilarityIndex:
+    index = SimilarityIndex(**options)
+    index.add("Show all customers from India", "sql", None, CUSTOMERS)
+    return index
+
+
+def answered(index: SimilarityIndex, question: str):
+    result = index.answer(question, "sql", None)
+    return result["query"] if result else None
+
+
+def test_answers_a_rephrased_question():
+    index = customers_index()
+    assert answered(index, "show customers from India please") == CUSTOMERS["query"]
+
+
+def test_operator_words_fall_through_to_the_llm():
+    index = customers_index(known_values_only=False)
+    assert answered(index, "customers except India") is None
+    assert answered(index, "customers outside India") is None
+    assert answered(index, "Show all customers not from India") is None
+
+
+def test_fillers_must_be_literals_of_the_slot_length():
+    index = customers_index(known_values_only=False)
+    assert answered(index, "Show all customers from Japan") == "SELECT * FROM customers WHERE country = 'Japan'"
+    assert answered(index, "Show all customers from japan") is None
+    assert answered(index, "Show all customers from New Zealand") is None
+
+
+def test_only_known_values_are_swapped_in():
+    index = customers_index()
+    assert answered(index, "Show all customers from Mumbai") is None
+    index.add("Show all customers from Japan", "sql", None,
+              {"query": "SELECT * FROM customers WHERE country = 'Japan'", "explanation": "", "optimization": ""})
+    assert answered(index, "customers from Japan") == "SELECT * FROM customers WHERE country = 'Japan'"
+    assert answered(index, "customers from India") == CUSTOMERS["query"]
+
+
+def test_numbers_are_swapped_without_being_known():
+    index = SimilarityIndex()
+    index.add("Show orders over 100", "sql", None,
+              {"query": "SELECT * FROM orders WHERE total_amount > 100", "explanation": "", "optimization": ""})
+    assert answered(index, "Show orders over 250") == "SELECT * FROM orders WHERE total_amount > 250"
+    assert answered(index, "Show orders under 250") is None
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import pytest
+
+from sql_executor import QueryTimeoutError, SQLExecutor, create_sql_engine
+
+# Counts to n in SQLite's VM, a few seconds at the default size
+SLOW_QUERY = (
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < :n) "
+    "SELECT count(*) AS n FROM c"
+)
+
+
+@pytest.fixture
+def executor(tmp_path):
+    engine = create_sql_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    executor = SQLExecutor(engine, max_workers=2, statement_timeout=10, poll_interval=0.05)
+    yield executor
+    executor.shutdown()
+    engine.dispose()
+
+
+async def sample_lag(task: asyncio.Future) -> float:
+    worst = 0.0
+    while not task.done():
+        started = time.perf_counter()
+        await asyncio.sleep(0)
+        worst = max(worst, time.perf_counter() - started)
+    return worst
+
+
+def test_slow_query_does_not_block_the_event_loop(executor):
+    async def scenario():
+        started = time.perf_counter()
+        task = asyncio.ensure_future(executor.fetch_all(SLOW_QUERY, {"n": 3_000_000}))
+        worst = await sample_lag(task)
+        return await task, time.perf_counter() - started, worst
+
+    rows, elapsed, worst = asyncio.run(scenario())
+    assert rows == [{"n": 3_000_000}]
+    assert elapsed > 0.1
+    assert worst < 0.1
+    assert executor.stats()["queries"] == 1
+
+
+def test_timeout_interrupts_the_query(executor):
+    async def scenario():
+        started = time.perf_counter()
+        task = asyncio.ensure_future(executor.fetch_all(SLOW_QUERY, {"n": 10 ** 10}, timeout=0.2))
+        worst = await sample_lag(task)
+        with pytest.raises(QueryTimeoutError):
+            await task
+        elapsed = time.perf_counter() - started
+        # The interrupted statement hands its worker back
+        for _ in range(100):
+            if executor.stats()["running"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        follow_up = await executor.fetch_all("SELECT 1 AS one")
+        return elapsed, worst, follow_up
+
+    elapsed, worst, follow_up = asyncio.run(scenario())
+    assert elapsed < 1.0
+    assert worst < 0.1
+    assert follow_up == [{"one": 1}]
+    stats = executor.stats()
+    assert stats["timeouts"] == 1
+    assert stats["running"] == 0
+
+
+def test_cancelled_caller_interrupts_the_query(executor):
+    async def scenario():
+        task = asyncio.ensure_future(executor.fetch_all(SLOW_QUERY, {"n": 10 ** 10}))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for _ in range(100):
+            if executor.stats()["running"] == 0:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    stats = executor.stats()
+    assert stats["cancelled"] == 1
+    assert stats["running"] == 0
+
+
+def test_stream_stops_at_max_rows_on_a_batch_boundary(executor, monkeypatch):
+    killed = []
+    monkeypatch.setattr(executor, "_kill_connection_query", killed.append)
+
+    def attach(conn, handle):
+        # Stand in for a MySQL connection id, SQLite has none
+        handle.connection_id = 7
+
+    monkeypatch.setattr(executor, "_attach", attach)
+
+    async def scenario():
+        batches = [batch async for batch in executor.stream(SLOW_QUERY.replace("count(*) AS n", "x"),
+                                                            {"n": 100}, batch_size=10, max_rows=20)]
+        # The statement is stopped after the end of the stream was handed over
+        for _ in range(100):
+            if executor.stats()["running"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        return batches
+
+    columns, *batches = asyncio.run(scenario())
+    assert columns == ["x"]
+    assert [len(batch) for batch in batches] == [10, 10]
+    assert killed == [7]
+
+
+def test_pending_and_running_return_to_zero(executor):
+    async def scenario():
+        await asyncio.gather(*[executor.run(time.sleep, 0) for _ in range(2000)])
+
+    asyncio.run(scenario())
+    stats = executor.stats()
+    assert stats["pending"] == 0
+    assert stats["running"] == 0